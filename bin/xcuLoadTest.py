@@ -0,0 +1,6 @@
+#!/usr/bin/env python
+
+from xcuActor import loadTest
+
+if __name__ == "__main__":
+    loadTest.main()
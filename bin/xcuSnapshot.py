@@ -0,0 +1,6 @@
+#!/usr/bin/env python
+
+from xcuActor import snapshot
+
+if __name__ == "__main__":
+    snapshot.main()
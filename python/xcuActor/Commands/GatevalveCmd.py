@@ -1,13 +1,15 @@
 #!/usr/bin/env python
 
 import logging
+import math
 import time
 
-import numpy as np
-
 import opscore.protocols.keys as keys
 import opscore.protocols.types as types
 
+from xcuActor import deadline
+from xcuActor import fanout
+
 class GateValveState(object):
     OPEN_CMD = 1 << 7
     TURBO_AT_SPEED = 1 << 6
@@ -18,12 +20,14 @@ class GateValveState(object):
     GATEVALVE_TIMEDOUT = 1 << 1
     GATEVALVE_SIGNAL = 1
 
+    __slots__ = ('state', 'gvMask', 'outsidePressure', 'insidePressure')
+
     def __init__(self, state, gvMask=0x00, pressures=None):
         if isinstance(state, str):
             state = int(state, base=2)
         self.state = state
         if pressures is None:
-            pressures = (np.nan, np.nan)
+            pressures = (math.nan, math.nan)
         self.setPressures(pressures)
         self.gvMask = gvMask
 
@@ -75,6 +79,10 @@ class GateValveState(object):
     def isBlocked(self):
         return self.request[0] != "OK"
 
+    def snapshotValues(self):
+        """ What we publish in the shared-memory snapshot: state bits, then inside and outside pressures. """
+        return self.state, self.insidePressure, self.outsidePressure
+
     def pressureDiff(self):
         """ Return the outside-inside pressure differernce. """
         return self.outsidePressure - self.insidePressure
@@ -162,10 +170,27 @@ class GatevalveCmd(object):
         self.dPressSoftLimit = 22  # The overridable pressure difference limit for opening, Torr
         self.dPressHardLimit = 22  # The absolute pressure difference limit for opening, Torr
 
+        # How long to wait for all the inputs to the gatevalve open checks, seconds.
+        self.openCheckTimeout = 7.0
+
+        # While waiting for the valve to move, the longest to go without asking the interlock board, seconds.
+        self.confirmInterval = 0.5
+
+        # The oldest roughing pump keys we accept without asking the rough actor for new ones, seconds.
+        self.roughKeysMaxAge = 5.0
+
+        # Resolved once, on first use.
+        self._roughName = None
+        self._roughNameResolved = False
         rougher = self.roughName
 
     @property
     def roughName(self):
+        """ The name of our roughing pump actor, or None if we ignore it. Its model is added once, here. """
+
+        if self._roughNameResolved:
+            return self._roughName
+
         sm = self.actor.ids.idDict['spectrograph']
         if sm in {1, 2}:
             roughName = 'rough1'
@@ -190,6 +215,9 @@ class GatevalveCmd(object):
 
         if roughName is not None and roughName not in self.actor.models:
             self.actor.addModels([roughName])
+
+        self._roughName = roughName
+        self._roughNameResolved = True
         return roughName
 
     @property
@@ -244,63 +272,109 @@ class GatevalveCmd(object):
 
         cmd.finish(f'text="dPressure limits are atm={self.atmThreshold} soft={self.dPressSoftLimit} hard={self.dPressHardLimit}"')
 
-    def _getDewarPressure(self, cmd):
-        state = self.interlockStatus(cmd)
-        dewarPressure = state.insidePressure
+    def _readRoughPump(self, roughName):
+        """ Return the roughing pump's (speed, errorMask, errors), from its actor's keys.
 
-        return dewarPressure
+        The rough actor's own monitoring usually keeps those keys current:
+        only ask it for new ones when they are not.
+        """
 
-    def _getRoughPressure(self, cmd):
-        state = self.interlockStatus(cmd)
-        roughPressure = state.outsidePressure
+        roughDict = self.actor.models[roughName].keyVarDict
+        roughKeys = ('pumpSpeed', 'pumpErrors')
+        freshness = self.actor.keyFreshness
+        freshness.watch(roughName, roughKeys)
 
-        return roughPressure
+        if not freshness.isFresh(roughName, roughKeys, maxAge=self.roughKeysMaxAge):
+            callVal = self.actor.cmdr.call(actor=roughName, cmdStr="gauge status",
+                                           timeLim=deadline.timeout(3, roughName, 'gauge status'))
+            if callVal.didFail:
+                raise RuntimeError('failed to get roughing gauge pressure')
+
+            callVal = self.actor.cmdr.call(actor=roughName, cmdStr="pump status",
+                                           timeLim=deadline.timeout(3, roughName, 'pump status'))
+            if callVal.didFail:
+                raise RuntimeError('failed to get roughing pump status')
+
+        # Check what the invalid values are!!!! CPLXXX
+        roughSpeed = roughDict['pumpSpeed'].getValue()
+        roughMask, roughErrors = roughDict['pumpErrors'].getValue()
+
+        return roughSpeed, roughMask, roughErrors
+
+    def _gatherOpenInputs(self, cmd, pcm, roughName):
+        """ Read everything _checkOpenable needs, concurrently and under one deadline.
+
+        Returns
+        -------
+        inputs : dict
+          name -> value, for each input which was read.
+        problems : list
+          one entry for each input which failed or timed out.
+        """
+
+        inputs = dict()
+        calls = dict(power=lambda: pcm.powerStatus(cmd=cmd),
+                     interlock=lambda: self.interlockStatus(cmd),
+                     turbo=lambda: self.actor.controllers['turbo'].speed(cmd))
+        if roughName is not None:
+            calls['rough'] = lambda: self._readRoughPump(roughName)
+
+        def keep(name, func):
+            def call():
+                inputs[name] = func()
+            return call
+
+        outcomes = fanout.fanOut({name: keep(name, func) for name, func in calls.items()},
+                                 self.openCheckTimeout)
+        cmd.inform(fanout.outcomesKey('gatevalveOpenInputs', outcomes))
+
+        problems = []
+        for o in outcomes.values():
+            if o.state == fanout.Outcome.TIMEDOUT:
+                problems.append(f'could not read {o.name} within {o.duration:0.2f}s')
+            elif o.state == fanout.Outcome.FAILED:
+                problems.append(f'could not read {o.name}: {o.error}')
+        return inputs, problems
 
     def _checkOpenable(self, cmd, atAtmosphere, dPressLimitFlexible):
         """ Check whether the gatevalve can be opened.
 
+        All the inputs are live or very recent reads, gathered at once. If
+        any of them cannot be read the valve cannot be opened.
+
         Returns
         -------
 
         errorString : str
-          "OK" if the valve can be opened, a useful striung otherwise.
+          "OK" if the valve can be opened, a list of problems otherwise.
 
         """
 
         try:
             pcm = self.actor.controllers['PCM']
         except KeyError:
-            return 'PCM controller is not connected'
+            return ['PCM controller is not connected']
 
-        powerMaskRaw = pcm.pcmCmd('~ge')
-        powerMask = int(powerMaskRaw[2:], base=2)
+        roughName = self.roughName
+        inputs, problems = self._gatherOpenInputs(cmd, pcm, roughName)
+        if problems:
+            return problems
+
+        powerMask = int(inputs['power'][2:], base=2)
         if not pcm.systemInPowerMask(powerMask, 'interlock'):
             return 'interlock board not powered up (by PCM)',
 
-        dewarPressure = self._getDewarPressure(cmd)
-
-        roughName = self.roughName
         if roughName is None:
-            roughPressure = self._getRoughPressure(cmd)
             roughSpeed = -9999
         else:
-            roughDict = self.actor.models[roughName].keyVarDict
-            callVal = self.actor.cmdr.call(actor=roughName, cmdStr="gauge status", timeLim=3)
-            if callVal.didFail:
-                return 'failed to get roughing gauge pressure',
-
-            callVal = self.actor.cmdr.call(actor=roughName, cmdStr="pump status", timeLim=3)
-            if callVal.didFail:
-                return 'failed to get roughing pump status',
-
-            # Check what the invalid values are!!!! CPLXXX
-            roughSpeed = roughDict['pumpSpeed'].getValue()
-            roughMask, roughErrors = roughDict['pumpErrors'].getValue()
-            roughPressure = self._getRoughPressure(cmd)
+            roughSpeed, roughMask, roughErrors = inputs['rough']
 
-        turboSpeed, turboStatus = self.actor.controllers['turbo'].speed(cmd)
-        # turboDict = self.actor.models[self.actor.name].keyVarDict
+        # Both pressures come from the same interlock reading.
+        state = inputs['interlock']
+        dewarPressure = state.insidePressure
+        roughPressure = state.outsidePressure
 
+        turboSpeed, turboStatus = inputs['turbo']
 
         problems = []
         if atAtmosphere:
@@ -386,21 +460,36 @@ class GatevalveCmd(object):
 
         self._doClose(cmd=cmd)
 
-    def _spinUntil(self, testFunc, starting=None, timeLimit=2.0, cmd=None):
-        """ Poll interlock state until success or timeout. """
+    def _waitUntil(self, testFunc, timeLimit=2.0, cmd=None):
+        """ Wait until the interlock state passes testFunc, or raise RuntimeError after timeLimit seconds.
 
-        pause = 0.2
-        lastState = starting
-        while timeLimit > 0:
+        We sleep until the gatevalve's ADIO bits change (the limit
+        switches), then confirm with the interlock board. We also check
+        every confirmInterval seconds, in case the board lags the switches.
+        """
+
+        endTime = time.monotonic() + timeLimit
+        lastState = None
+        while True:
             ret = self.getGatevalveStatus(cmd, silentIf=lastState)
             if testFunc(ret):
                 return ret
+            remaining = endTime - time.monotonic()
+            if remaining <= 0:
+                break
             lastState = ret.state
-            timeLimit -= pause
-            time.sleep(pause)
+            self.gatevalve.waitForChange(ret.gvMask, min(remaining, self.confirmInterval))
         cmd.warn(f"failed to get desired gate valve state. Timed out with: {ret.state:#08b})")
         raise RuntimeError()
 
+    def _reportTransition(self, cmd, position, requestTime):
+        """ Generate gatevalveMoved=position,switchTime,duration, if the switches changed since requestTime. """
+
+        stamp = self.gatevalve.lastChange
+        if stamp is None or stamp.wall < requestTime:
+            return
+        cmd.inform('gatevalveMoved=%s,%0.3f,%0.3f' % (position, stamp.wall, stamp.wall - requestTime))
+
     def _doOpen(self, cmd):
         state = self._doStatus(cmd, doFinish=False)
         if state.isBlocked():
@@ -411,8 +500,9 @@ class GatevalveCmd(object):
             return status.isOpen()
 
         try:
+            requestTime = time.time()
             self.gatevalve.request(True)
-            self._spinUntil(isOpen, cmd=cmd)
+            self._waitUntil(isOpen, cmd=cmd)
         except Exception as e:
             # cmd.warn(f'text="FAILED to open gatevalve: {e} -- commanding it to close"')
             self._doStatus(cmd)
@@ -420,23 +510,30 @@ class GatevalveCmd(object):
             cmd.fail(f'text="FAILED to open gatevalve; close it to re-enable opening"')
             return
 
+        self._reportTransition(cmd, 'open', requestTime)
         self._doStatus(cmd)
         cmd.finish()
 
     def _doClose(self, cmd, doFinish=True):
+        """ Close the gatevalve. Returns the final state, or None if the command was failed. """
+
         def isClosed(status):
             return status.isClosed()
 
         try:
+            requestTime = time.time()
             self.gatevalve.request(False)
-            self._spinUntil(isClosed, cmd=cmd)
+            self._waitUntil(isClosed, cmd=cmd)
         except Exception as e:
             cmd.fail(f'text="FAILED to close gatevalve!!!!! {e}"')
-            return
+            return None
 
-        self._doStatus(cmd)
+        self._reportTransition(cmd, 'closed', requestTime)
+
+        state = self._doStatus(cmd, doFinish=False)
         if doFinish:
             cmd.finish()
+        return state
 
     def _doStatus(self, cmd, doFinish=True):
         ret = self.interlockStatus(cmd)
@@ -457,14 +554,28 @@ class GatevalveCmd(object):
             cmd.inform(state.getStateKeys())
         return state
 
-    def interlockStatus(self, cmd):
-        """ Get status from the new interlock board. """
+    def interlockStatus(self, cmd, maxAge=0.0):
+        """ Get status from the new interlock board.
+
+        Args
+        ----
+        maxAge : `float`
+          if > 0, return the last reading if it is at most that many
+          seconds old. Keys are only generated for new readings.
+        """
 
-        state = self.getGatevalveStatus(cmd, silentIf=True)
+        return self.actor.readings.fetch('interlock.status',
+                                         lambda: self._readInterlockStatus(cmd),
+                                         maxAge=maxAge)
+
+    def _readInterlockStatus(self, cmd):
+        # The state bits and both pressures, from one exchange with the board.
+        rawStatus, pressuresRaw = self.interlock.sendCommandStrs(['gStat,all', 'gP,all'], cmd=cmd)
+        gvMask = self.gatevalve.getStatus()
+        state = GateValveState(rawStatus, gvMask=gvMask)
 
         # The new board returns pressures in mbar. The rest of the instrument uses Torr.
         # Convert here.
-        pressuresRaw = self.interlock.sendCommandStr('gP,all', cmd=cmd)
         pressures = [0.75*float(s) for s in pressuresRaw.split(',')]
         if any([p <= -10 for p in pressures]):
             cmd.warn('text="raw interlock board pressures are suspiciously low: %s"' % (pressures))
@@ -7,6 +7,8 @@ import opscore.protocols.keys as keys
 import opscore.protocols.types as types
 from opscore.utility.qstr import qstr
 
+from xcuActor import readingCache
+
 class GaugeCmd(object):
 
     def __init__(self, actor):
@@ -31,8 +33,10 @@ class GaugeCmd(object):
     def pcmPressure(self, cmd, doFinish=True):
         """ Fetch the latest pressure reading from the cryostat ion gauge. """
 
-        ret = self.actor.controllers['PCM'].gaugeRawCmd('rVac,torr', cmd=cmd)
+        ret, stamp = readingCache.sample(self.actor.controllers['PCM'].gaugeRawCmd, 'rVac,torr', cmd=cmd)
         ret = float(ret)
+        self.actor.readings.put('PCM.pressure', ret, stamp=stamp)
+        self.actor.readings.genTimesKey(cmd, 'pressure', 'PCM.pressure')
 
         if doFinish:
             cmd.finish('pressure=%g' % (ret))
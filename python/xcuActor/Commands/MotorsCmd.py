@@ -1,12 +1,13 @@
 #!/usr/bin/env python
 
-import numpy as np
-from astropy import time as astroTime
-
 import opscore.protocols.keys as keys
 import opscore.protocols.types as types
 from opscore.utility.qstr import qstr
 
+from xcuActor import timeUtils
+from xcuActor.lazyImport import LazyModule
+np = LazyModule('numpy')
+
 class MotorsCmd(object):
 
     # MOTOR PARAMETERS FOR INITIALIZATION used by initCcd
@@ -86,9 +87,10 @@ class MotorsCmd(object):
         self.a_microns_to_steps = self.stepsPerRev * self.pivotRatios[0] / self.leadScrewPitch
         self.b_microns_to_steps = self.stepsPerRev * self.pivotRatios[1] / self.leadScrewPitch
         self.c_microns_to_steps = self.stepsPerRev * self.pivotRatios[2] / self.leadScrewPitch
-        self.microns_to_steps = np.array([self.a_microns_to_steps,
-                                          self.b_microns_to_steps,
-                                          self.c_microns_to_steps])
+        # Plain tuples, like the fpa config: numpy is only imported when we first move.
+        self.microns_to_steps = (self.a_microns_to_steps,
+                                 self.b_microns_to_steps,
+                                 self.c_microns_to_steps)
         self.a_microns_to_microsteps = self.a_microns_to_steps * self.microstepping
         self.b_microns_to_microsteps = self.b_microns_to_steps * self.microstepping
         self.c_microns_to_microsteps = self.c_microns_to_steps * self.microstepping
@@ -97,9 +99,12 @@ class MotorsCmd(object):
 
         self.brokenLAMr1A = False
 
-        self.loadConfig()
+        # The config needs no device, so load it now. Fetching the motor
+        # status needs the PCM, so wait until that is attached.
+        self.loadConfig(doStatus=False, doReload=False)
+        self.actor.whenAttached('PCM', self.loadStatus)
 
-    def loadConfig(self, cmd=None):
+    def loadConfig(self, cmd=None, doStatus=True, doReload=True):
         if cmd is None:
             cmd = self.actor.bcast
 
@@ -107,18 +112,28 @@ class MotorsCmd(object):
         self.tilts = 0.0,0.0,0.0
         self.focus = 0.0
 
-        self.actor.actorConfig.reload()
+        if doReload:
+            self.actor.actorConfig.reload()
         cfg = self.actor.actorConfig['fpa']
 
-        self.range = np.array(cfg['range'])
+        self.range = tuple(cfg['range'])
         self.focus = cfg['focus']
         self.medFocus = cfg.get('medFocus', None)
-        self.tilts = np.array(cfg['tilts'])
+        self.tilts = tuple(cfg['tilts'])
 
         cmd.inform(f'fpaTilt={self.tilts[0]:0.2f},{self.tilts[1]:0.2f},{self.tilts[2]:0.2f}')
         cmd.inform(f'fpaRange={self.range[0]:0.2f},{self.range[1]:0.2f},{self.range[2]:0.2f}')
         cmd.inform(f'fpaBestFocus={self.focus:0.2f},{self.medFocus}')
 
+        if doStatus:
+            self.loadStatus(cmd)
+
+    def loadStatus(self, cmd=None):
+        """ Fetch and validate the motor status, complaining if we cannot. """
+
+        if cmd is None:
+            cmd = self.actor.bcast
+
         try:
             self.initializeStatus(cmd)
         except Exception as e:
@@ -138,7 +153,7 @@ class MotorsCmd(object):
         b += spectral
         c -= spectral
 
-        self.tilts = np.array([a,b,c])
+        self.tilts = (a,b,c)
         cmd.finish(f'fpaTilt={self.tilts[0]:0.2f},{self.tilts[1]:0.2f},{self.tilts[2]:0.2f}')
 
     def setArmOffsets(self, cmd):
@@ -149,7 +164,7 @@ class MotorsCmd(object):
         b = cmdKeys['b'].values[0] if 'b' in cmdKeys else self.tilts[1]
         c = cmdKeys['c'].values[0] if 'c' in cmdKeys else self.tilts[2]
 
-        self.tilts = np.array([a,b,c])
+        self.tilts = (a,b,c)
         cmd.finish(f'fpaTilt={self.tilts[0]:0.2f},{self.tilts[1]:0.2f},{self.tilts[2]:0.2f}')
 
     def initializeStatus(self, cmd=None):
@@ -356,7 +371,7 @@ class MotorsCmd(object):
         """
 
         # Use MJD seconds.
-        now = float(astroTime.Time.now().mjd)
+        now = timeUtils.mjdNow()
 
         keys = dict(motorMovedMjd=now,
                     motorPositions=self._getCorrectedPosition(cmd).tolist())
@@ -851,8 +866,8 @@ class MotorsCmd(object):
     def _moveFocus(self, cmd, newFocus):
         """Move to given focus position, applying the tilt calibrations."""
 
-        netMove = newFocus + self.tilts
-        netSteps = np.round(netMove * self.microns_to_steps)
+        netMove = newFocus + np.array(self.tilts)
+        netSteps = np.round(netMove * np.array(self.microns_to_steps))
 
         cmd.inform(f'text="moving focus to {newFocus} and {self.tilts} -> {netMove}"')
         self._moveCcd(cmd, *netSteps, absMove=True)
@@ -890,7 +905,7 @@ class MotorsCmd(object):
             for ax in _axes:
                 moveArgs[ax] = self.stepsNearLimit
         elif 'toCenter' or 'nearFar' in cmdKeys:
-            far = (self.range * self.microns_to_steps).astype('int')
+            far = (np.array(self.range) * np.array(self.microns_to_steps)).astype('int')
             if np.any(far <= 0):
                 cmd.fail(f'text="far limit position for axis {ax} is not known"')
                 return
@@ -60,6 +60,8 @@ class PcmCmd(object):
                                                  help='new firmware file name'),
                                         )
 
+        # How old a power status reading we accept for reporting, in seconds.
+        self.powerStatusMaxAge = 1.0
 
     def pcmRaw(self, cmd):
         """ Send a raw command to the PCM controller. """
@@ -185,7 +187,9 @@ class PcmCmd(object):
 
         volts = [float(v) for v in rawVolts.split(b',')]
         amps = [float(a) for a in rawAmps.split(b',')]
-        states = [c for c in self.actor.controllers['PCM'].pcmCmd('~ge', cmd=cmd).decode('latin-1')]
+        # getPowerStatus has usually just read this.
+        powerStatus = self.actor.controllers['PCM'].powerStatus(maxAge=self.powerStatusMaxAge, cmd=cmd)
+        states = [c for c in powerStatus.decode('latin-1')]
 
         cmd.diag('text="states: %s"' % (states))
 
@@ -260,12 +264,12 @@ class PcmCmd(object):
            none.
         """
       
-        cmdStr = "~ge"
-        ret = self.actor.controllers['PCM'].pcmCmd(cmdStr, cmd=cmd)
+        ret = self.actor.controllers['PCM'].powerStatus(cmd=cmd)
         if ret is None:
             cmd.fail('text="failed to execute getStatus command"')
             return
         binVal = self.powerMasktoInt(ret.decode('latin-1'))
+        self.actor.readings.put('PCM.powerMask', binVal)
         cmd.inform("powerMask=0x%02x; poweredUp=%s" % (binVal,
                                                        self.getPoweredNames(binVal)))    
         self.getPowerState(cmd)
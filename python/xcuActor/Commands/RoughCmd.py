@@ -8,6 +8,8 @@ import opscore.protocols.types as types
 from opscore.utility.qstr import qstr
 
 class RoughCmd(object):
+    # Our handlers take the controller name from the command verb.
+    controllerFromVerb = True
 
     def __init__(self, actor):
         # This lets us access the rest of the actor.
@@ -2,12 +2,15 @@
 
 import logging
 
-import numpy as np
-
 import opscore.protocols.keys as keys
 import opscore.protocols.types as types
 from opscore.utility.qstr import qstr
 
+from xcuActor import readingCache
+from xcuActor import records
+from xcuActor.lazyImport import LazyModule
+np = LazyModule('numpy')
+
 class TempsCmd(object):
 
     def __init__(self, actor):
@@ -25,6 +28,8 @@ class TempsCmd(object):
             ('temps', 'status [<channel>]', self.getTemps),
             ('temps', 'test1', self.test1),
             ('temps', 'test2', self.test2),
+            ('temps', 'cooldown status', self.cooldownStatus),
+            ('temps', 'cooldown reset', self.cooldownReset),
             ('HPheaters', '@(on|off) @(shield|spreader)', self.HPheaters),
             ('heaters', '@(ccd|h4|asic) <power>', self.heaterToPower),
             ('heaters', '@(ccd|h4|asic) <temp>', self.heaterToTemp),
@@ -75,11 +80,16 @@ class TempsCmd(object):
             cmd.fail('text="invalid cahnnel specified"')
         else:
             cmdStr = "?K%d" % (channelID)
-        ret = self.actor.controllers['temps'].tempsCmd(cmdStr, cmd=cmd) 
+        ret, stamp = readingCache.sample(self.actor.controllers['temps'].tempsCmd, cmdStr, cmd=cmd)
 
         if channelID is None:
             ender = cmd.finish if doFinish else cmd.inform
             temps = ret.split(',')
+            try:
+                self.actor.readings.put('temps.temps', records.Temps(*[float(t) for t in temps]),
+                                        stamp=stamp)
+            except (TypeError, ValueError):
+                cmd.warn('text=%s' % (qstr('unparseable temps reply: %s' % (ret))))
             if self.actor.ids.arm in 'brm':
                 # Was 0,1,2,... See INSTRM-1147
                 # had to actually change actorkeys ordering
@@ -277,11 +287,24 @@ class TempsCmd(object):
         """ Return all status keywords. """
         
         temps = self.actor.controllers['temps'].fetchTemps(cmd=cmd)
+        self.actor.readings.genTimesKey(cmd, 'temps', 'temps.temps')
         ender = cmd.finish if doFinish else cmd.inform
         ender('temps=%s' % ', '.join(['%0.4f' % (t) for t in temps]))
 
         return temps
     
+    def cooldownStatus(self, cmd):
+        """ Report cooling rates (coolRates, K/h) and times to target (coolEta, s) for all channels. """
+
+        self.actor.cooldown.genKeys(cmd)
+        cmd.finish()
+
+    def cooldownReset(self, cmd):
+        """ Forget the cooling rate fits. """
+
+        self.actor.cooldown.reset()
+        cmd.finish('text="cooldown fits reset"')
+
     def test2(self, cmd):
         """Test readings against dewar feedthrough test pack. 
 
@@ -316,7 +339,7 @@ class TempsCmd(object):
 
         try:
             coolerStat = self.actor.controllers['cooler'].status(cmd=cmd)
-            coolerTemp = coolerStat[-2]
+            coolerTemp = coolerStat.tipTemp
             if abs(coolerTemp - coolerTestData) >= 0.5:
                 errs.append('coolerTip: read=%0.2f, ref=%0.2f' % (coolerTemp, coolerTestData))
         except Exception as e:
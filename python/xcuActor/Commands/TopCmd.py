@@ -1,12 +1,22 @@
 #!/usr/bin/env python
 
 from builtins import object
+import time
 import opscore.protocols.keys as keys
 import opscore.protocols.types as types
 from opscore.utility.qstr import qstr
 
+from xcuActor import fanout
+from xcuActor.snapshot import snapshotValues
+
 class TopCmd(object):
 
+    # The commands which refresh a controller's "<controller>." readings, when not "<controller> status".
+    snapshotCommands = dict(PCM=(('gauge', 'status'), ('power', 'status')))
+
+    # The default oldest reading snapshot accepts, seconds.
+    snapshotMaxAge = 10.0
+
     def __init__(self, actor):
         # This lets us access the rest of the actor.
         self.actor = actor
@@ -18,10 +28,13 @@ class TopCmd(object):
         #
         self.vocab = [
             ('ping', '', self.ping),
-            ('status', '[@all]', self.status),
+            ('status', '[@all] [@readings] [<timeout>]', self.status),
+            ('snapshot', '[<maxAge>]', self.snapshot),
             ('connect', '<controller> [<name>]', self.connect),
             ('disconnect', '<controller>', self.disconnect),
             ('monitor', '<controllers> <period>', self.monitor),
+            ('watchdog', 'status', self.watchdogStatus),
+            ('watchdog', 'close <activity>', self.watchdogClose),
          ]
 
         # Define typed command arguments for the above commands.
@@ -34,6 +47,12 @@ class TopCmd(object):
                                                  help='the names a controller.'),
                                         keys.Key("period", types.Int(),
                                                  help='the period to sample at.'),
+                                        keys.Key("activity", types.Int(),
+                                                 help='the id of a running device activity, from watchdog status.'),
+                                        keys.Key("timeout", types.Float(),
+                                                 help='seconds to wait for all controller status.'),
+                                        keys.Key("maxAge", types.Float(),
+                                                 help='the oldest cached reading to accept, seconds.'),
                                         )
 
     def monitor(self, cmd):
@@ -83,6 +102,7 @@ class TopCmd(object):
                 cmd.fail('text="failed to connect controller %s: %s"' % (instanceName,
                                                                          e))
                 return
+        self.actor.runAttachCallbacks(instanceName)
 
         cmd.finish(self.controllerKey())
         
@@ -98,6 +118,23 @@ class TopCmd(object):
             return
         cmd.finish(self.controllerKey())
 
+    def watchdogStatus(self, cmd):
+        """ List all running device transactions and commands. """
+
+        self.actor.watchdog.genKeys(cmd)
+        cmd.finish()
+
+    def watchdogClose(self, cmd):
+        """ Force-close the device under a stuck transaction, to unblock its thread. """
+
+        activity = cmd.cmd.keywords['activity'].values[0]
+        try:
+            self.actor.watchdog.close(activity, cmd=cmd)
+        except Exception as e:
+            cmd.fail('text=%s' % (qstr(f'failed to close activity {activity}: {e}')))
+            return
+        cmd.finish()
+
     def ping(self, cmd):
         """Query the actor for liveness/happiness."""
 
@@ -105,7 +142,11 @@ class TopCmd(object):
         cmd.finish("text='Present and (probably) well'")
 
     def status(self, cmd):
-        """Report camera status and actor version. """
+        """Report camera status and actor version.
+
+        With readings, also report the reading cache, key freshness, and
+        each controller's circuit breaker and coalesced queries.
+        """
 
         self.actor.sendVersionKey(cmd)
 
@@ -114,10 +155,113 @@ class TopCmd(object):
         cmd.inform('text="config id=0x%08x %r"' % (id(self.actor.actorConfig),
                                                    self.actor.actorConfig.keys()))
         self.actor.cryoMode.genKeys(cmd)
+        self.actor.genControllerKeys(cmd)
+        if 'readings' in cmd.cmd.keywords:
+            self.readingsStatus(cmd)
 
         if 'all' in cmd.cmd.keywords:
-            for c in self.actor.controllers:
-                self.actor.callCommand("%s status" % (c))
+            if 'timeout' in cmd.cmd.keywords:
+                timeout = cmd.cmd.keywords['timeout'].values[0]
+            else:
+                timeout = self.statusTimeout()
+            self.statusAll(cmd, timeout)
 
         cmd.finish(self.controllerKey())
 
+    def readingsStatus(self, cmd):
+        self.actor.readings.genKeys(cmd)
+        self.actor.keyFreshness.genKeys(cmd)
+        for c in list(self.actor.controllers.values()):
+            breaker = getattr(c, 'breaker', None)
+            if breaker is not None:
+                breaker.genKeys(cmd)
+            flights = getattr(c, 'flights', None)
+            if flights is not None:
+                flights.genKeys(cmd)
+
+    def statusTimeout(self):
+        try:
+            return float(self.actor.actorConfig['controllers']['statusTimeout'])
+        except Exception:
+            return 10.0
+
+    def controllerLocks(self, name):
+        """ Return the locks a fan-out handler for controller name holds: its breaker's ioLock, if any. """
+
+        breaker = getattr(self.actor.controllers.get(name), 'breaker', None)
+        return [breaker.ioLock] if breaker is not None else []
+
+    def statusAll(self, cmd, timeout):
+        """ Run all controller status commands concurrently, waiting at most timeout seconds.
+
+        Generates statusAll=nOK,nFailed,nTimedOut,wallTime and
+        statusAllTimes=name,state,duration,... for each controller.
+        """
+
+        handlers = dict()
+        locks = dict()
+        for c in list(self.actor.controllers):
+            verb, handler = fanout.findHandler(self.actor, c, 'status')
+            if handler is None:
+                cmd.diag('text="no status command for %s"' % (c))
+                continue
+            handlers[c] = (verb, handler)
+            locks[c] = self.controllerLocks(c)
+        handlers, locks = fanout.uniqueHandlers(handlers, locks)
+
+        t0 = time.time()
+        outcomes = fanout.runHandlers(cmd, handlers, timeout, locks=locks)
+        wallTime = time.time() - t0
+
+        states = [o.state for o in outcomes.values()]
+        fanout.warnAboutOutcomes(cmd, outcomes)
+        cmd.inform(fanout.outcomesKey('statusAllTimes', outcomes))
+        cmd.inform('statusAll=%d,%d,%d,%0.3f' % (states.count(fanout.Outcome.OK),
+                                                 (states.count(fanout.Outcome.FAILED)
+                                                  + states.count(fanout.Outcome.BUSY)),
+                                                 states.count(fanout.Outcome.TIMEDOUT),
+                                                 wallTime))
+
+    def snapshot(self, cmd):
+        """ Report every device's latest reading, refreshing only those older than maxAge seconds.
+
+        Readings come from the actor's reading cache. Groups of readings
+        which are missing or too old are refreshed by running their
+        controllers' status commands concurrently, so the command takes
+        about as long as the slowest of those devices. Generates
+        snapshotReading=name,age,values... for every cached reading, then
+        snapshot=nReadings,nRefreshed,nFailed,wallTime.
+        """
+
+        cmdKeys = cmd.cmd.keywords
+        maxAge = cmdKeys['maxAge'].values[0] if 'maxAge' in cmdKeys else self.snapshotMaxAge
+
+        t0 = time.time()
+        cached = self.actor.readings.items()
+        handlers = dict()
+        locks = dict()
+        for controller in list(self.actor.controllers):
+            ages = [r.age for name, r in cached if name.startswith(f'{controller}.')]
+            if ages and max(ages) <= maxAge:
+                continue
+            for verb, subVerb in self.snapshotCommands.get(controller, ((controller, 'status'),)):
+                cmdVerb, handler = fanout.findHandler(self.actor, verb, subVerb)
+                if handler is None:
+                    cmd.diag('text="no %s %s command to refresh %s"' % (verb, subVerb, controller))
+                    continue
+                handlers[f'{verb} {subVerb}'] = (cmdVerb, handler)
+                locks.setdefault(f'{verb} {subVerb}', []).extend(self.controllerLocks(controller))
+        handlers, locks = fanout.uniqueHandlers(handlers, locks)
+
+        outcomes = (fanout.runHandlers(cmd, handlers, self.statusTimeout(), locks=locks)
+                    if handlers else dict())
+        fanout.warnAboutOutcomes(cmd, outcomes)
+        nFailed = sum(1 for o in outcomes.values() if o.state != fanout.Outcome.OK)
+
+        readings = sorted(self.actor.readings.items())
+        for name, reading in readings:
+            values = snapshotValues(reading.value) or ()
+            cmd.inform('snapshotReading=%s,%0.3f%s' % (qstr(name), reading.age,
+                                                       ''.join([',%g' % (v) for v in values])))
+        cmd.finish('snapshot=%d,%d,%d,%0.3f' % (len(readings), len(handlers), nFailed,
+                                                time.time() - t0))
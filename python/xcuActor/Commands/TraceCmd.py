@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+from builtins import object
+
+import opscore.protocols.keys as keys
+import opscore.protocols.types as types
+from opscore.utility.qstr import qstr
+
+class TraceCmd(object):
+
+    def __init__(self, actor):
+        # This lets us access the rest of the actor.
+        self.actor = actor
+
+        # Declare the commands we implement. When the actor is started
+        # these are registered with the parser, which will call the
+        # associated methods when matched. The callbacks will be
+        # passed a single argument, the parsed and typed command.
+        #
+        self.vocab = [
+            ('trace', '<device> dump [<n>]', self.dump),
+            ('trace', '<device> @(verbose|quiet)', self.setVerbose),
+            ('trace', '<device> clear', self.clear),
+        ]
+
+        # Define typed command arguments for the above commands.
+        self.keys = keys.KeysDictionary("xcu_trace", (1, 1),
+                                        keys.Key("device", types.String(),
+                                                 help='the name of a connected controller'),
+                                        keys.Key("n", types.Int(),
+                                                 help='number of exchanges to show'),
+                                        )
+
+    def _getTrace(self, cmd):
+        device = cmd.cmd.keywords['device'].values[0]
+        try:
+            controller = self.actor.controllers[device]
+        except KeyError:
+            cmd.fail('text=%s' % (qstr(f'{device} is not a connected controller')))
+            return None
+
+        trace = getattr(controller, 'trace', None)
+        if trace is None:
+            cmd.fail('text=%s' % (qstr(f'{device} does not keep an I/O trace')))
+        return trace
+
+    def dump(self, cmd):
+        """ Show the last n (default all) raw exchanges with a device. """
+
+        trace = self._getTrace(cmd)
+        if trace is None:
+            return
+
+        cmdKeys = cmd.cmd.keywords
+        n = cmdKeys['n'].values[0] if 'n' in cmdKeys else None
+        nLines = trace.dump(cmd, n=n)
+        cmd.finish('text="%d exchanges from %s"' % (nLines, trace.name))
+
+    def setVerbose(self, cmd):
+        """ Turn the per-transaction diag and log lines for a device on (verbose) or off (quiet). """
+
+        trace = self._getTrace(cmd)
+        if trace is None:
+            return
+
+        trace.verbose = 'verbose' in cmd.cmd.keywords
+        cmd.finish('text="%s I/O is %s"' % (trace.name,
+                                           'verbose' if trace.verbose else 'quiet'))
+
+    def clear(self, cmd):
+        """ Empty a device's trace ring. """
+
+        trace = self._getTrace(cmd)
+        if trace is None:
+            return
+
+        trace.clear()
+        cmd.finish()
@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+
+import logging
+import time
+
+import opscore.protocols.keys as keys
+import opscore.protocols.types as types
+from opscore.utility.qstr import qstr
+
+from xcuActor import deadline
+from xcuActor import readingCache
+from xcuActor.lazyImport import LazyModule
+np = LazyModule('numpy')
+
+def fitRise(t, p):
+    """ Fit a rate-of-rise pressure curve, by linear least squares.
+
+    Fits both p = a + b*t (a pure leak: constant throughput into a
+    closed volume) and p = a + b*t + c*t^2. Outgassing falls off as the
+    surfaces are exhausted, so a curve which flattens out over the test
+    points to outgassing, and a straight one to a leak.
+
+    Args
+    ----
+    t : `np.ndarray`
+      sample times, seconds from the start of the test.
+    p : `np.ndarray`
+      pressures, Torr.
+
+    Returns
+    -------
+    rate : `float`
+      the linear rate of rise, Torr/s
+    rateErr : `float`
+      the 1-sigma error on rate.
+    r2 : `float`
+      the coefficient of determination of the linear fit.
+    slopeRatio : `float`
+      the slope at the end of the test over the slope at the start, from
+      the quadratic fit. ~1 for a leak, << 1 for outgassing.
+    """
+
+    n = len(t)
+    A = np.column_stack((np.ones(n), t))
+    coeffs = np.linalg.lstsq(A, p, rcond=None)[0]
+    resid = p - A @ coeffs
+    ssr = float(resid @ resid)
+    sst = float(((p - p.mean())**2).sum())
+    r2 = 1.0 - ssr/sst if sst > 0 else 0.0
+
+    sigma2 = ssr / max(n - 2, 1)
+    cov = sigma2 * np.linalg.inv(A.T @ A)
+    rate = float(coeffs[1])
+    rateErr = float(np.sqrt(cov[1, 1]))
+
+    slopeRatio = np.nan
+    if n >= 4:
+        A2 = np.column_stack((A, t*t))
+        _, b, c = np.linalg.lstsq(A2, p, rcond=None)[0]
+        if b != 0:
+            slopeRatio = float((b + 2*c*t[-1]) / b)
+
+    return rate, rateErr, r2, slopeRatio
+
+class VacuumCmd(object):
+
+    def __init__(self, actor):
+        # This lets us access the rest of the actor.
+        self.actor = actor
+        self.logger = logging.getLogger('vacuum')
+
+        # Declare the commands we implement. When the actor is started
+        # these are registered with the parser, which will call the
+        # associated methods when matched. The callbacks will be
+        # passed a single argument, the parsed and typed command.
+        #
+        self.vocab = [
+            ('vacuum', 'leakTest [<duration>] [<rate>]', self.leakTest),
+            ('vacuum', 'pumpdown status', self.pumpdownStatus),
+            ('vacuum', 'pumpdown reset', self.pumpdownReset),
+            ('vacuum', 'pumps status', self.pumpsStatus),
+            ('vacuum', 'pumps reset', self.pumpsReset),
+        ]
+
+        # Define typed command arguments for the above commands.
+        self.keys = keys.KeysDictionary("xcu_vacuum", (1, 1),
+                                        keys.Key("duration", types.Float(),
+                                                 help='seconds to watch the pressure rise for'),
+                                        keys.Key("rate", types.Float(),
+                                                 help='pressure samples per second'),
+                                        )
+
+        # Leak test limits, Torr. We want to start from a good vacuum, and the gauge
+        # must not leave its high-vacuum range during the test.
+        self.leakTestMaxStart = 1e-3
+        self.leakTestMaxPressure = 1e-1
+
+        # Leak test durations, seconds. The test holds its command thread throughout.
+        self.leakTestDuration = 60.0
+        self.leakTestMaxDuration = 600.0
+
+        # Slopes at the end of the test over the slopes at the start, for the verdict.
+        self.leakSlopeRatio = 0.8
+        self.outgassingSlopeRatio = 0.3
+
+    @property
+    def config(self):
+        try:
+            return self.actor.actorConfig['vacuum']
+        except Exception:
+            return dict()
+
+    @property
+    def gatevalveCmd(self):
+        return self.actor.commandSets['GatevalveCmd']
+
+    def _readGauge(self, cmd):
+        """ Return the cryostat gauge pressure, in Torr, and the Stamp of the read. """
+
+        pcm = self.actor.controllers['PCM']
+        ret, stamp = readingCache.sample(pcm.gaugeRawCmd, 'rVac,torr', cmd=cmd)
+        pressure = float(ret)
+        self.actor.readings.put('PCM.pressure', pressure, stamp=stamp)
+        return pressure, stamp
+
+    def _leakTestCheck(self, cmd):
+        """ Check that a leak test makes sense now. Returns "OK" or the reason why not. """
+
+        for c in 'PCM', 'interlock', 'gatevalve':
+            if c not in self.actor.controllers:
+                return f'{c} controller is not connected'
+
+        state = self.gatevalveCmd.interlockStatus(cmd)
+        if state.position[0] != 'OK':
+            return f'gatevalve position is {state.position[1]}'
+        if state.isBlocked() and not state.isClosed():
+            return f'gatevalve request is {state.request[1]}'
+
+        pressure, _ = self._readGauge(cmd)
+        maxStart = float(self.config.get('leakTestMaxStart', self.leakTestMaxStart))
+        if not pressure < maxStart:
+            return f'cryostat pressure {pressure:g} is above {maxStart:g} Torr'
+
+        return 'OK'
+
+    def _verdict(self, slopeRatio):
+        if not np.isfinite(slopeRatio):
+            return 'unknown'
+        if slopeRatio >= self.leakSlopeRatio:
+            return 'leak'
+        if slopeRatio <= self.outgassingSlopeRatio:
+            return 'outgassing'
+        return 'mixed'
+
+    def _leakValues(self, rate, rateErr, r2, slopeRatio):
+        volume = self.config.get('volume', None)
+        throughput = rate * float(volume) if volume is not None else np.nan
+        return (rate, rateErr, r2, slopeRatio, throughput)
+
+    def leakTest(self, cmd):
+        """ Close the gatevalve and fit the cryostat pressure rise.
+
+        Samples the cryostat gauge <rate> times a second (default 2) for
+        <duration> seconds (default leakTestDuration, 60), generating a
+        leakTestFit key every reportInterval seconds, then
+        leakTest=rate,rateErr,r2,slopeRatio,throughput,verdict. rate is
+        in Torr/s; throughput is in Torr l/s if the cryostat volume is
+        configured. The gatevalve is left closed.
+
+        The test ends with a verdict only when it runs to completion or
+        the pressure passes leakTestMaxPressure. If the command runs out
+        of time or the gauge cannot be read, the command fails.
+        """
+
+        cmdKeys = cmd.cmd.keywords
+        duration = (cmdKeys['duration'].values[0] if 'duration' in cmdKeys
+                    else float(self.config.get('leakTestDuration', self.leakTestDuration)))
+        rate = cmdKeys['rate'].values[0] if 'rate' in cmdKeys else 2.0
+        if duration <= 0 or rate <= 0:
+            cmd.fail('text="duration and rate must be positive"')
+            return
+        maxDuration = float(self.config.get('leakTestMaxDuration', self.leakTestMaxDuration))
+        if duration > maxDuration:
+            cmd.fail('text="duration must be at most %g s"' % (maxDuration))
+            return
+        budget = deadline.current()
+        if budget is not None and budget.remaining < duration:
+            cmd.fail('text="duration %g s is longer than the %0.1f s left for this command"' %
+                     (duration, budget.remaining))
+            return
+
+        reason = self._leakTestCheck(cmd)
+        if reason != 'OK':
+            cmd.fail('text=%s' % (qstr(f'cannot run leak test: {reason}')))
+            return
+
+        state = self.gatevalveCmd._doClose(cmd, doFinish=False)
+        if state is None:
+            return
+
+        maxPressure = float(self.config.get('leakTestMaxPressure', self.leakTestMaxPressure))
+        reportInterval = float(self.config.get('leakTestReportInterval', 10.0))
+        nSamples = int(duration * rate) + 1
+        t = np.zeros(nSamples, dtype='f8')
+        p = np.zeros(nSamples, dtype='f8')
+
+        period = 1.0 / rate
+        start = time.monotonic()
+        nextReport = start + reportInterval
+        n = 0
+        try:
+            for i in range(nSamples):
+                deadline.check('vacuum', 'leakTest')
+                delay = start + i*period - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+                pressure, stamp = self._readGauge(cmd)
+                t[n] = stamp.mono - start
+                p[n] = pressure
+                n += 1
+
+                if pressure > maxPressure:
+                    cmd.warn('text="stopping leak test: pressure %g is above %g Torr"' % (pressure,
+                                                                                     maxPressure))
+                    break
+                if n >= 3 and time.monotonic() >= nextReport:
+                    nextReport += reportInterval
+                    fit = fitRise(t[:n], p[:n])
+                    cmd.inform('leakTestFit=%d,%0.1f,%g,%g,%0.4f,%0.3f' % ((n, t[n-1]) + fit))
+        except Exception as e:
+            self.logger.warning('leak test failed after %d samples: %s', n, e)
+            cmd.fail('text=%s' % (qstr(f'leak test failed after {n} samples: {e}; gatevalve left closed')))
+            return
+
+        if n < 3:
+            cmd.fail('text="leak test got too few samples to fit; gatevalve left closed"')
+            return
+
+        fit = fitRise(t[:n], p[:n])
+        verdict = self._verdict(fit[3])
+        cmd.inform('leakTestSamples=%d,%0.1f,%g,%g' % (n, t[n-1], p[0], p[n-1]))
+        cmd.finish('leakTest=%g,%g,%0.4f,%0.3f,%g,%s; text="gatevalve left closed"' %
+                   (self._leakValues(*fit) + (verdict,)))
+
+    def pumpdownStatus(self, cmd):
+        """ Report the pumpdown predictions: pumpdownEta=threshold,seconds for each threshold, and any stall. """
+
+        if self.actor.pumpdown.nSamples == 0:
+            cmd.finish('text="no cryostat pressures seen yet"')
+            return
+        self.actor.pumpdown.genKeys(cmd)
+        cmd.finish()
+
+    def pumpdownReset(self, cmd):
+        """ Start following a new pumpdown from the next pressure reading. """
+
+        self.actor.pumpdown.reset()
+        cmd.finish('text="pumpdown fit reset"')
+
+    def pumpsStatus(self, cmd):
+        """ Report the turbo and roughing pump drift detectors: a pumpDrift key per learned series. """
+
+        self.actor.pumpHealth.genKeys(cmd)
+        cmd.finish()
+
+    def pumpsReset(self, cmd):
+        """ Forget the pump baselines, e.g. after servicing a pump. """
+
+        self.actor.pumpHealth.reset()
+        cmd.finish('text="pump baselines will be relearned"')
@@ -1,11 +1,13 @@
-from importlib import reload
-
 import logging
 import socket
 import time
 
+from xcuActor import deadline
+from xcuActor import watchdog
+from xcuActor.Controllers import circuitBreaker
+from xcuActor.Controllers import traceRing
+from xcuActor.Controllers import singleFlight
 from xcuActor.Controllers import idgPfeiffer
-reload(idgPfeiffer)
 
 class PCM(object):
     powerPorts = ('motors', 'gauge', 'cooler', 'temps',
@@ -30,48 +32,69 @@ class PCM(object):
         self.gauge = idgPfeiffer.Pfeiffer(self.name)
         self.logger.warn('gauge=%s,%s', 'new', self.gauge)
 
+        self.trace = traceRing.TraceRing.fromConfig(actor, self.name)
+        self.breaker = circuitBreaker.CircuitBreaker.fromConfig(actor, self.name, trace=self.trace,
+                                                                probe=lambda: self.sendOneCommand('~ge'))
+        self.flights = singleFlight.SingleFlight(self.name)
+
     def start(self, cmd=None):
         pass
 
     def stop(self, cmd=None):
         pass
 
+    # Queries which do not change anything, and so can be shared by concurrent callers.
+    readOnlyPrefixes = (b'~ge', b'~rdV', b'~rdC', b'~gStatus')
+
     def sendOneCommand(self, cmdStr, timeout=2.0, cmd=None):
         try:
             cmdStr = cmdStr.encode('latin-1')
         except AttributeError:
             pass
-        
-        fullCmd = b"%s%s" % (cmdStr, self.EOL)
-        self.logger.debug('sending %r', cmdStr)
-        if cmd is not None:
-            cmd.diag('text="sending %r"' % (cmdStr))
 
-        try:
-            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            s.settimeout(timeout)
-        except socket.error as e:
-            self.logger.error('text="failed to create socket to PCM: %s"' % (e))
-            raise
- 
-        try:
-            s.connect((self.host, self.port))
-            s.sendall(fullCmd)
-        except socket.error as e:
-            self.logger.error('text="failed to create connect or send to PCM: %s"' % (e))
-            raise
+        if cmdStr.startswith(self.readOnlyPrefixes):
+            return self.flights.do(cmdStr,
+                                   lambda: self._sendOneCommand(cmdStr, timeout=timeout, cmd=cmd))
+        return self._sendOneCommand(cmdStr, timeout=timeout, cmd=cmd)
 
-        try:
-            ret = s.recv(1024)
-        except socket.error as e:
-            self.logger.error('text="failed to read response from PCM: %s"' % (e))
-            raise
+    def _sendOneCommand(self, cmdStr, timeout=2.0, cmd=None):
+        fullCmd = b"%s%s" % (cmdStr, self.EOL)
+        self.trace.send(cmdStr)
+        if self.trace.verbose:
+            self.logger.debug('sending %r', cmdStr)
+            if cmd is not None:
+                cmd.diag('text="sending %r"' % (cmdStr))
+
+        with self.breaker.transaction(step=cmdStr.decode('latin-1')), \
+             watchdog.track(self.actor, self.name, closer=lambda: watchdog.shutdownSocket(s)):
+            try:
+                s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                s.settimeout(deadline.timeout(timeout, self.name, cmdStr.decode('latin-1')))
+            except socket.error as e:
+                self.logger.error('text="failed to create socket to PCM: %s"' % (e))
+                raise
 
-        self.logger.debug('received: %r', ret)
-        s.close()
+            try:
+                s.connect((self.host, self.port))
+                s.sendall(fullCmd)
+            except socket.error as e:
+                self.logger.error('text="failed to create connect or send to PCM: %s"' % (e))
+                s.close()
+                raise
 
-        if cmd is not None:
-            cmd.diag('text="received %r"' % (ret))
+            try:
+                ret = s.recv(1024)
+            except socket.error as e:
+                self.logger.error('text="failed to read response from PCM: %s"' % (e))
+                raise
+            finally:
+                s.close()
+
+        self.trace.recv(ret)
+        if self.trace.verbose:
+            self.logger.debug('received: %r', ret)
+            if cmd is not None:
+                cmd.diag('text="received %r"' % (ret))
             
         if ret.startswith(b'Error:'):
             raise RuntimeError('Error reading or writing: %s' % (ret))
@@ -88,7 +111,39 @@ class PCM(object):
             cmd.inform('powerNames=%s' % (self.powerPorts))
             
     def pcmCmd(self, cmdStr, timeout=None, cmd=None):
+        checkStr = cmdStr.decode('latin-1') if isinstance(cmdStr, bytes) else cmdStr
+        if checkStr.startswith(('~se', '~reset')):
+            return self._changePower(cmdStr, timeout=timeout, cmd=cmd)
         return self.sendOneCommand(cmdStr, timeout=timeout, cmd=cmd)
+
+    def _changePower(self, cmdStr, timeout=None, cmd=None):
+        """ Send a command which changes the power state, and forget the cached status once it has.
+
+        Invalidating also stops any ~ge read in flight from caching what it read.
+        """
+
+        self.forgetPowerStatus()
+        try:
+            return self.sendOneCommand(cmdStr, timeout=timeout, cmd=cmd)
+        finally:
+            self.forgetPowerStatus()
+
+    @property
+    def powerStatusName(self):
+        return f'{self.name}.powerStatus'
+
+    def powerStatus(self, maxAge=0.0, cmd=None):
+        """ Return the raw ~ge power status, as read no more than maxAge seconds ago. """
+
+        if self.actor is None:
+            return self.pcmCmd('~ge', cmd=cmd)
+        return self.actor.readings.fetch(self.powerStatusName,
+                                         lambda: self.pcmCmd('~ge', cmd=cmd),
+                                         maxAge=maxAge)
+
+    def forgetPowerStatus(self):
+        if self.actor is not None:
+            self.actor.readings.invalidate(self.powerStatusName)
     
     def powerCmd(self, system, turnOn=True, cmd=None):
         try:
@@ -98,7 +153,7 @@ class PCM(object):
             return False
 
         cmdStr = b"~se,ch%d,%s" % (i+1, b'on' if turnOn else b'off')
-        ret = self.sendOneCommand(cmdStr)
+        ret = self._changePower(cmdStr)
         return ret
 
     def powerOn(self, system):
@@ -8,8 +8,9 @@ class BufferedSocket(object):
     """ Buffer the input from a socket and block it into lines. """
 
     def __init__(self, name, sock=None, loggerName=None, EOL=b'\n', timeout=1.0,
-                 logLevel=logging.INFO):
+                 logLevel=logging.INFO, trace=None):
         self.EOL = EOL
+        self.trace = trace
         self.sock = sock
         self.name = name
         self.logger = logging.getLogger(loggerName)
@@ -57,10 +58,11 @@ class BufferedSocket(object):
             except IOError:
                 return ''
             
-            msg = '%s added: %r' % (self.name, more)
-            self.logger.debug(msg)
-            if cmd:
-                cmd.diag('text=%s' % (qstr(msg)))
+            if self.trace is not None and self.trace.verbose:
+                msg = '%s added: %r' % (self.name, more)
+                self.logger.debug(msg)
+                if cmd:
+                    cmd.diag('text=%s' % (qstr(msg)))
             self.buffer += more
             if more == b'':
                 return ''
@@ -0,0 +1,252 @@
+import logging
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+from xcuActor import deadline
+
+class DeviceDown(IOError):
+    """ Raised instead of talking to a device which we believe is unreachable. """
+    pass
+
+def tcpProbe(host, port, timeout=1.0):
+    """ Return a probe function which just checks that we can connect to host:port. """
+
+    def probe():
+        s = socket.create_connection((host, port), timeout=timeout)
+        s.close()
+    return probe
+
+class CircuitBreaker(object):
+    """Stop waiting for timeouts from a device which is known to be down.
+
+    The breaker is closed while the device is talking to us. After
+    failLimit consecutive communication failures it opens, and all
+    transactions fail immediately with DeviceDown. While open, we
+    probe the device in the background, backing off exponentially
+    between tries. The breaker is half-open while a probe is
+    running, and closes again on the first success.
+
+    Only communication failures (OSError, including socket, serial and
+    timeout errors, and EOFError) count. Errors from a device which
+    did answer are not our business.
+
+    Transitions are announced with <name>Comm=up|down|probing keywords.
+
+    Args
+    ----
+    name : `str`
+       the device name, used for the keyword.
+    actor : `Actor`
+       where to broadcast transitions. Can be None.
+    probe : callable
+       called with no arguments to test the device; should raise on
+       failure. It can simply run a normal transaction: those are
+       allowed through from the probe thread. If None, the first
+       transaction after each backoff period is let through instead.
+    trace : `TraceRing`
+       if set, dumped to the log on every communication failure.
+
+    Only one transaction at a time goes through to the device: they
+    all hold ioLock. A caller which must not be interleaved with other
+    transactions (e.g. a status handler which makes several) can hold
+    ioLock itself, around all of them. Controllers with their own device
+    lock take it inside the transaction, never around it.
+    """
+
+    CLOSED = 'up'
+    OPEN = 'down'
+    HALF_OPEN = 'probing'
+
+    commErrors = (OSError, EOFError)
+
+    def __init__(self, name, actor=None, probe=None, trace=None,
+                 failLimit=3, minBackoff=2.0, maxBackoff=120.0):
+        self.name = name
+        self.actor = actor
+        self.probe = probe
+        self.trace = trace
+        self.failLimit = failLimit
+        self.minBackoff = minBackoff
+        self.maxBackoff = maxBackoff
+
+        self.logger = logging.getLogger(f'{name}.breaker')
+        self.lock = threading.RLock()
+
+        self.ioLock = threading.RLock()
+
+        self.state = self.CLOSED
+        self.failures = 0
+        self.lastError = None
+        self.backoff = minBackoff
+        self.retryAt = 0.0
+        self.probeThread = None
+        self.trialThread = None
+
+    @classmethod
+    def fromConfig(cls, actor, name, probe=None, trace=None):
+        """ Create a breaker, taking failLimit/minBackoff/maxBackoff from actorConfig[name]. """
+
+        argv = dict()
+        try:
+            cfg = actor.actorConfig[name]
+            for k in 'failLimit', 'minBackoff', 'maxBackoff':
+                if k in cfg:
+                    argv[k] = cfg[k]
+        except Exception:
+            pass
+
+        return cls(name, actor=actor, probe=probe, trace=trace, **argv)
+
+    def __str__(self):
+        return f'CircuitBreaker({self.name}, {self.state}, failures={self.failures})'
+
+    @property
+    def isUp(self):
+        return self.state == self.CLOSED
+
+    def getKey(self):
+        return f'{self.name}Comm={self.state}'
+
+    def genKeys(self, cmd=None):
+        if cmd is None:
+            if self.actor is None:
+                return
+            cmd = self.actor.bcast
+        cmdFunc = cmd.inform if self.isUp else cmd.warn
+        cmdFunc(self.getKey())
+
+    def _announce(self, reason=None):
+        self.logger.warning('%s%s', self.getKey(), '' if reason is None else f': {reason}')
+        if self.actor is None:
+            return
+        if reason is not None:
+            self.actor.bcast.warn('text="%s: %s"' % (self.name, str(reason).replace('"', "'")))
+        self.genKeys()
+
+    def check(self):
+        """ Raise DeviceDown unless a transaction is allowed now. """
+
+        me = threading.current_thread()
+        with self.lock:
+            if self.state == self.CLOSED:
+                return
+            if me is self.probeThread or me is self.trialThread:
+                return
+            if (self.probe is None and self.state == self.OPEN
+                and time.monotonic() >= self.retryAt):
+                self.trialThread = me
+                self.state = self.HALF_OPEN
+                self._announce()
+                return
+
+        raise DeviceDown(f'{self.name} is down (after {self.failures} failures: {self.lastError}); '
+                         f'next retry in {max(0, self.retryAt - time.monotonic()):0.1f}s')
+
+    def success(self):
+        with self.lock:
+            wasDown = self.state != self.CLOSED
+            self.state = self.CLOSED
+            self.failures = 0
+            self.backoff = self.minBackoff
+            self.trialThread = None
+            if wasDown:
+                self._announce('communication restored')
+
+    def failure(self, e):
+        with self.lock:
+            self.failures += 1
+            self.lastError = e
+            if self.state == self.CLOSED and self.failures < self.failLimit:
+                return
+
+            oldState = self.state
+            if oldState != self.CLOSED:
+                self.backoff = min(self.backoff * 2, self.maxBackoff)
+            self.state = self.OPEN
+            self.trialThread = None
+            self.retryAt = time.monotonic() + self.backoff
+            if oldState == self.CLOSED:
+                self._announce(f'{self.failures} consecutive failures, last: {e}')
+            elif oldState == self.HALF_OPEN:
+                self._announce(f'still down, retrying in {self.backoff:0.1f}s: {e}')
+            self._startProbe()
+
+    def _startProbe(self):
+        if self.probe is None:
+            return
+        if self.probeThread is not None and self.probeThread.is_alive():
+            return
+        self.probeThread = threading.Thread(target=self._probeLoop,
+                                            name=f'{self.name}-probe', daemon=True)
+        self.probeThread.start()
+
+    def _probeLoop(self):
+        while True:
+            with self.lock:
+                if self.state == self.CLOSED:
+                    return
+                delay = max(0.0, self.retryAt - time.monotonic())
+            time.sleep(delay)
+
+            with self.lock:
+                self.state = self.HALF_OPEN
+                self._announce()
+            self.logger.info('probing %s', self.name)
+            try:
+                self.probe()
+            except self.commErrors as e:
+                # A probe which ran a transaction has already been counted.
+                with self.lock:
+                    if self.state == self.HALF_OPEN:
+                        self.failure(e)
+                continue
+            except Exception as e:
+                self.logger.warning('probe of %s got an answer, but with: %s', self.name, e)
+            self.success()
+            return
+
+    def reply(self, ret, step='reply'):
+        """ Return ret, a device's reply, raising a timeout if it is empty.
+
+        BufferedSocket returns '' when a read times out. Call this on its
+        replies inside transaction(), so that the silence counts as a
+        communication failure rather than as an answer.
+        """
+
+        if ret == '' or ret == b'':
+            raise socket.timeout(f'no reply from {self.name} to {step}')
+        return ret
+
+    @contextmanager
+    def transaction(self, step='transaction'):
+        """ Wrap one device transaction: fail fast if down, and record the outcome.
+
+        A communication error after the current command deadline has
+        passed is most likely due to our having clamped the timeout:
+        it is raised as a DeadlineExceeded for <name>/<step>, and not
+        held against the device.
+        """
+
+        deadline.check(self.name, step)
+        self.check()
+        with self.ioLock:
+            try:
+                yield
+            except (DeviceDown, deadline.DeadlineExceeded):
+                raise
+            except self.commErrors as e:
+                current = deadline.current()
+                if current is not None and current.expired:
+                    raise current.exceeded(self.name, step) from e
+                if self.trace is not None:
+                    self.trace.logDump(f'{self.name} communication error: {e}')
+                self.failure(e)
+                raise
+            except Exception:
+                # The device answered, even if we did not like what it said.
+                self.success()
+                raise
+            else:
+                self.success()
@@ -1,14 +1,17 @@
-from importlib import reload
 import logging
+import math
 import socket
 import time
 
-import numpy as np
-
 from opscore.utility.qstr import qstr
 
 import xcuActor.Controllers.bufferedSocket as bufferedSocket
-reload(bufferedSocket)
+from xcuActor import deadline
+from xcuActor import readingCache
+from xcuActor import records
+from xcuActor import watchdog
+from xcuActor.Controllers import circuitBreaker
+from xcuActor.Controllers import traceRing
 
 class cooler(object):
     def __init__(self, actor, name,
@@ -24,7 +27,8 @@ class cooler(object):
         self.host = self.actor.actorConfig[self.name]['host']
         self.port = self.actor.actorConfig[self.name]['port']
 
-        self.ioBuffer = bufferedSocket.BufferedSocket(self.name + "IO", EOL=b'\r\n')
+        self.trace = traceRing.TraceRing.fromConfig(actor, self.name)
+        self.ioBuffer = bufferedSocket.BufferedSocket(self.name + "IO", EOL=b'\r\n', trace=self.trace)
 
         self.keepUnlocked = False
         self.sock = None
@@ -32,6 +36,9 @@ class cooler(object):
         self.rejectLimitHit = False
         self.tipSensorBad = False
 
+        self.breaker = circuitBreaker.CircuitBreaker.fromConfig(actor, self.name, trace=self.trace,
+                                                                probe=lambda: self.sendOneCommand('TC'))
+
     def start(self, cmd=None):
         pass
 
@@ -42,7 +49,7 @@ class cooler(object):
         if self.sock is None:
             try:
                 s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                s.settimeout(1.0)
+                s.settimeout(deadline.timeout(1.0, self.name, 'connect'))
             except socket.error as e:
                 cmd.warn('text="failed to create socket for %s: %s"' % (self.name, e))
                 raise
@@ -91,24 +98,32 @@ class cooler(object):
             cmdStr = cmdStr.encode('latin-1')
 
         fullCmd = b"%s%s" % (cmdStr, self.EOL)
-        self.logger.debug('sending %r', fullCmd)
-        cmd.diag('text="sending %r"' % fullCmd)
+        self.trace.send(fullCmd)
+        if self.trace.verbose:
+            self.logger.debug('sending %r', fullCmd)
+            cmd.diag('text="sending %r"' % fullCmd)
 
-        s = self.connectSock(cmd)
-        
-        try:
-            s.sendall(fullCmd)
-        except socket.error as e:
-            cmd.warn('text="failed to send to cooler: %s"' % (e))
-            raise
-
-        ret = self.ioBuffer.getOneResponse(sock=s, cmd=cmd)
-        if not ret.startswith(cmdStr.decode('latin-1')):
-            cmd.warn('text="command to cooler (%r) was not echoed: %r"' % (fullCmd,
-                                                                           ret))
-            raise
-
-        reply = self.getOneResponse(cmd=cmd, timeout=timeout)
+        with self.breaker.transaction(step=cmdStr.decode('latin-1')), \
+             watchdog.track(self.actor, self.name, closer=lambda: watchdog.shutdownSocket(s)):
+            try:
+                s = self.connectSock(cmd)
+                s.sendall(fullCmd)
+            except socket.error as e:
+                cmd.warn('text="failed to send to cooler: %s"' % (e))
+                self.closeSock(cmd)
+                raise
+
+            echoTimeout = deadline.timeout(self.ioBuffer.timeout, self.name, 'echo')
+            ret = self.ioBuffer.getOneResponse(sock=s, timeout=echoTimeout, cmd=cmd)
+            self.trace.recv(ret)
+            if not ret.startswith(cmdStr.decode('latin-1')):
+                cmd.warn('text="command to cooler (%r) was not echoed: %r"' % (fullCmd,
+                                                                               ret))
+                self.closeSock(cmd)
+                self.breaker.reply(ret, step=f'{fullCmd} echo')
+                raise RuntimeError(f'command to {self.name} ({fullCmd}) was not echoed: {ret}')
+
+            reply = self.breaker.reply(self.getOneResponse(cmd=cmd, timeout=timeout), step=fullCmd)
         if doClose:
             self.closeSock(cmd)
 
@@ -118,12 +133,17 @@ class cooler(object):
         if sock is None:
             sock = self.connectSock(cmd)
             
+        if timeout is None:
+            timeout = self.ioBuffer.timeout
+        timeout = deadline.timeout(timeout, self.name, 'reply')
         ret = self.ioBuffer.getOneResponse(sock=sock, timeout=timeout, cmd=cmd)
         reply = ret.strip()
-        
-        self.logger.debug('received %r', reply)
-        if cmd is not None:
-            cmd.diag('text="received %r"' % reply)
+
+        self.trace.recv(ret)
+        if self.trace.verbose:
+            self.logger.debug('received %r', reply)
+            if cmd is not None:
+                cmd.diag('text="received %r"' % reply)
 
         return reply
 
@@ -135,15 +155,18 @@ class cooler(object):
             self.sendOneCommand('LOGOUT=STIRLING', cmd=cmd)
         
     def getPID(self, cmd=None):
-        KP = float(self.sendOneCommand('KP', doClose=False, cmd=cmd))
-        KI = float(self.sendOneCommand('KI', doClose=False, cmd=cmd))
-        KD = float(self.sendOneCommand('KD', doClose=False, cmd=cmd))
-        mode = self.sendOneCommand('COOLER', doClose=False, cmd=cmd)
+        """ Return the control loop settings, as a records.CoolerLoop. """
+
+        with readingCache.sampling() as stamp:
+            KP = float(self.sendOneCommand('KP', doClose=False, cmd=cmd))
+            KI = float(self.sendOneCommand('KI', doClose=False, cmd=cmd))
+            KD = float(self.sendOneCommand('KD', doClose=False, cmd=cmd))
+            mode = self.sendOneCommand('COOLER', doClose=False, cmd=cmd)
 
         if cmd is not None:
             cmd.inform('%sLoop=%s, %g,%g,%g' % (self.name, mode,
                                                 KP, KI,KD))
-        return mode, KP, KI, KD
+        return records.CoolerLoop(mode, KP, KI, KD, stamp=stamp)
 
     def startCooler(self, mode, setpoint, cmd=None):
         headTemp = float(self.sendOneCommand('TC', cmd=cmd))
@@ -267,19 +290,25 @@ class cooler(object):
         return errorMask, ', '.join(elist)
         
     def getTemps(self, cmd=None):
+        """ Return the temperatures and power, as a records.CoolerTemps. """
+
         mode = self.sendOneCommand('COOLER', doClose=False, cmd=cmd)
         errorMask = int(self.sendOneCommand('ERROR', doClose=False, cmd=cmd), base=2)
-        try:
-            maxPower = float(self.sendOneCommand('E', doClose=False, cmd=cmd, timeout=2))
-            minPower = float(self.getOneResponse(cmd=cmd))
-            power = float(self.getOneResponse(cmd=cmd))
-        except ValueError:
-            maxPower = np.nan
-            minPower = np.nan
-            power = np.nan
-        tipTemp = float(self.sendOneCommand('TC', doClose=False, cmd=cmd))
-        rejectTemp = float(self.sendOneCommand('TEMP2', doClose=False, cmd=cmd))
-        setTemp = float(self.sendOneCommand('TTARGET', cmd=cmd))
+        with readingCache.sampling() as powerStamp:
+            try:
+                maxPower = float(self.sendOneCommand('E', doClose=False, cmd=cmd, timeout=2))
+                minPower = float(self.getOneResponse(cmd=cmd))
+                power = float(self.getOneResponse(cmd=cmd))
+            except ValueError:
+                maxPower = math.nan
+                minPower = math.nan
+                power = math.nan
+        with readingCache.sampling() as tipStamp:
+            tipTemp = float(self.sendOneCommand('TC', doClose=False, cmd=cmd))
+        with readingCache.sampling() as rejectStamp:
+            rejectTemp = float(self.sendOneCommand('TEMP2', doClose=False, cmd=cmd))
+        with readingCache.sampling() as setStamp:
+            setTemp = float(self.sendOneCommand('TTARGET', cmd=cmd))
 
         rejectLimit = self.actor.actorConfig[self.name]['rejectLimit']
         if rejectTemp > rejectLimit:
@@ -288,6 +317,14 @@ class cooler(object):
             self.rejectLimitHit = False
 
         self.tipSensorBad = (tipTemp > 399)
+        temps = records.CoolerTemps(setTemp, rejectTemp, tipTemp, power,
+                                    stamp=readingCache.spanning((setStamp, rejectStamp,
+                                                                 tipStamp, powerStamp)))
+        self.actor.readings.put(f'{self.name}.temps', temps,
+                                stamps=(setStamp, rejectStamp, tipStamp, powerStamp))
+        self.actor.readings.put(f'{self.name}.status',
+                                records.CoolerPower(errorMask, minPower, maxPower, power,
+                                                    stamp=powerStamp))
 
         if cmd is not None:
             errorMask, errorString = self.errorFlags(errorMask)
@@ -301,19 +338,18 @@ class cooler(object):
             cmd.inform('%sTemps=%g,%g,%g, %g' % (self.name, setTemp,
                                                  rejectTemp, tipTemp,
                                                  power))
+            self.actor.readings.genTimesKey(cmd, f'{self.name}Temps', f'{self.name}.temps')
 
-        return setTemp, rejectTemp, tipTemp, setTemp
+        return temps
 
     def status(self, cmd=None):
-        ret = []
-
-        ret1 = self.getPID(cmd=cmd)
-        ret2 = self.getTemps(cmd=cmd)
+        """ Return the loop settings and temperatures, as a records.CoolerStatus. """
 
-        ret.extend(ret1)
-        ret.extend(ret2)
+        loop = self.getPID(cmd=cmd)
+        temps = self.getTemps(cmd=cmd)
 
-        return ret
+        return records.CoolerStatus(*loop, *temps,
+                                    stamp=readingCache.spanning((loop.stamp, temps.stamp)))
 
     def rawCmd(self, cmdStr, timeout=None, cmd=None):
         """ Send a raw command to the controller and return the output.
@@ -1,13 +1,13 @@
 #!/usr/bin/env python
 
-from importlib import reload
-
 import logging
 import sys
+import threading
 import time
 
 import rtdADIO.ADIO
-reload(rtdADIO.ADIO)
+
+from xcuActor import readingCache
 
 class gatevalve(object):
     def __init__(self, actor, name,
@@ -15,6 +15,7 @@ class gatevalve(object):
                  loglevel=logging.DEBUG):
 
         self.actor = actor
+        self.name = name
         self.logger = logger if logger else logging.getLogger('gatevalve')
         self.logger.setLevel(loglevel)
 
@@ -36,11 +37,23 @@ class gatevalve(object):
                              0:'closed',
                              self.requestBits:'open'}
 
+        # While waiting for the valve to move, how often to read the ADIO bits, seconds.
+        # Set pollInterval in the gatevalve config section.
+        try:
+            self.pollInterval = float(self.actor.actorConfig[self.name]['pollInterval'])
+        except Exception:
+            self.pollInterval = 0.05
+
+        # The ADIO device is used from command threads and waiters: only touch it under this lock.
+        self.devLock = threading.Lock()
         self.dev = None
         self.dev = rtdADIO.ADIO.ADIO(self.bits['enabled'] | self.bits['sam_on'] | self.bits['sam_return'])
         # This is the second argument, for the interrupt mask. Add it when we update rtdADIO.
         #self.posBits | self.bits['enabled'] | self.bits['active'])
 
+        # The last ADIO bits seen while waiting, and when they changed.
+        self.lastBits = None
+        self.lastChange = None
 
     def __del__(self):
         if self.dev is not None:
@@ -51,35 +64,79 @@ class gatevalve(object):
 
     def stop(self, cmd=None):
         try:
-            self.dev.disconnect()
+            with self.devLock:
+                self.dev.disconnect()
         except:
             pass
 
-    def spinUntil(self, testFunc, starting=None, wait=5.0, cmd=None):
-        """ """
-
-        pause = 0.1
-        lastState = starting
-        while wait > 0:
-            ret = self.status(silentIf=lastState, cmd=cmd)
-            if testFunc(ret):
-                return ret
-            lastState = ret
-            wait -= pause
-            time.sleep(pause)
-        raise RuntimeError("failed to get desired gate valve state. Timed out with: 0x%02x" % (ret))
+    def _readBits(self):
+        """ Return the ADIO bits, and the Stamp of the read. """
+
+        with self.devLock:
+            return readingCache.sample(self.dev.status)
+
+    def _noteBits(self, bits, stamp):
+        """ Remember the bits seen while waiting, and announce any change. """
+
+        if bits == self.lastBits:
+            return
+        self.lastBits = bits
+        self.lastChange = stamp
+
+        if self.actor is not None:
+            self.actor.readings.put(f'{self.name}.bits', bits, stamp=stamp)
+            pos, request, samPower = self.describeStatus(bits)
+            self.actor.bcast.inform('gatevalveBits=0x%02x,%s,%s,%0.3f' % (bits, pos, request, stamp.wall))
+
+    def waitForChange(self, bits, timeout):
+        """ Wait up to timeout seconds for the ADIO bits to differ from bits. Returns the latest (bits, Stamp).
+
+        This polls: rtdADIO cannot yet tell us about changes. We read
+        the bits every pollInterval seconds, and only while somebody is
+        waiting. Replace this with a blocking wait on the interrupt mask
+        once rtdADIO supports one.
+        """
+
+        endTime = time.monotonic() + timeout
+        while True:
+            newBits, stamp = self._readBits()
+            self._noteBits(newBits, stamp)
+            if newBits != bits or stamp.mono >= endTime:
+                return newBits, stamp
+            time.sleep(min(self.pollInterval, max(endTime - stamp.mono, 0.0)))
+
+    def waitUntil(self, testFunc, wait=5.0):
+        """ Wait until testFunc(bits) is True. Returns (bits, Stamp of the change), or raises RuntimeError after wait seconds. """
+
+        endTime = time.monotonic() + wait
+        bits, stamp = self._readBits()
+        self._noteBits(bits, stamp)
+        while not testFunc(bits):
+            remaining = endTime - time.monotonic()
+            if remaining <= 0:
+                raise RuntimeError("failed to get desired gate valve state. Timed out with: 0x%02x" % (bits))
+            bits, stamp = self.waitForChange(bits, remaining)
+        return bits, stamp
+
+    def _set(self, bits):
+        with self.devLock:
+            self.dev.set(bits)
+
+    def _clear(self, bits):
+        with self.devLock:
+            self.dev.clear(bits)
 
     def open(self, wait=4, cmd=None):
         """ Raise the gatevalve Open Enable line. """
 
-        starting = self.status(cmd=cmd)
-        self.dev.set(self.bits['enabled'])
+        self.status(cmd=cmd)
+        self._set(self.bits['enabled'])
 
         def isOpen(status):
             return (status & self.posBits) == self.bits['open']
 
         try:
-            ret = self.spinUntil(isOpen, starting=starting, wait=wait, cmd=cmd)
+            ret, stamp = self.waitUntil(isOpen, wait=wait)
         except Exception as e:
             cmd.warn(f'text="FAILED to open gatevalve: {e}; Trying to set requested state to closed...."')
             ret = self.close(cmd=cmd)
@@ -91,14 +148,14 @@ class gatevalve(object):
     def close(self, wait=4, cmd=None):
         """ Drop the gatevalve Open Enable line. """
 
-        starting = self.status(cmd=cmd)
-        self.dev.clear(self.bits['enabled'])
+        self.status(cmd=cmd)
+        self._clear(self.bits['enabled'])
 
         def isClosed(status):
             return (status & self.posBits) == self.bits['closed']
 
         try:
-            ret = self.spinUntil(isClosed, starting=starting, wait=wait, cmd=cmd)
+            ret, stamp = self.waitUntil(isClosed, wait=wait)
         except Exception as e:
             cmd.warn(f'text="FAILED to close gatevalve: {e}"')
             raise
@@ -110,18 +167,18 @@ class gatevalve(object):
         """ Raise or drop the gatevalve open request line. """
 
         if toOpen:
-            self.dev.set(self.bits['enabled'])
+            self._set(self.bits['enabled'])
         else:
-            self.dev.clear(self.bits['enabled'])
+            self._clear(self.bits['enabled'])
 
     def powerOffSam(self, wait=1, cmd=None):
         """ Deassert SAM power line, turning it off. """
-        self.dev.clear(self.bits['sam_on'])
+        self._clear(self.bits['sam_on'])
         return self.samStatus()
 
     def powerOnSam(self, wait=1, cmd=None):
         """ Assert SAM power line, turning it on. """
-        self.dev.set(self.bits['sam_on'])
+        self._set(self.bits['sam_on'])
         return self.samStatus()
 
     def samStatus(self):
@@ -129,7 +186,8 @@ class gatevalve(object):
         return ret
 
     def getStatus(self):
-        return self.dev.status()
+        with self.devLock:
+            return self.dev.status()
 
     def describeStatus(self, bits):
         """ Return the description of the position and the requested position. """
@@ -143,7 +201,9 @@ class gatevalve(object):
         return pos, request, samPower
 
     def status(self, silentIf=None, cmd=None):
-        ret = self.getStatus()
+        ret, stamp = self._readBits()
+        if self.actor is not None:
+            self.actor.readings.put(f'{self.name}.bits', ret, stamp=stamp)
         pos, request, samPower = self.describeStatus(ret)
         if cmd and ret != silentIf:
             cmd.inform('sampower=%d' % (samPower))
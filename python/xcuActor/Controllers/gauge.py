@@ -1,10 +1,11 @@
-from importlib import reload
-
 import logging
 import socket
 
+from xcuActor import deadline
+from xcuActor import watchdog
+from xcuActor.Controllers import circuitBreaker
+from xcuActor.Controllers import traceRing
 from xcuActor.Controllers import pfeiffer
-reload(pfeiffer)
 
 class gauge(pfeiffer.Pfeiffer):
     def __init__(self, actor, name,
@@ -22,6 +23,11 @@ class gauge(pfeiffer.Pfeiffer):
 
         pfeiffer.Pfeiffer.__init__(self)
 
+        self.trace = traceRing.TraceRing.fromConfig(actor, self.name)
+        self.breaker = circuitBreaker.CircuitBreaker.fromConfig(actor, self.name, trace=self.trace,
+                                                                probe=circuitBreaker.tcpProbe(self.host,
+                                                                                              self.port))
+
     def start(self, cmd=None):
         pass
 
@@ -50,32 +56,40 @@ class gauge(pfeiffer.Pfeiffer):
             pass
         
         fullCmd = b"%s%s" % (cmdStr, self.EOL)
-        self.logger.info('sending %r', fullCmd)
-        cmd.diag('text="sending %r"' % fullCmd)
-
-        try:
-            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            s.settimeout(1.0)
-        except socket.error as e:
-            cmd.warn('text="failed to create socket to %s: %s"' % (self.name, e))
-            raise
- 
-        try:
-            s.connect((self.host, self.port))
-            s.sendall(fullCmd)
-        except socket.error as e:
-            cmd.warn('text="failed to create connect or send to %s: %s"' % (self.name, e))
-            raise
-
-        try:
-            ret = s.recv(1024)
-        except socket.error as e:
-            cmd.warn('text="failed to read response from %s: %s"' % (self.name, e))
-            raise
-
-        self.logger.info('received %r', ret)
-        cmd.diag('text="received %r"' % ret)
-        s.close()
+        self.trace.send(fullCmd)
+        if self.trace.verbose:
+            self.logger.info('sending %r', fullCmd)
+            cmd.diag('text="sending %r"' % fullCmd)
+
+        with self.breaker.transaction(step=cmdStr.decode('latin-1')), \
+             watchdog.track(self.actor, self.name, closer=lambda: watchdog.shutdownSocket(s)):
+            try:
+                s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                s.settimeout(deadline.timeout(1.0, self.name, cmdStr.decode('latin-1')))
+            except socket.error as e:
+                cmd.warn('text="failed to create socket to %s: %s"' % (self.name, e))
+                raise
+
+            try:
+                s.connect((self.host, self.port))
+                s.sendall(fullCmd)
+            except socket.error as e:
+                cmd.warn('text="failed to create connect or send to %s: %s"' % (self.name, e))
+                s.close()
+                raise
+
+            try:
+                ret = s.recv(1024)
+            except socket.error as e:
+                cmd.warn('text="failed to read response from %s: %s"' % (self.name, e))
+                raise
+            finally:
+                s.close()
+
+        self.trace.recv(ret)
+        if self.trace.verbose:
+            self.logger.info('received %r', ret)
+            cmd.diag('text="received %r"' % ret)
 
         return ret
 
@@ -0,0 +1,151 @@
+import collections
+import logging
+import time
+
+class _Line(object):
+    """ One Intel HEX record on its way to the bootloader. """
+
+    def __init__(self, number, text, eol):
+        self.number = number
+        self.text = text
+        self.data = (text + eol).encode('latin-1')
+        self.retries = 0
+
+    @property
+    def isData(self):
+        return self.text[7:9] == '00'
+
+    @property
+    def isEnd(self):
+        return self.text[7:9] == '01'
+
+class HexUpload(object):
+    """ Send an Intel HEX image to a bootloader which echoes every byte, then ACKs or NAKs each line.
+
+    Lines are written whole, and as many data records are kept in flight
+    as fit in bufferSize bytes, so that the upload is not limited by one
+    serial round trip per character. The echoes and ACK/NAKs are then
+    read back in bulk, and matched against the lines in the order they
+    were sent. A NAKed line is resent on its own, up to maxRetries times.
+
+    Records other than data records (extended addresses, end of file)
+    change the bootloader's state, so they are sent only once everything
+    before them has been acknowledged, and nothing follows them until
+    they are.
+
+    The bootloader's XOFF and XON are dropped from the echoes, and we
+    stop writing between them.
+
+    Args
+    ----
+    device : `serial.Serial`
+       the open port.
+    bufferSize : `int`
+       how many bytes we may have sent and not had acknowledged.
+    progress : callable
+       called as progress(nDone, nLines, nBytes, elapsed) every
+       progressInterval seconds, and at the end.
+    """
+
+    ACK = 0x06
+    NAK = 0x15
+    XON = 0x11
+    XOFF = 0x13
+
+    def __init__(self, device, bufferSize=128, maxRetries=5, eol='\n',
+                 progress=None, progressInterval=2.0, logger=None):
+        self.device = device
+        self.bufferSize = bufferSize
+        self.maxRetries = maxRetries
+        self.eol = eol
+        self.progress = progress
+        self.progressInterval = progressInterval
+        self.logger = logger if logger is not None else logging.getLogger('hexUpload')
+
+    def send(self, hexLines):
+        """ Send all the records in hexLines, skipping blank and ';' comment lines. Returns the number of bytes sent. """
+
+        pending = collections.deque()
+        for l_i, rawl in enumerate(hexLines):
+            text = rawl.strip()
+            if text and text[0] != ';':
+                pending.append(_Line(l_i+1, text, self.eol))
+        nLines = len(pending)
+
+        inFlight = collections.deque()
+        rx = bytearray()
+        paused = False
+        nDone = 0
+        nBytes = 0
+        t0 = time.monotonic()
+        lastProgress = t0
+
+        while pending or inFlight:
+            # Fill the window.
+            inFlightBytes = sum(len(l.data) for l in inFlight)
+            while pending and not paused:
+                line = pending[0]
+                if inFlight and (not line.isData or not inFlight[-1].isData
+                                 or inFlightBytes + len(line.data) > self.bufferSize):
+                    break
+                pending.popleft()
+                self.device.write(line.data)
+                inFlight.append(line)
+                inFlightBytes += len(line.data)
+                nBytes += len(line.data)
+
+            # Read whatever has come back, waiting for at least one byte.
+            data = self.device.read(max(1, self.device.in_waiting))
+            if not data:
+                if not inFlight:
+                    raise RuntimeError('timed out waiting for XON before line %d' % (pending[0].number))
+                line = inFlight[0]
+                if line.isEnd and len(rx) >= len(line.data):
+                    # The bootloader may start the new image without acknowledging the end record.
+                    del rx[:len(line.data)]
+                    inFlight.popleft()
+                    nDone += 1
+                    continue
+                raise RuntimeError('timed out waiting for the echo of line %d (%d of %d bytes back)' %
+                                   (line.number, len(rx), len(line.data) + 1))
+            for b in data:
+                if b == self.XOFF:
+                    paused = True
+                elif b == self.XON:
+                    paused = False
+                else:
+                    rx.append(b)
+
+            # Match complete echoes and ACK/NAKs against what we sent.
+            while inFlight and len(rx) > len(inFlight[0].data):
+                line = inFlight.popleft()
+                n = len(line.data)
+                echo = bytes(rx[:n])
+                status = rx[n]
+                del rx[:n+1]
+
+                if echo != line.data:
+                    raise RuntimeError('echo mismatch on line %d: sent %r, recv %r' %
+                                       (line.number, line.data, echo))
+                if status == self.ACK or line.isEnd:
+                    nDone += 1
+                elif status == self.NAK:
+                    line.retries += 1
+                    if line.retries >= self.maxRetries:
+                        raise RuntimeError('too many retries (%d) on line %d' %
+                                           (line.retries, line.number))
+                    self.logger.warning('resending line %d; try %d', line.number, line.retries)
+                    # Resend it next. Data lines sent after it carry their own addresses, so they stand.
+                    pending.appendleft(line)
+                else:
+                    raise RuntimeError('unexpected response (%r) after sending line %d' %
+                                       (bytes([status]), line.number))
+
+            now = time.monotonic()
+            if self.progress is not None and now - lastProgress >= self.progressInterval:
+                self.progress(nDone, nLines, nBytes, now - t0)
+                lastProgress = now
+
+        if self.progress is not None:
+            self.progress(nDone, nLines, nBytes, time.monotonic() - t0)
+        return nBytes
@@ -1,10 +1,18 @@
 import logging
+import math
 import serial
 import threading
 import time
 
 from opscore.utility.qstr import qstr
 
+from xcuActor import deadline
+from xcuActor import watchdog
+from xcuActor.Controllers import circuitBreaker
+from xcuActor.Controllers import hexUpload
+from xcuActor.Controllers import traceRing
+from xcuActor.Controllers import singleFlight
+
 class interlock(object):
     def __init__(self, actor, name, logLevel=logging.DEBUG):
         self.actor = actor
@@ -30,6 +38,14 @@ class interlock(object):
 
         self.connect()
 
+        self.trace = traceRing.TraceRing.fromConfig(actor, self.name)
+        self.breaker = circuitBreaker.CircuitBreaker.fromConfig(actor, self.name, trace=self.trace,
+                                                                probe=lambda: self.sendCommandStr('gStat,all'))
+        self.flights = singleFlight.SingleFlight(self.name)
+
+        # How long a firmware upload can reasonably take, in seconds.
+        self.imageBound = 600.0
+
     def __str__(self):
         return ("Interlock(port=%s, device=%s)" %
                 (self.devConfig['port'],
@@ -41,6 +57,17 @@ class interlock(object):
     def stop(self, cmd=None):
         pass
 
+    def setReadTimeout(self, timeout):
+        # Changing the timeout reconfigures the port, so only do it when necessary.
+        if self.device.timeout != timeout:
+            self.device.timeout = timeout
+
+    def closeDevice(self):
+        """ Close the serial port, e.g. to unblock a stuck read. The next command reopens it. """
+
+        if self.device is not None:
+            self.device.close()
+
     def connect(self):
         """ Establish a new connection to the GV interlock. Any old connection is closed.  """
 
@@ -51,15 +78,38 @@ class interlock(object):
         self.device = serial.Serial(**self.devConfig)
 
     def sendCommandStr(self, cmdStr, cmd=None):
-        if len(cmdStr) > 0 and cmdStr[0] != '~':
-            cmdStr = f'~{cmdStr}'
-            
-        fullCmd = "%s%s" % (cmdStr, self.EOL)
+        return self.sendCommandStrs([cmdStr], cmd=cmd)[0]
+
+    def sendCommandStrs(self, cmdStrs, cmd=None):
+        """ Send several commands in one exchange, and return their responses.
+
+        All the commands are written at once, under one hold of the device
+        lock, then each echo and response is read back in turn. So several
+        queries cost one serial round trip, and see the board in one state.
+        """
+
+        cmdStrs = [cmdStr if cmdStr.startswith('~') else f'~{cmdStr}' for cmdStr in cmdStrs]
+
+        # The "g" commands are all queries.
+        if all(cmdStr.startswith('~g') for cmdStr in cmdStrs):
+            key = '|'.join(cmdStrs)
+            return self.flights.do(key, lambda: self._sendCommandStrs(cmdStrs, cmd=cmd))
+        return self._sendCommandStrs(cmdStrs, cmd=cmd)
+
+    def _sendCommandStrs(self, cmdStrs, cmd=None):
+        fullCmd = ''.join(["%s%s" % (cmdStr, self.EOL) for cmdStr in cmdStrs])
         writeCmd = fullCmd.encode('latin-1')
-        with self.deviceLock:
-            if cmd is not None:
-                cmd.debug('text=%s' % (qstr("sending %r" % fullCmd)))
-            self.logger.debug("sending command :%r:" % (fullCmd))
+        step = ','.join(cmdStrs)
+        with self.breaker.transaction(step=step), self.deviceLock, \
+             watchdog.track(self.actor, self.name, closer=self.closeDevice):
+            if self.device is None or not self.device.is_open:
+                self.connect()
+            self.setReadTimeout(deadline.timeout(self.devConfig['timeout'], self.name, step))
+            self.trace.send(writeCmd)
+            if self.trace.verbose:
+                if cmd is not None:
+                    cmd.debug('text=%s' % (qstr("sending %r" % fullCmd)))
+                self.logger.debug("sending command :%r:", fullCmd)
             try:
                 self.device.write(writeCmd)
             except serial.writeTimeoutError:
@@ -69,16 +119,18 @@ class interlock(object):
             except Exception:
                 raise
 
-            try:
-                ret = self.readResponse(cmd=cmd)
-            except EOFError:
-                raise EOFError(f"no response from {self.name}; sent :{fullCmd}:")
-            if ret != cmdStr:
-                raise RuntimeError("command echo mismatch. sent :%r: rcvd :%r:" % (cmdStr, ret))
- 
-            ret = self.readResponse(cmd=cmd)
+            replies = []
+            for cmdStr in cmdStrs:
+                try:
+                    ret = self.readResponse(cmd=cmd)
+                except EOFError:
+                    raise EOFError(f"no response from {self.name}; sent :{fullCmd}:")
+                if ret != cmdStr:
+                    raise RuntimeError("command echo mismatch. sent :%r: rcvd :%r:" % (cmdStr, ret))
 
-        return ret
+                replies.append(self.readResponse(cmd=cmd))
+
+        return replies
 
     def readResponse(self, EOL=None, cmd=None):
         """ Read a single response line, up to the next self.EOL.
@@ -116,9 +168,11 @@ class interlock(object):
                 break
             response += c
 
-        if cmd is not None:
-            cmd.debug('text="recv %r"' % response)
-        self.logger.debug("received :%r:" % (response))
+        self.trace.recv(response)
+        if self.trace.verbose:
+            if cmd is not None:
+                cmd.debug('text="recv %r"' % response)
+            self.logger.debug("received :%r:", response)
 
         if response == '' and c == '':
             raise EOFError()
@@ -147,12 +201,6 @@ class interlock(object):
         if cmd is None:
             cmd =  self.actor.bcast
 
-        eol = chr(0x0a)
-        ack = chr(0x06) # ; ack='+'
-        nak = chr(0x15) # ; name='-'
-        lineNumber = 1
-        maxRetries = 5
-
         if straightToCode:
             sendReboot = False
             doWait = False
@@ -193,58 +241,30 @@ class interlock(object):
                 if not ret.startswith('*Waiting for Data...'):
                     raise RuntimeError('could not get *Waiting for Data')
 
-        logLevel = self.logger.level
-        # self.logger.setLevel(logging.INFO)
-        self.device.timeout = 1.0 # self.devConfig['timeout'] * 100
-        strTrans = str.maketrans('', '', '\x11\x13')
-        with open(path, 'rU') as hexfile:
+        def progress(nDone, nLines, nBytes, elapsed):
+            rate = nBytes/elapsed if elapsed > 0 else 0.0
+            eta = (nLines - nDone) * elapsed/nDone if nDone > 0 else math.nan
+            cmd.inform('imageUpload=%d,%d,%0.0f,%0.1f' % (nDone, nLines, rate, eta))
+
+        try:
+            bufferSize = int(self.actor.actorConfig[self.name]['uploadBuffer'])
+        except Exception:
+            bufferSize = 128
+        uploader = hexUpload.HexUpload(self.device, bufferSize=bufferSize, eol='\n',
+                                       progress=progress if verbose else None,
+                                       logger=self.logger)
+
+        self.device.timeout = 1.0
+        with open(path, 'r') as hexfile, \
+             watchdog.track(self.actor, f'{self.name} sendImage',
+                            bound=self.imageBound, closer=self.closeDevice):
             lines = hexfile.readlines()
             t0 = time.time()
             cmd.inform('text="sending image file %s, %d lines"' % (path, len(lines)))
             self.logger.info('sending image file %s, %d lines' % (path, len(lines)))
-            for l_i, rawl in enumerate(lines):
-                hexl = rawl.strip()
-                if hexl[0] == ';':
-                    continue
-                retries = 0
-                # self.logger.debug('sending line %d: %r' % (l_i, hexl))
-                while True:
-                    if retries > 0:
-                        cmd.warn('text="resending line %d; try %d"' % (lineNumber,
-                                                                        retries))
-                        self.logger.warn('resending line %d; try %d' % (lineNumber, 
-                                                                        retries))
-                    fullLine = hexl+eol
-                    if verbose and lineNumber%100 == 1:
-                        cmd.inform('text="sending line %d / %d"' % (lineNumber, len(lines)))
-                        self.logger.info('sending line %d / %d', lineNumber, len(lines))
-                    self.logger.debug("sending line %d: %r", lineNumber, fullLine)
-                    if True:
-                        retline = self.sendOneLinePerChar(fullLine)
-                    else:
-                        self.device.write(fullLine.encode('latin-1'))
-                        time.sleep(0.05)
-                        retline = self.device.read(size=len(hexl)+len(eol)+1).decode('latin-1')
-                    self.logger.debug('recv %r' % (retline))
-                    retline = retline.translate(strTrans)
-
-                    if fullLine != retline[:len(fullLine)]:
-                        cmd.warn('text="command echo mismatch. sent %r rcvd %r"' % (fullLine, retline))
-                        self.logger.warn("command echo mismatch. sent %r rcvd %r" % (fullLine, retline))
-                    ret = retline[-1]
-                    lineNumber += 1
-                    if ret == ack or hexl == ':00000001FF':
-                        break
-                    if ret != nak:
-                        raise RuntimeError("unexpected response (%r in %r) after sending line %d" %
-                                           (ret, retline, lineNumber-1))
-                    retries += 1
-                    if retries >= maxRetries:
-                        raise RuntimeError("too many retries (%d) on line %d" %
-                                           (retries, lineNumber-1))
-
+            uploader.send(lines)
             t1 = time.time()
-            
+
         self.logger.info('sent image file %s in %0.2f seconds' % (path, t1-t0))
         cmd.inform('text="sent image file %s in %0.2f seconds"' % (path, t1-t0))
         time.sleep(1)
@@ -259,26 +279,3 @@ class interlock(object):
             if 'Interlock' not in line:
                 self.logger.warn('did not get expected Interlock line after loading image (%s)' % line)
 
-        self.logger.setLevel(logLevel)
-
-
-    def sendOneLinePerChar(self, strline):
-        line = strline.encode('latin-1')
-        ret = bytearray(len(line) + 1)
-        for c_i in range(len(line)):
-            c = line[c_i:c_i+1]
-            self.device.write(c)
-            # time.sleep(0.001)
-            retc = self.device.read(1)
-            if c != retc:
-                raise RuntimeError('boom: mismatch at %d: sent %r but recv %r' % (c_i,c,retc))
-            ret[c_i] = retc[0]
-        ackNak = self.device.read(1)
-        ret[-1] = ackNak[0]
-
-        return ret.decode('latin-1')
-    
-    
-        
-            
-        
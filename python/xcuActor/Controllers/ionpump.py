@@ -1,13 +1,19 @@
 import logging
+import math
 import socket
 import time
 import traceback
 
-import numpy as np
-
 from opscore.utility.qstr import qstr
 from functools import reduce
 
+from xcuActor import deadline
+from xcuActor import readingCache
+from xcuActor import records
+from xcuActor import watchdog
+from xcuActor.Controllers import circuitBreaker
+from xcuActor.Controllers import traceRing
+
 class IncompleteReply(Exception):
     pass
 
@@ -22,14 +28,17 @@ class ConnectTo4UHV:
 
     - allows reuse of existing connection.
     """
-    def __init__(self, cmd, host, port, sock=None, tryFor=3.0, waitTime=0.25):
+    def __init__(self, cmd, host, port, sock=None, tryFor=3.0, waitTime=0.25,
+                 breaker=None, name='ionpump'):
         self.cmd = cmd
+        self.name = name
         self.host = host
         self.port = port
         self.sock = sock
         self.doClose = sock is None
         self.tryFor = tryFor
         self.waitTime = waitTime
+        self.breaker = breaker
 
     def __enter__(self):
         cmd = self.cmd
@@ -37,6 +46,11 @@ class ConnectTo4UHV:
             # cmd.debug(f'text="keeping given socket: {self.sock}"')
             return self.sock
 
+        # Do not spend tryFor seconds on a controller we know to be unreachable.
+        if self.breaker is not None:
+            self.breaker.check()
+        deadline.check(self.name, 'connect')
+
         try:
             self.sock = sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             sock.settimeout(self.waitTime)
@@ -44,12 +58,12 @@ class ConnectTo4UHV:
             cmd.warn('text="failed to create socket to ion pump: %s"' % (e))
             raise
 
-        tryFor = self.tryFor
+        tryFor = deadline.timeout(self.tryFor, self.name, 'connect')
         while tryFor > 0:
             try:
                 cmd.debug(f'text="connecting {sock} to ({self.host}:{self.port}) ({tryFor}s left)"')
                 sock.connect((self.host, self.port))
-                sock.settimeout(1.0)
+                sock.settimeout(deadline.timeout(1.0, self.name, 'recv'))
                 return sock
             except socket.error as e:
                 tryFor -= self.waitTime
@@ -58,6 +72,9 @@ class ConnectTo4UHV:
                     time.sleep(self.waitTime)
                 else:
                     cmd.warn('text="failed to connect to ion pump: %s"' % (e))
+                    deadline.check(self.name, 'connect')
+                    if self.breaker is not None:
+                        self.breaker.failure(e)
                     raise
 
         cmd.warn(f'text="failed to connect to ion pump within {tryFor}s"')
@@ -72,6 +89,9 @@ class ConnectTo4UHV:
             except Exception as e:
                 cmd.warn(f'text="failed to close ionpump: {e}"')
 
+        if exc_type is not None and issubclass(exc_type, deadline.DeadlineExceeded):
+            # Let the command fail, instead of just warning and carrying on.
+            return False
         if exc_type is not None:
             tb0 = traceback.extract_tb(exc_tb)[-1]
             cmd.warn(f'text="error commanding ionpump at {tb0.filename}:{tb0.lineno} -- {exc_type.__name__}: {exc_value}"')
@@ -108,6 +128,17 @@ class ionpump(object):
 
         self.logger.info(f'text="ionpump {self.host}:{self.port} {self.pumpAddrs}"')
 
+        self.trace = traceRing.TraceRing.fromConfig(actor, self.name)
+        self.breaker = circuitBreaker.CircuitBreaker.fromConfig(actor, self.name, trace=self.trace,
+                                                                probe=circuitBreaker.tcpProbe(self.host,
+                                                                                              self.port))
+
+    def connect(self, cmd, sock=None):
+        """ Return a context manager for a (possibly existing) connection to the 4UHV. """
+
+        return ConnectTo4UHV(cmd=cmd, host=self.host, port=self.port, sock=sock,
+                             breaker=self.breaker, name=self.name)
+
     def __str__(self):
         a = self.pumpAddrs
         return f'ionpumps({self.host}:{self.port}; pump1:{a[0]}; pump2:{a[1]})'
@@ -139,8 +170,10 @@ class ionpump(object):
                 cmd.warn('text="failed to read response from ion pump: %s"' % (e))
                 raise
 
-            self.logger.info('received %r', ret1)
-            cmd.diag('text="ionpump received %r"' % ret1)
+            self.trace.recv(ret1)
+            if self.trace.verbose:
+                self.logger.info('received %r', ret1)
+                cmd.diag('text="ionpump received %r"' % ret1)
             ret += ret1
 
             try:
@@ -192,17 +225,22 @@ class ionpump(object):
         coreCmd = b"%s%s\x03" % (busID, cmdStr)
         crc = self.calcCrc(coreCmd)
         fullCmd = b"\x02%s%02X" % (coreCmd, crc)
-        self.logger.info('sending %r to %s:%s:%s', fullCmd, self.host, self.port, busAddr)
-
-        with ConnectTo4UHV(cmd=cmd, host=self.host, port=self.port, sock=sock) as sock:
-            cmd.diag('text="%s sending %s"' % (self.name, fullCmd))
-            try:
-                sock.sendall(fullCmd)
-            except socket.error as e:
-                cmd.warn('text="failed to send command to ion pump: %s"' % (e))
-                raise
+        if self.trace.verbose:
+            self.logger.info('sending %r to %s:%s:%s', fullCmd, self.host, self.port, busAddr)
+
+        with self.connect(cmd, sock=sock) as sock:
+            self.trace.send(fullCmd)
+            if self.trace.verbose:
+                cmd.diag('text="%s sending %s"' % (self.name, fullCmd))
+            with self.breaker.transaction(step=cmdStr.decode('latin-1')), \
+                 watchdog.track(self.actor, self.name, closer=lambda: watchdog.shutdownSocket(sock)):
+                try:
+                    sock.sendall(fullCmd)
+                except socket.error as e:
+                    cmd.warn('text="failed to send command to ion pump: %s"' % (e))
+                    raise
 
-            return self.readOneReply(cmd, sock)
+                return self.readOneReply(cmd, sock)
 
     def parseRawReply(self, raw, cmd):
         if len(raw) < 6:
@@ -269,8 +307,10 @@ class ionpump(object):
         try:
             reply = self.sendReadCommand(pumpIdx, win,
                                          sock=sock, cmd=cmd)
-        except:
-            reply = np.nan
+        except deadline.DeadlineExceeded:
+            raise
+        except Exception:
+            reply = math.nan
 
         return float(reply)
 
@@ -279,8 +319,10 @@ class ionpump(object):
         try:
             reply = self.sendReadCommand(pumpIdx, 800 + 10*channel,
                                          sock=sock, cmd=cmd)
-        except:
-            reply = np.nan
+        except deadline.DeadlineExceeded:
+            raise
+        except Exception:
+            reply = math.nan
 
         return float(reply)
 
@@ -289,8 +331,10 @@ class ionpump(object):
         try:
             reply = self.sendReadCommand(pumpIdx, 801 + 10*channel,
                                          sock=sock, cmd=cmd)
-        except:
-            reply = np.nan
+        except deadline.DeadlineExceeded:
+            raise
+        except Exception:
+            reply = math.nan
 
         return float(reply)
 
@@ -299,8 +343,10 @@ class ionpump(object):
         try:
             reply = self.sendReadCommand(pumpIdx, 802 + 10*channel,
                                          sock=sock, cmd=cmd)
-        except:
-            reply = np.nan
+        except deadline.DeadlineExceeded:
+            raise
+        except Exception:
+            reply = math.nan
 
         return float(reply)
 
@@ -311,10 +357,10 @@ class ionpump(object):
         if newState:
             try:
                 graceTime = self.actor.actorConfig[self.name]['delay']
-            except:
+            except Exception:
                 pass
 
-        with ConnectTo4UHV(cmd=cmd, host=self.host, port=self.port, sock=sock) as sock:
+        with self.connect(cmd, sock=sock) as sock:
             ret = []
             for pumpIdx, pumpAddr in enumerate(self.pumpAddrs):
                 if pumpIdx == 0 and not pump1:
@@ -409,15 +455,15 @@ class ionpump(object):
         return ",".join(errors)
 
     def readOnePump(self, pumpIdx, sock=None, cmd=None):
-        with ConnectTo4UHV(cmd=cmd, host=self.host, port=self.port, sock=sock) as sock:
-            enabled = self.readEnabled(pumpIdx, sock=sock)
+        with self.connect(cmd, sock=sock) as sock:
+            enabled, enabledStamp = readingCache.sample(self.readEnabled, pumpIdx, sock=sock)
 
-            V = self.readVoltage(pumpIdx, cmd=cmd, sock=sock)
-            A = self.readCurrent(pumpIdx, cmd=cmd, sock=sock)
-            p = self.readPressure(pumpIdx, cmd=cmd, sock=sock)
-            t = self.readTemp(pumpIdx, cmd=cmd, sock=sock)
+            V, VStamp = readingCache.sample(self.readVoltage, pumpIdx, cmd=cmd, sock=sock)
+            A, AStamp = readingCache.sample(self.readCurrent, pumpIdx, cmd=cmd, sock=sock)
+            p, pStamp = readingCache.sample(self.readPressure, pumpIdx, cmd=cmd, sock=sock)
+            t, tStamp = readingCache.sample(self.readTemp, pumpIdx, cmd=cmd, sock=sock)
 
-            err = self.readError(pumpIdx, cmd=cmd, sock=sock)
+            err, errStamp = readingCache.sample(self.readError, pumpIdx, cmd=cmd, sock=sock)
 
             # INSTRM-594, INSTRM-758: create synthetic error when pump is on but not indicating current or pressure.
             doTurnOff = False
@@ -448,6 +494,11 @@ class ionpump(object):
             if self.commandedOn[pumpIdx] is None:
                 self.commandedOn[pumpIdx] = enabled
 
+            readingName = f'{self.name}.pump{pumpIdx+1}'
+            stamps = (enabledStamp, VStamp, AStamp, tStamp, pStamp, errStamp)
+            reading = records.IonPump(enabled, V, A, t, p, err, stamp=readingCache.spanning(stamps))
+            self.actor.readings.put(readingName, reading, stamps=stamps)
+
             if cmd is not None:
                 cmdFunc = cmd.inform if err == 0 else cmd.warn
                 errString = self._makeErrorString(err)
@@ -458,9 +509,10 @@ class ionpump(object):
                 cmdFunc('ionPump%dErrors=0x%05x,%s,%s' % (pumpIdx+1, err,
                                                           "OK" if errString == "OK" else "ERROR",
                                                           qstr(errString)))
+                self.actor.readings.genTimesKey(cmd, 'ionPump%d' % (pumpIdx+1), readingName)
             if doTurnOff:
                 # Just turn off a single pump
                 self.off(cmd=cmd, sock=sock,
                          pump1=(pumpIdx==0), pump2=(pumpIdx==1))
 
-            return enabled,V,A,p
+            return reading
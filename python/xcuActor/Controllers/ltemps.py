@@ -1,16 +1,23 @@
 from builtins import range
 from builtins import object
 import logging
+import math
 import socket
 import time
 
-import numpy as np
+from xcuActor import deadline
+from xcuActor import readingCache
+from xcuActor import records
+from xcuActor import watchdog
+from xcuActor.Controllers import circuitBreaker
+from xcuActor.Controllers import traceRing
 
 class ltemps(object):
     def __init__(self, actor, name,
                  loglevel=logging.INFO):
 
         self.actor = actor
+        self.name = name
         self.logger = logging.getLogger('ltemps')
         self.logger.setLevel(loglevel)
 
@@ -19,6 +26,10 @@ class ltemps(object):
         self.host = self.actor.actorConfig[self.name]['host']
         self.port = self.actor.actorConfig[self.name]['port']
 
+        self.trace = traceRing.TraceRing.fromConfig(actor, self.name)
+        self.breaker = circuitBreaker.CircuitBreaker.fromConfig(actor, self.name, trace=self.trace,
+                                                                probe=lambda: self.sendOneCommand('*IDN?'))
+
     def start(self):
         pass
 
@@ -30,54 +41,67 @@ class ltemps(object):
             cmd = self.actor.bcast
 
         fullCmd = "%s%s" % (cmdStr, self.EOL)
-        self.logger.debug('sending %r', fullCmd)
-        cmd.diag('text="sending %r"' % fullCmd)
-
-        try:
-            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            s.settimeout(1.0)
-        except socket.error as e:
-            cmd.warn('text="failed to create socket to ltemps: %s"' % (e))
-            raise
- 
-        try:
-            s.connect((self.host, self.port))
-            s.sendall(fullCmd)
-        except socket.error as e:
-            cmd.warn('text="failed to create connect or send to ltemps: %s"' % (e))
-            raise
-
-        try:
-            ret = s.recv(1024)
-        except socket.error as e:
-            cmd.warn('text="failed to read response from ltemps: %s"' % (e))
-            raise
-
-        self.logger.debug('received %r', ret)
-        cmd.diag('text="received %r"' % ret)
-        s.close()
+        self.trace.send(fullCmd)
+        if self.trace.verbose:
+            self.logger.debug('sending %r', fullCmd)
+            cmd.diag('text="sending %r"' % fullCmd)
+
+        with self.breaker.transaction(step=cmdStr), \
+             watchdog.track(self.actor, self.name, closer=lambda: watchdog.shutdownSocket(s)):
+            try:
+                s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                s.settimeout(deadline.timeout(1.0, self.name, cmdStr))
+            except socket.error as e:
+                cmd.warn('text="failed to create socket to ltemps: %s"' % (e))
+                raise
+
+            try:
+                s.connect((self.host, self.port))
+                s.sendall(fullCmd.encode('latin-1'))
+            except socket.error as e:
+                cmd.warn('text="failed to create connect or send to ltemps: %s"' % (e))
+                s.close()
+                raise
+
+            try:
+                ret = s.recv(1024)
+            except socket.error as e:
+                cmd.warn('text="failed to read response from ltemps: %s"' % (e))
+                raise
+            finally:
+                s.close()
+
+        self.trace.recv(ret)
+        if self.trace.verbose:
+            self.logger.debug('received %r', ret)
+            cmd.diag('text="received %r"' % ret)
 
         return ret
 
     def getTemps(self, cmd=None):
         temps = []
+        stamps = []
         cmdStr = 'KRDG? %s'
 
         controller = 'D'
         for probe in range(1,5):
             s = "%s%d" % (controller, probe)
-            reply = self.sendOneCommand(cmdStr % s,
-                                        cmd=cmd)
+            reply, stamp = readingCache.sample(self.sendOneCommand, cmdStr % s,
+                                               cmd=cmd)
 
             try:
                 temp = float(reply)
             except:
-                temp = np.nan
+                temp = math.nan
 
             temps.append(temp)
+            stamps.append(stamp)
 
+        temps = records.LTemps(*temps, stamp=readingCache.spanning(stamps))
+        self.actor.readings.put(f'{self.name}.temps', temps, stamps=stamps)
         if cmd is not None:
             cmd.inform('ltemps=%s' % (','.join(["%g" % (t) for t in temps])))
+            self.actor.readings.genTimesKey(cmd, 'ltemps', f'{self.name}.temps')
             
         return temps
 
@@ -6,6 +6,14 @@ import time
 
 from opscore.utility.qstr import qstr
 
+from xcuActor import deadline
+from xcuActor import readingCache
+from xcuActor import records
+from xcuActor import watchdog
+from xcuActor.Controllers import circuitBreaker
+from xcuActor.Controllers import traceRing
+from xcuActor.Controllers import singleFlight
+
 class rough(object):
     def __init__(self, actor, name,
                  loglevel=logging.INFO):
@@ -20,6 +28,11 @@ class rough(object):
         self.host = self.actor.actorConfig[self.name]['host']
         self.port = self.actor.actorConfig[self.name]['port']
 
+        self.trace = traceRing.TraceRing.fromConfig(actor, self.name)
+        self.breaker = circuitBreaker.CircuitBreaker.fromConfig(actor, self.name, trace=self.trace,
+                                                                probe=self.ident)
+        self.flights = singleFlight.SingleFlight(self.name)
+
     def start(self, cmd=None):
         pass
 
@@ -34,34 +47,48 @@ class rough(object):
             cmdStr = cmdStr.encode('latin-1')
         except AttributeError:
             pass
-        
-        fullCmd = b"%s%s" % (cmdStr, self.EOL)
-        self.logger.info('sending %r', fullCmd)
-        cmd.diag('text="sending %r"' % fullCmd)
 
-        try:
-            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            s.settimeout(1.0)
-        except socket.error as e:
-            cmd.warn('text="failed to create socket to rough: %s"' % (e))
-            raise
- 
-        try:
-            s.connect((self.host, self.port))
-            s.sendall(fullCmd)
-        except socket.error as e:
-            cmd.warn('text="failed to create connect or send to rough: %s"' % (e))
-            raise
-
-        try:
-            ret = s.recv(1024)
-        except socket.error as e:
-            cmd.warn('text="failed to read response from rough: %s"' % (e))
-            raise
+        # "?" commands are queries, "!" commands change things.
+        if cmdStr.startswith(b'?'):
+            return self.flights.do(cmdStr, lambda: self._sendOneCommand(cmdStr, cmd=cmd))
+        return self._sendOneCommand(cmdStr, cmd=cmd)
 
-        self.logger.info('received %r', ret)
-        cmd.diag('text="received %r"' % ret)
-        s.close()
+    def _sendOneCommand(self, cmdStr, cmd=None):
+        fullCmd = b"%s%s" % (cmdStr, self.EOL)
+        self.trace.send(fullCmd)
+        if self.trace.verbose:
+            self.logger.info('sending %r', fullCmd)
+            cmd.diag('text="sending %r"' % fullCmd)
+
+        with self.breaker.transaction(step=cmdStr.decode('latin-1')), \
+             watchdog.track(self.actor, self.name, closer=lambda: watchdog.shutdownSocket(s)):
+            try:
+                s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                s.settimeout(deadline.timeout(1.0, self.name, cmdStr.decode('latin-1')))
+            except socket.error as e:
+                cmd.warn('text="failed to create socket to rough: %s"' % (e))
+                raise
+
+            try:
+                s.connect((self.host, self.port))
+                s.sendall(fullCmd)
+            except socket.error as e:
+                cmd.warn('text="failed to create connect or send to rough: %s"' % (e))
+                s.close()
+                raise
+
+            try:
+                ret = s.recv(1024)
+            except socket.error as e:
+                cmd.warn('text="failed to read response from rough: %s"' % (e))
+                raise
+            finally:
+                s.close()
+
+        self.trace.recv(ret)
+        if self.trace.verbose:
+            self.logger.info('received %r', ret)
+            cmd.diag('text="received %r"' % ret)
 
         return ret
 
@@ -165,38 +192,40 @@ class rough(object):
     def speed(self, cmd=None):
         cmdStr = b'?V802'
 
-        ret = self.sendOneCommand(cmdStr, cmd=cmd)
+        ret, stamp = readingCache.sample(self.sendOneCommand, cmdStr, cmd=cmd)
         status = self.parseReply(cmdStr, ret, cmd=cmd)
 
         rpm =  int(status[0]) * 60
         status = int(status[1], base=16)
+        speed = records.PumpSpeed(rpm, status, stamp=stamp)
+        self.actor.readings.put(f'{self.name}.speed', speed)
         
         cmd.inform('roughSpeed=%s' % (rpm))
         self.statusWord(status, cmd=cmd)
         
-        return rpm, status
+        return speed
         
     def pumpTemps(self, cmd=None):
         cmdStr = b'?V808'
 
-        ret = self.sendOneCommand(cmdStr, cmd=cmd)
-        speeds = self.parseReply(cmdStr, ret, cmd=cmd)
+        ret, stamp = readingCache.sample(self.sendOneCommand, cmdStr, cmd=cmd)
+        reply = self.parseReply(cmdStr, ret, cmd=cmd)
+        temps = records.PumpTemps(*[float(t) for t in reply[:2]], stamp=stamp)
+        self.actor.readings.put(f'{self.name}.temps', temps)
 
-        cmd.inform('roughTemps=%s,%s' % (speeds[0], speeds[1]))
+        cmd.inform('roughTemps=%g,%g' % (temps.temp1, temps.temp2))
         
-        return speeds
+        return temps
         
     def status(self, cmd=None):
-        reply = []
-        
+        """ Return the speed and temperatures, as a records.RoughStatus. """
+
         speeds = self.speed(cmd=cmd)
         #VAW = self.pumpVAW(cmd=cmd)
         temps = self.pumpTemps(cmd=cmd)
-        reply.extend(speeds)
-        #reply.extend(VAW)
-        reply.extend(temps)
         
-        return reply
+        return records.RoughStatus(*speeds, *temps,
+                                   stamp=readingCache.spanning((speeds.stamp, temps.stamp)))
 
     def pumpCmd(self, cmdStr, cmd=None):
         if cmd is None:
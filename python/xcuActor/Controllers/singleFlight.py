@@ -0,0 +1,103 @@
+import logging
+import threading
+
+from xcuActor import deadline
+
+class _Flight(object):
+    """ One call in progress, and what came of it. """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+class SingleFlight(object):
+    """ Coalesce identical concurrent device queries into one transaction.
+
+    If a call with the same key is already in flight, later callers wait
+    for it and get its result instead of queueing a duplicate
+    transaction behind it. Only use this for read-only queries: a
+    command which changes the device must always be sent.
+
+    If the call fails, each waiting caller gets its own copy of the
+    exception. If it fails because the caller which made it ran out of
+    time, the others are not bound by that caller's deadline, and try
+    again: one of them makes the call.
+
+    Args
+    ----
+    name : `str`
+       the device name, used for the keyword.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.logger = logging.getLogger(f'{name}.flights')
+        self.lock = threading.Lock()
+        self.flights = dict()
+
+        self.calls = 0
+        self.saved = 0
+
+    def do(self, key, func):
+        """ Return func(), or the result of an identical call already in flight. """
+
+        with self.lock:
+            self.calls += 1
+
+        while True:
+            with self.lock:
+                flight = self.flights.get(key)
+                if flight is not None:
+                    flight.followers += 1
+                    isLeader = False
+                else:
+                    flight = _Flight()
+                    self.flights[key] = flight
+                    isLeader = True
+
+            if isLeader:
+                break
+
+            # Do not wait on someone else's call longer than our own command allows.
+            budget = deadline.current()
+            if not flight.done.wait(None if budget is None else max(budget.remaining, 0.0)):
+                raise budget.exceeded(self.name, f'waiting for {key!r}')
+            if isinstance(flight.error, deadline.DeadlineExceeded):
+                self.logger.debug('%r: the caller ran out of time; trying again', key)
+                continue
+            with self.lock:
+                self.saved += 1
+            if flight.error is None:
+                return flight.result
+            raise _copyError(flight.error) from None
+
+        try:
+            flight.result = func()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+            if flight.followers > 0:
+                self.logger.debug('%r answered %d extra callers', key, flight.followers)
+
+        return flight.result
+
+    def getKey(self):
+        with self.lock:
+            return f'{self.name}Flights={self.calls},{self.saved}'
+
+    def genKeys(self, cmd):
+        cmd.inform(self.getKey())
+
+def _copyError(e):
+    """ Return a new exception like e, so that each waiting thread raises its own. """
+
+    try:
+        return type(e)(*e.args)
+    except Exception:
+        return RuntimeError(str(e))
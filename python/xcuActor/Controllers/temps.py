@@ -1,10 +1,13 @@
-from importlib import reload
-
 import logging
 import socket
 
 import xcuActor.Controllers.bufferedSocket as bufferedSocket
-reload(bufferedSocket)
+from xcuActor import deadline
+from xcuActor import readingCache
+from xcuActor import records
+from xcuActor import watchdog
+from xcuActor.Controllers import circuitBreaker
+from xcuActor.Controllers import traceRing
 
 class NonClosingSocket(object):
     def __init__(self, s):
@@ -20,6 +23,7 @@ class DeviceIO(object):
                  keepOpen=False,
                  loglevel=logging.DEBUG):
 
+        self.name = name
         self.logger = logging.getLogger('temps')
         self.logger.setLevel(loglevel)
 
@@ -49,17 +53,24 @@ class DeviceIO(object):
         socket.socket.close(s)
         
 class SocketIO(DeviceIO):
-    def __init__(self, host, port, *argl, **argv):
+    def __init__(self, host, port, *argl, breaker=None, trace=None, actor=None, **argv):
         DeviceIO.__init__(self, *argl, **argv)
         self.host = host
         self.port = port
-
-        self.ioBuffer = bufferedSocket.BufferedSocket('tempsio')
+        self.actor = actor
+        if breaker is None:
+            breaker = circuitBreaker.CircuitBreaker(self.name)
+        self.breaker = breaker
+        if trace is None:
+            trace = traceRing.TraceRing(self.name)
+        self.trace = trace
+
+        self.ioBuffer = bufferedSocket.BufferedSocket('tempsio', trace=self.trace)
         
     def _connect(self, cmd=None, timeout=1.0):
         try:
             s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            s.settimeout(timeout)
+            s.settimeout(deadline.timeout(timeout, self.name, 'connect'))
         except Exception as e:
             if cmd is not None:
                 cmd.warn('text="failed to create socket: %s"' % (e))
@@ -78,6 +89,7 @@ class SocketIO(DeviceIO):
         if sock is None:
             sock = self.connect(cmd=cmd)
             
+        timeout = deadline.timeout(timeout, self.name, 'readOneLine')
         ret = self.ioBuffer.getOneResponse(sock, timeout=timeout, cmd=cmd)
         
         sock.close()
@@ -92,22 +104,28 @@ class SocketIO(DeviceIO):
             cmdStr = cmdStr.encode('latin-1')
             
         fullCmd = b"%s%s" % (cmdStr, self.EOL)
-        self.logger.debug('sending %r', fullCmd)
-        cmd.diag('text="sending %r"' % fullCmd)
+        self.trace.send(fullCmd)
+        if self.trace.verbose:
+            self.logger.debug('sending %r', fullCmd)
+            cmd.diag('text="sending %r"' % fullCmd)
 
-        if sock is None:
-            sock = self.connect()
-        
-        try:
-            sock.sendall(fullCmd)
-        except socket.error as e:
-            cmd.warn('text="failed to create send command to %s: %s"' % (self.name, e))
-            raise
+        with self.breaker.transaction(step=cmdStr.decode('latin-1')), \
+             watchdog.track(self.actor, self.name, closer=lambda: watchdog.shutdownSocket(sock)):
+            if sock is None:
+                sock = self.connect()
+
+            try:
+                sock.sendall(fullCmd)
+            except socket.error as e:
+                cmd.warn('text="failed to create send command to %s: %s"' % (self.name, e))
+                raise
 
-        ret = self.readOneLine(sock=sock, cmd=cmd)
+            ret = self.breaker.reply(self.readOneLine(sock=sock, cmd=cmd), step=fullCmd)
 
-        self.logger.debug('received %r', ret)
-        cmd.diag('text="received %r"' % ret)
+        self.trace.recv(ret)
+        if self.trace.verbose:
+            self.logger.debug('received %r', ret)
+            cmd.diag('text="received %r"' % ret)
 
         return ret.strip()
 
@@ -125,8 +143,14 @@ class temps(object):
         host = self.actor.actorConfig[self.name]['host']
         port = self.actor.actorConfig[self.name]['port']
 
+        self.trace = traceRing.TraceRing.fromConfig(actor, self.name)
+        self.breaker = circuitBreaker.CircuitBreaker.fromConfig(actor, self.name, trace=self.trace,
+                                                                probe=lambda: self.tempsCmd('?K1'))
         self.dev = SocketIO(host, port, name, self.EOL,
                             keepOpen=False,
+                            breaker=self.breaker,
+                            trace=self.trace,
+                            actor=actor,
                             loglevel=loglevel)
 
         self.heaters = dict(asic=1, ccd=2, h4=2)
@@ -207,8 +231,21 @@ class temps(object):
             sensors = list(range(12))
 
         replies = ["nan"]*12
+        stamps = [None]*12
+
+        # For a partial read, keep the other channels from the last reading.
+        last = self.actor.readings.get(f'{self.name}.temps')
+        if len(sensors) < 12 and last is not None:
+            replies = list(last.value)
+            stamps = [last.stampOf(i) for i in range(12)]
+
         for s_i in sensors:
-            replies[s_i] = self.dev.sendOneCommand('?K%d' % (s_i + 1), cmd=cmd)
-        values = [float(s) for s in replies]
+            replies[s_i], stamps[s_i] = readingCache.sample(self.dev.sendOneCommand,
+                                                            '?K%d' % (s_i + 1), cmd=cmd)
+        if None in stamps:
+            return records.Temps(*[float(s) for s in replies])
+
+        values = records.Temps(*[float(s) for s in replies], stamp=readingCache.spanning(stamps))
+        self.actor.readings.put(f'{self.name}.temps', values, stamps=stamps)
 
         return values
@@ -0,0 +1,89 @@
+import collections
+import logging
+import time
+
+from opscore.utility.qstr import qstr
+
+class TraceRing(object):
+    """ The last few raw exchanges with a device, kept cheaply and only formatted on demand.
+
+    Each entry is (monotonic time, direction, raw data). Appending to
+    the ring does no formatting and sends nothing, so it can be left on
+    for every transaction. The ring is rendered by "trace ... dump", and
+    written to the log when a transaction fails with a communication
+    error.
+
+    The per-transaction diag and log lines the controllers used to
+    generate are only produced when .verbose is set.
+
+    Args
+    ----
+    name : `str`
+       the device name.
+    size : `int`
+       how many entries to keep.
+    verbose : `bool`
+       whether controllers should also generate per-transaction diag/log lines.
+    """
+
+    SEND = '>'
+    RECV = '<'
+    NOTE = '#'
+
+    def __init__(self, name, size=256, verbose=False):
+        self.name = name
+        self.verbose = verbose
+        self.entries = collections.deque(maxlen=size)
+        self.logger = logging.getLogger(f'{name}.trace')
+
+    @classmethod
+    def fromConfig(cls, actor, name):
+        """ Create a ring, taking traceSize/traceVerbose from actorConfig[name]. """
+
+        argv = dict()
+        try:
+            cfg = actor.actorConfig[name]
+            if 'traceSize' in cfg:
+                argv['size'] = int(cfg['traceSize'])
+            if 'traceVerbose' in cfg:
+                argv['verbose'] = bool(cfg['traceVerbose'])
+        except Exception:
+            pass
+
+        return cls(name, **argv)
+
+    def send(self, data):
+        self.entries.append((time.monotonic(), self.SEND, data))
+
+    def recv(self, data):
+        self.entries.append((time.monotonic(), self.RECV, data))
+
+    def note(self, text):
+        self.entries.append((time.monotonic(), self.NOTE, text))
+
+    def clear(self):
+        self.entries.clear()
+
+    def format(self, n=None):
+        """ Return the last n entries as lines of text, with times relative to now. """
+
+        entries = list(self.entries)
+        if n is not None:
+            entries = entries[-n:]
+        now = time.monotonic()
+        return ['%s %9.3f %s %r' % (self.name, t - now, direction, data)
+                for t, direction, data in entries]
+
+    def dump(self, cmd, n=None):
+        """ Send the last n entries to cmd, one inform per line. """
+
+        lines = self.format(n)
+        for l in lines:
+            cmd.inform('text=%s' % (qstr(l)))
+        return len(lines)
+
+    def logDump(self, reason, n=50):
+        """ Write the last n entries to the log, e.g. after a communication error. """
+
+        lines = self.format(n)
+        self.logger.warning('%s; last %d exchanges:\n%s', reason, len(lines), '\n'.join(lines))
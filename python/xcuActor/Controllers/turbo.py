@@ -5,6 +5,14 @@ import serial
 
 from opscore.utility.qstr import qstr
 
+from xcuActor import deadline
+from xcuActor import readingCache
+from xcuActor import records
+from xcuActor import watchdog
+from xcuActor.Controllers import circuitBreaker
+from xcuActor.Controllers import traceRing
+from xcuActor.Controllers import singleFlight
+
 class turbo(object):
     def __init__(self, actor, name,
                  loglevel=logging.INFO):
@@ -27,6 +35,11 @@ class turbo(object):
                               timeout=2.0)
         self.connect()
 
+        self.trace = traceRing.TraceRing.fromConfig(actor, self.name)
+        self.breaker = circuitBreaker.CircuitBreaker.fromConfig(actor, self.name, trace=self.trace,
+                                                                probe=self.ident)
+        self.flights = singleFlight.SingleFlight(self.name)
+
     def __str__(self):
         return ("Turbo(port=%s, device=%s)" %
                 (self.devConfig['port'],
@@ -38,6 +51,17 @@ class turbo(object):
     def stop(self, cmd=None):
         pass
 
+    def setReadTimeout(self, timeout):
+        # Changing the timeout reconfigures the port, so only do it when necessary.
+        if self.device.timeout != timeout:
+            self.device.timeout = timeout
+
+    def closeDevice(self):
+        """ Close the serial port, e.g. to unblock a stuck read. The next command reopens it. """
+
+        if self.device is not None:
+            self.device.close()
+
     def connect(self):
         """ Establish a new connection to the GV interlock. Any old connection is closed.  """
 
@@ -48,12 +72,24 @@ class turbo(object):
         self.device = serial.Serial(**self.devConfig)
 
     def sendOneCommand(self, cmdStr, cmd=None):
+        # "?" commands are queries, "!" commands change things.
+        if cmdStr.startswith('?'):
+            return self.flights.do(cmdStr, lambda: self._sendOneCommand(cmdStr, cmd=cmd))
+        return self._sendOneCommand(cmdStr, cmd=cmd)
+
+    def _sendOneCommand(self, cmdStr, cmd=None):
         fullCmd = "%s%s" % (cmdStr, self.EOL)
         writeCmd = fullCmd.encode('latin-1')
-        with self.deviceLock:
-            if cmd is not None:
-                cmd.debug('text="sending %r"' % fullCmd)
-            self.logger.debug("sending command :%r:" % (fullCmd))
+        with self.breaker.transaction(step=cmdStr), self.deviceLock, \
+             watchdog.track(self.actor, self.name, closer=self.closeDevice):
+            if self.device is None or not self.device.is_open:
+                self.connect()
+            self.setReadTimeout(deadline.timeout(self.devConfig['timeout'], self.name, cmdStr))
+            self.trace.send(writeCmd)
+            if self.trace.verbose:
+                if cmd is not None:
+                    cmd.debug('text="sending %r"' % fullCmd)
+                self.logger.debug("sending command :%r:", fullCmd)
             try:
                 self.device.write(writeCmd)
             except serial.writeTimeoutError:
@@ -96,10 +132,14 @@ class turbo(object):
                 break
             response += c
 
-        if cmd is not None:
-            cmd.debug('text="recv %r"' % response)
-            
-        self.logger.debug("received :%r:" % (response))
+        self.trace.recv(response)
+        if self.trace.verbose:
+            if cmd is not None:
+                cmd.debug('text="recv %r"' % response)
+            self.logger.debug("received :%r:", response)
+        if response == '' and c == '':
+            raise EOFError(f"no response from {self.name}")
+
         return response.strip()
 
     def parseReply(self, cmdStr, reply, cmd=None):
@@ -209,7 +249,14 @@ class turbo(object):
 
         return allFlags
                  
-    def speed(self, cmd=None):
+    def speed(self, cmd=None, maxAge=0.0):
+        """ Return the records.PumpSpeed (rpm, status) of the pump, as read no more than maxAge seconds ago. """
+
+        return self.actor.readings.fetch(f'{self.name}.speed',
+                                         lambda: self._readSpeed(cmd=cmd),
+                                         maxAge=maxAge)
+
+    def _readSpeed(self, cmd=None):
         cmdStr = '?V852'
 
         ret = self.sendOneCommand(cmdStr, cmd=cmd)
@@ -221,45 +268,47 @@ class turbo(object):
         cmd.inform('turboSpeed=%s' % (rpm))
         self.statusWord(status, cmd=cmd)
         
-        return rpm, status
+        return records.PumpSpeed(rpm, status)
         
     def pumpTemps(self, cmd=None):
         cmdStr = '?V859'
 
-        ret = self.sendOneCommand(cmdStr, cmd=cmd)
-        speeds = self.parseReply(cmdStr, ret, cmd=cmd)
+        ret, stamp = readingCache.sample(self.sendOneCommand, cmdStr, cmd=cmd)
+        reply = self.parseReply(cmdStr, ret, cmd=cmd)
+        temps = records.PumpTemps(*[float(t) for t in reply[:2]], stamp=stamp)
+        self.actor.readings.put(f'{self.name}.temps', temps)
 
-        cmd.inform('turboTemps=%s,%s' % (speeds[0], speeds[1]))
+        cmd.inform('turboTemps=%g,%g' % (temps.temp1, temps.temp2))
         
-        return speeds
+        return temps
         
     def pumpVAW(self, cmd=None):
         cmdStr = '?V860'
 
-        ret = self.sendOneCommand(cmdStr, cmd=cmd)
+        ret, stamp = readingCache.sample(self.sendOneCommand, cmdStr, cmd=cmd)
         pumpStat = self.parseReply(cmdStr, ret, cmd=cmd)
 
         V, A, W = [float(i) for i in pumpStat]
         V /= 10.0
         A /= 10.0
         W /= 10.0
+        VAW = records.PumpVAW(V, A, W, stamp=stamp)
+        self.actor.readings.put(f'{self.name}.VAW', VAW)
 
         if cmd is not None:
             cmd.inform('turboVAW=%g,%g,%g' % (V,A,W))
             
-        return V,A,W
+        return VAW
         
     def status(self, cmd=None):
-        reply = []
-        
+        """ Return the speed, power and temperatures, as a records.TurboStatus. """
+
         speeds = self.speed(cmd=cmd)
         VAW = self.pumpVAW(cmd=cmd)
         temps = self.pumpTemps(cmd=cmd)
-        reply.extend(speeds)
-        reply.extend(VAW)
-        reply.extend(temps)
         
-        return reply
+        return records.TurboStatus(*speeds, *VAW, *temps,
+                                   stamp=readingCache.spanning((speeds.stamp, VAW.stamp, temps.stamp)))
 
     def pumpCmd(self, cmdStr, cmd=None):
         if cmd is None:
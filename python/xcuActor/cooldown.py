@@ -0,0 +1,221 @@
+""" Follow a cooldown: cooling rates and time-to-target for the temps board channels and the cooler tip.
+
+A CooldownEstimator takes every temps board poll (12 channels) and
+every cooler poll (the tip temperature, and the setpoint as its
+target), and keeps, for all 13 channels at once:
+
+  - an exponentially weighted average of the sample-to-sample dT/dt,
+    which follows quick changes, and
+  - a recursive least-squares fit of T = a + b(t - now) with a
+    forgetting time, which gives a steadier slope b and the current
+    temperature a, from which we get the time to each channel's target.
+
+Each poll updates all channels with a few array operations. The fit is
+re-centred on the latest sample every time, so a stays the current
+temperature and the numbers stay well conditioned.
+
+We generate coolRates (K/h, from the fits) and coolEta (seconds, nan for
+channels without a target or not heading for it), and warn with
+coolRateOutlier when one channel's rate departs from the others, which
+is what a loose thermal strap or a failing sensor looks like.
+
+Settings come from the optional "cooldown" config section: targets (a
+list of 12 temps board targets in K; null for none), memory, ewTime,
+reportInterval, and outlierSigma.
+"""
+
+import logging
+import threading
+
+from xcuActor.lazyImport import LazyModule
+np = LazyModule('numpy')
+
+class CooldownEstimator(object):
+    nTemps = 12
+    TIP = 12
+
+    def __init__(self, actor=None, targets=None, memory=3600.0, ewTime=1800.0,
+                 reportInterval=60.0, outlierSigma=5.0):
+        self.actor = actor
+        self.logger = logging.getLogger('cooldown')
+        self.lock = threading.Lock()
+
+        self.names = [f'temps{i+1}' for i in range(self.nTemps)] + ['coolerTip']
+        self.memory = memory
+        self.ewTime = ewTime
+        self.reportInterval = reportInterval
+        self.outlierSigma = outlierSigma
+
+        # Fits closer than this to their target are there, K.
+        self.targetTolerance = 0.5
+        # The plausible range of a real reading, K.
+        self.validRange = (1.0, 400.0)
+
+        # Initial fit covariance: intercept in K^2, slope in (K/s)^2.
+        self.initialP = np.diag([1e4, 1e-2])
+
+        self.targets = np.full(self.nTemps + 1, np.nan)
+        if targets is not None:
+            self.targets[:self.nTemps] = [np.nan if t is None else float(t) for t in targets]
+
+        self.reset()
+
+    @classmethod
+    def fromConfig(cls, actor):
+        try:
+            cfg = dict(actor.actorConfig['cooldown'])
+        except Exception:
+            cfg = dict()
+
+        argv = dict()
+        for k in 'memory', 'ewTime', 'reportInterval', 'outlierSigma':
+            if k in cfg:
+                argv[k] = float(cfg[k])
+        if 'targets' in cfg:
+            argv['targets'] = cfg['targets']
+        return cls(actor, **argv)
+
+    def reset(self):
+        n = self.nTemps + 1
+        with self.lock:
+            self.lastTime = np.full(n, np.nan)
+            self.lastTemp = np.full(n, np.nan)
+            self.ewSlope = np.zeros(n)
+            self.theta = np.zeros((n, 2))
+            self.P = np.tile(self.initialP, (n, 1, 1))
+            self.nSamples = np.zeros(n, dtype='i4')
+            self.lastReport = None
+            self.outliers = set()
+
+    def putReading(self, name, reading):
+        """ ReadingCache listener: ingest temps board and cooler readings. """
+
+        n = self.nTemps + 1
+        temps = np.full(n, np.nan)
+        times = np.full(n, np.nan)
+        if name == 'temps.temps':
+            temps[:self.nTemps] = reading.value
+            times[:self.nTemps] = [reading.stampOf(i if reading.stamps else None).mono
+                                   for i in range(self.nTemps)]
+        elif name == 'cooler.temps':
+            temps[self.TIP] = reading.value.tipTemp
+            times[self.TIP] = reading.stampOf(2).mono
+            self.targets[self.TIP] = reading.value.setTemp
+        else:
+            return
+
+        self.add(times, temps)
+
+        if name == 'temps.temps' and self.actor is not None and self.isReportDue(times[0]):
+            self.genKeys(self.actor.bcast)
+
+    def add(self, times, temps):
+        """ Update all channels which have a valid temperature (K) at monotonic time times[i]. """
+
+        lo, hi = self.validRange
+        with np.errstate(invalid='ignore'):
+            valid = np.isfinite(temps) & (temps > lo) & (temps < hi)
+        if not valid.any():
+            return
+
+        with self.lock:
+            first = valid & np.isnan(self.lastTime)
+            dt = np.where(valid & ~first, times - self.lastTime, 0.0)
+            dt = np.maximum(np.nan_to_num(dt), 0.0)
+            update = valid & ~first & (dt > 0)
+
+            # Exponentially weighted sample-to-sample slope, K/s.
+            alpha = np.where(update, -np.expm1(-dt/self.ewTime), 0.0)
+            slope = np.where(update, (temps - self.lastTemp)/np.where(dt > 0, dt, 1.0), 0.0)
+            self.ewSlope += alpha * (slope - self.ewSlope)
+
+            # Move the fits to the new time origin: a' = a + b dt.
+            M = np.zeros((len(dt), 2, 2))
+            M[:, 0, 0] = 1.0
+            M[:, 0, 1] = dt
+            M[:, 1, 1] = 1.0
+            self.theta = np.einsum('nij,nj->ni', M, self.theta)
+            self.P = np.einsum('nij,njk,nlk->nil', M, self.P, M)
+
+            # Start new channels at their first reading.
+            self.theta[first, 0] = temps[first]
+            self.theta[first, 1] = 0.0
+            self.P[first] = self.initialP
+
+            # One RLS step per updated channel, with x = (1, 0) at the new origin.
+            lam = np.where(update, np.exp(-dt/self.memory), 1.0)
+            x = np.array([1.0, 0.0])
+            Px = self.P @ x
+            denom = lam + Px[:, 0]
+            k = Px / denom[:, None]
+            err = np.where(update, temps - self.theta[:, 0], 0.0)
+            self.theta += k * err[:, None]
+            newP = (self.P - np.einsum('ni,nj->nij', k, Px)) / lam[:, None, None]
+            self.P = np.where(update[:, None, None], newP, self.P)
+
+            self.lastTime = np.where(valid, times, self.lastTime)
+            self.lastTemp = np.where(valid, temps, self.lastTemp)
+            self.nSamples += valid
+
+    def rates(self):
+        """ Return the fitted dT/dt of all channels, K/s. nan for channels we have not seen twice. """
+
+        with self.lock:
+            return np.where(self.nSamples > 1, self.theta[:, 1], np.nan)
+
+    def etas(self):
+        """ Return the seconds until each channel reaches its target, from its fit.
+
+        0 if it is there, inf if it is not heading there, nan if it has no target.
+        """
+
+        with self.lock:
+            temp = self.theta[:, 0]
+            rate = np.where(self.nSamples > 1, self.theta[:, 1], np.nan)
+            targets = self.targets.copy()
+
+        togo = targets - temp
+        with np.errstate(divide='ignore', invalid='ignore'):
+            eta = np.where(togo * rate > 0, togo / rate, np.inf)
+        eta = np.where(np.abs(togo) < self.targetTolerance, 0.0, eta)
+        return np.where(np.isfinite(targets) & np.isfinite(rate), eta, np.nan)
+
+    def findOutliers(self):
+        """ Return the channels whose rate is far from the others', as (index, rate, median rate) tuples. """
+
+        with self.lock:
+            rates = np.where(self.nSamples > 1, self.ewSlope, np.nan)
+        good = np.isfinite(rates)
+        if good.sum() < 4:
+            return []
+
+        med = np.median(rates[good])
+        mad = 1.4826 * np.median(np.abs(rates[good] - med))
+        # Channels do cool at somewhat different rates; do not complain about small spreads.
+        scale = max(mad, 0.1 * abs(med), 1e-5)
+        z = np.abs(rates - med) / scale
+        return [(i, rates[i], med) for i in np.flatnonzero(good & (z > self.outlierSigma))]
+
+    def isReportDue(self, now):
+        with self.lock:
+            if self.lastReport is not None and now - self.lastReport < self.reportInterval:
+                return False
+            self.lastReport = now
+            return True
+
+    def genKeys(self, cmd):
+        if cmd is None:
+            return
+
+        rates = self.rates() * 3600
+        etas = self.etas()
+        cmd.inform('coolRates=%s' % (','.join(['%0.3f' % r for r in rates])))
+        cmd.inform('coolEta=%s' % (','.join(['inf' if np.isinf(e) else '%0.0f' % e for e in etas])))
+
+        outliers = self.findOutliers()
+        for i, rate, med in outliers:
+            cmd.warn('coolRateOutlier=%s,%0.3f,%0.3f' % (self.names[i], rate*3600, med*3600))
+        newOutliers = {self.names[o[0]] for o in outliers}
+        if newOutliers - self.outliers:
+            self.logger.warning('cooling rate outliers: %s', sorted(newOutliers))
+        self.outliers = newOutliers
@@ -0,0 +1,103 @@
+""" Time budgets for commands, applied to every device wait made on their behalf.
+
+A Deadline is made for each command (see OurActor.runActorCmd), or
+handed down from a caller, and is kept as the current deadline of the
+thread which runs the command. Controllers do not need to pass it
+around: before each socket or serial wait they ask for
+
+    timeout = deadline.timeout(1.0, self.name, 'recv')
+
+which is the normal timeout clamped to what is left of the current
+budget, and which raises DeadlineExceeded("ran out of time in
+<device>/<step>") if nothing is left. When a clamped wait does time
+out, the device's circuit breaker turns the timeout into the same
+DeadlineExceeded instead of blaming the device.
+
+With no current deadline, everything behaves as before.
+"""
+
+import contextlib
+import threading
+import time
+
+class DeadlineExceeded(RuntimeError):
+    """ A command ran out of time. Not a device failure. """
+    pass
+
+class Deadline(object):
+    def __init__(self, seconds, name=None):
+        self.name = name
+        self.seconds = seconds
+        self.expiresAt = time.monotonic() + seconds
+
+    def __str__(self):
+        return f'Deadline({self.name}, {self.remaining:0.3f}s of {self.seconds:0.3f}s left)'
+
+    @property
+    def remaining(self):
+        return self.expiresAt - time.monotonic()
+
+    @property
+    def expired(self):
+        return self.remaining <= 0
+
+    def exceeded(self, device, step):
+        return DeadlineExceeded(f'ran out of time in {device}/{step} '
+                                f'({self.seconds:0.1f}s allowed for {self.name})')
+
+    def clamp(self, timeout, device, step):
+        """ Return timeout, reduced to the remaining budget. Raise DeadlineExceeded if there is none. """
+
+        remaining = self.remaining
+        if remaining <= 0:
+            raise self.exceeded(device, step)
+        if timeout is None:
+            return remaining
+        return min(timeout, remaining)
+
+_local = threading.local()
+
+def current():
+    """ Return the current thread's deadline, or None. """
+
+    return getattr(_local, 'deadline', None)
+
+@contextlib.contextmanager
+def using(deadline):
+    """ Make deadline (which can be None) current for the enclosed block. """
+
+    old = current()
+    _local.deadline = deadline
+    try:
+        yield deadline
+    finally:
+        _local.deadline = old
+
+def within(seconds, name=None):
+    """ Run the enclosed block within seconds, or within the current deadline if that is sooner.
+
+    seconds can be None, to just keep the current deadline.
+    """
+
+    old = current()
+    if seconds is None:
+        return using(old)
+    new = Deadline(seconds, name=name)
+    if old is not None and old.expiresAt < new.expiresAt:
+        new = old
+    return using(new)
+
+def timeout(default, device, step):
+    """ Return the default timeout, clamped to the current deadline. """
+
+    deadline = current()
+    if deadline is None:
+        return default
+    return deadline.clamp(default, device, step)
+
+def check(device, step):
+    """ Raise DeadlineExceeded if the current deadline has passed. """
+
+    deadline = current()
+    if deadline is not None and deadline.expired:
+        raise deadline.exceeded(device, step)
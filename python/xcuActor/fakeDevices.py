@@ -0,0 +1,323 @@
+""" Fake network device endpoints, for exercising xcu actors without hardware.
+
+Each fake speaks just enough of the real device's line protocol for
+the xcu controllers to poll it: the PCM (including its motor and
+gauge pass-throughs), the Sunpower cryocooler, the temperature board,
+the nXDS roughing pump and the Agilent 4UHV ion pump controller.
+
+All requests to one fake device are serialized through a single lock,
+the way a real MOXA port serializes them on its serial line, and the
+time each request waits for that lock is accounted for. That is the
+"device-side contention" we want to see when many actors share a box.
+"""
+
+import logging
+import random
+import socket
+import socketserver
+import threading
+import time
+from functools import reduce
+
+class DeviceStats(object):
+    """ Thread-safe counters for one fake device. """
+
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.connections = 0
+            self.transactions = 0
+            self.active = 0
+            self.maxActive = 0
+            self.waitTime = 0.0
+            self.maxWait = 0.0
+            self.busyTime = 0.0
+
+    def connected(self):
+        with self.lock:
+            self.connections += 1
+            self.active += 1
+            self.maxActive = max(self.maxActive, self.active)
+
+    def disconnected(self):
+        with self.lock:
+            self.active -= 1
+
+    def transaction(self, waited, busy):
+        with self.lock:
+            self.transactions += 1
+            self.waitTime += waited
+            self.maxWait = max(self.maxWait, waited)
+            self.busyTime += busy
+
+    def asDict(self):
+        with self.lock:
+            return dict(name=self.name,
+                        connections=self.connections,
+                        transactions=self.transactions,
+                        maxActive=self.maxActive,
+                        waitTime=self.waitTime,
+                        maxWait=self.maxWait,
+                        busyTime=self.busyTime)
+
+class FakeDevice(object):
+    """ Base class: split the input stream into requests and answer each one.
+
+    Subclasses set EOL and implement reply(request) -> bytes.
+    """
+
+    EOL = b'\n'
+
+    def __init__(self, name, latency=0.01):
+        self.name = name
+        self.latency = latency
+        self.lineLock = threading.Lock()
+        self.stats = DeviceStats(name)
+        self.logger = logging.getLogger(f'fake.{name}')
+
+    def splitRequests(self, buf):
+        """ Return (complete requests, leftover bytes). """
+
+        parts = buf.split(self.EOL)
+        return parts[:-1], parts[-1]
+
+    def reply(self, request):
+        raise NotImplementedError()
+
+    def transact(self, request):
+        t0 = time.monotonic()
+        with self.lineLock:
+            t1 = time.monotonic()
+            if self.latency > 0:
+                time.sleep(self.latency)
+            ret = self.reply(request)
+            t2 = time.monotonic()
+        self.stats.transaction(t1-t0, t2-t1)
+        return ret
+
+class FakePCM(FakeDevice):
+    """ The PCM: power control, plus the motor and gauge pass-throughs. """
+
+    EOL = b'\n'
+
+    def __init__(self, name='PCM', **argv):
+        FakeDevice.__init__(self, name, **argv)
+        self.powerBits = '11111111'
+        self.pressure = 1.0e-6
+
+    def reply(self, request):
+        req = request.strip()
+        if req.startswith(b'~ge'):
+            return b'NN%s\n' % self.powerBits.encode('latin-1')
+        if req.startswith(b'~rdV') or req.startswith(b'~rdC'):
+            vals = [24.0 + random.gauss(0, 0.05) for i in range(10)]
+            return b'%s\n' % ','.join(['%0.3f' % v for v in vals]).encode('latin-1')
+        if req.startswith(b'~se'):
+            return b'Success\n'
+        if req.startswith(b'~@'):
+            _, _, passThrough = req.split(b',', 2)
+            if passThrough.startswith(b'/1'):
+                # Idle, no error.
+                return b'/0`\n'
+            if passThrough.startswith(b'%'):
+                self.pressure *= random.uniform(0.99, 1.01)
+                return b'%0.3e\n' % (self.pressure)
+        return b'Error: unknown command %s\n' % (req)
+
+class FakeCooler(FakeDevice):
+    """ The Sunpower cryocooler controller: echo the command, then the value(s). """
+
+    EOL = b'\r'
+
+    def __init__(self, name='cooler', **argv):
+        FakeDevice.__init__(self, name, **argv)
+        self.values = {b'COOLER': b'POWER',
+                       b'KP': b'50.0',
+                       b'KI': b'0.5',
+                       b'KD': b'0.0',
+                       b'ERROR': b'00000000',
+                       b'TC': b'77.0',
+                       b'TEMP2': b'30.0',
+                       b'TTARGET': b'77.0'}
+
+    def reply(self, request):
+        req = request.strip()
+        echo = req + b'\r\n'
+        if req == b'E':
+            return echo + b'240.0\r\n70.0\r\n150.0\r\n'
+        key = req.split(b'=')[0]
+        return echo + self.values.get(key, req) + b'\r\n'
+
+class FakeTemps(FakeDevice):
+    """ The temperature board. """
+
+    EOL = b'\n'
+
+    def reply(self, request):
+        req = request.strip()
+        if req == b'?t':
+            vals = [80.0 + random.gauss(0, 0.01) for i in range(12)]
+            return b'%s\n' % ','.join(['%0.4f' % v for v in vals]).encode('latin-1')
+        if req.startswith(b'?K'):
+            return b'%0.4f\n' % (80.0 + random.gauss(0, 0.01))
+        if req[:2] in (b'?F', b'?L'):
+            return b'0\n'
+        if req.startswith(b'?V'):
+            return b'0.0\n'
+        if req.startswith(b'heater status'):
+            return b'mode=0 output=0.0 temp=100.0 setpoint=0.0\n'
+        return b'OK\n'
+
+class FakeRough(FakeDevice):
+    """ The Edwards nXDS roughing pump. """
+
+    EOL = b'\r'
+
+    def reply(self, request):
+        req = request.strip()
+        replies = {b'?S801': b'=S801 nXDS;1.0;1.0',
+                   b'?V802': b'=V802 30;00000090',
+                   b'?V808': b'=V808 35;40'}
+        if req.startswith(b'!'):
+            return b'*%s 0\r' % (req[1:5])
+        return replies.get(req[:5], b'=%s 0' % (req[1:5])) + b'\r'
+
+class FakeIonpump(FakeDevice):
+    """ The Agilent 4UHV, with its STX/ETX/CRC binary framing. """
+
+    EOL = b'\x03'
+
+    def __init__(self, name='ionpump', **argv):
+        FakeDevice.__init__(self, name, **argv)
+        self.registers = dict()
+
+    def splitRequests(self, buf):
+        # Each frame is \x02 ... \x03 CRC CRC
+        reqs = []
+        while True:
+            etx = buf.find(self.EOL)
+            if etx < 0 or len(buf) < etx + 3:
+                return reqs, buf
+            reqs.append(buf[:etx+3])
+            buf = buf[etx+3:]
+
+    @staticmethod
+    def frame(core):
+        crc = reduce(int.__xor__, [c for c in core])
+        return b'\x02%s%02X' % (core, crc)
+
+    def reply(self, request):
+        if request[:1] != b'\x02':
+            return b''
+        addr = request[1:2]
+        win = request[2:5]
+        isWrite = request[5:6] == b'1'
+        if isWrite:
+            self.registers[win] = request[6:-3]
+            return self.frame(addr + b'\x06\x03')
+
+        defaults = {b'011': b'1', b'012': b'1', b'013': b'1', b'014': b'1',
+                    b'206': b'000000'}
+        winNum = int(win)
+        if win in self.registers:
+            value = self.registers[win]
+        elif win in defaults:
+            value = defaults[win]
+        elif winNum % 10 == 0:
+            value = b'005000'
+        elif winNum % 10 == 1:
+            value = b'1.0E-6'
+        elif winNum % 10 == 2:
+            value = b'1.0E-8'
+        else:
+            value = b'000025'
+        return self.frame(addr + win + b'0' + value + b'\x03')
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        device = self.server.device
+        device.stats.connected()
+        buf = b''
+        try:
+            while True:
+                try:
+                    more = self.request.recv(1024)
+                except socket.error:
+                    break
+                if not more:
+                    break
+                buf += more
+                requests, buf = device.splitRequests(buf)
+                for req in requests:
+                    ret = device.transact(req)
+                    if ret:
+                        self.request.sendall(ret)
+        finally:
+            device.stats.disconnected()
+
+class _Server(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, device, host='127.0.0.1', port=0):
+        self.device = device
+        socketserver.ThreadingTCPServer.__init__(self, (host, port), _Handler)
+
+class FakeDeviceFarm(object):
+    """ Run a set of fake devices, each on its own localhost port.
+
+    Args
+    ----
+    devices : dict
+       controller name -> FakeDevice instance. The names are the
+       actorConfig section names: 'PCM', 'cooler', 'temps', 'rough1',
+       'ionpump', etc.
+    """
+
+    def __init__(self, devices, host='127.0.0.1'):
+        self.host = host
+        self.devices = devices
+        self.servers = dict()
+        self.threads = []
+
+    @classmethod
+    def standard(cls, latency=0.01, roughNames=('rough1', 'rough2')):
+        devices = dict(PCM=FakePCM(latency=latency),
+                       cooler=FakeCooler(latency=latency),
+                       temps=FakeTemps('temps', latency=latency),
+                       ionpump=FakeIonpump(latency=latency))
+        for r in roughNames:
+            devices[r] = FakeRough(r, latency=latency)
+        return cls(devices)
+
+    def start(self):
+        for name, device in self.devices.items():
+            server = _Server(device, host=self.host)
+            self.servers[name] = server
+            t = threading.Thread(target=server.serve_forever,
+                                 name=f'fake-{name}', daemon=True)
+            t.start()
+            self.threads.append(t)
+
+    def stop(self):
+        for server in self.servers.values():
+            server.shutdown()
+            server.server_close()
+
+    def endpoints(self):
+        """ Return {name: (host, port)} for all running devices. """
+
+        return {name:server.server_address for name, server in self.servers.items()}
+
+    def configOverrides(self):
+        """ Return actorConfig overrides pointing the controllers at us. """
+
+        return {name:dict(host=host, port=port)
+                for name, (host, port) in self.endpoints().items()}
+
+    def stats(self):
+        return [device.stats.asDict() for device in self.devices.values()]
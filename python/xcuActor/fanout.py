@@ -0,0 +1,311 @@
+""" Run several command handlers at once, as parts of a single command.
+
+The actor runs one command at a time, so a command which wants the
+status of every controller cannot simply queue "<controller> status"
+commands to itself and wait for them. Instead we call the status
+handlers directly, each in its own thread, with a SubCommand standing
+in for the actorcore Command: output is forwarded to the originating
+command, and finish/fail are recorded instead of ending it.
+"""
+
+import logging
+import threading
+import time
+
+from opscore.utility.qstr import qstr
+
+from xcuActor import deadline
+
+class ParsedCommand(object):
+    """ Just enough of a parsed opscore command for our handlers: .name and .keywords. """
+
+    def __init__(self, name, keywords=None):
+        self.name = name
+        self.keywords = keywords if keywords is not None else dict()
+
+class SubCommand(object):
+    """ Stand in for an actorcore Command while running one handler of a fan-out.
+
+    inform/warn/diag/debug go to the parent command. finish() and fail()
+    are recorded, and their responses sent to the parent as inform and
+    warn. Once the fan-out has given up on us, output is only logged.
+    """
+
+    def __init__(self, parent, name, keywords=None):
+        self.parent = parent
+        self.cmd = ParsedCommand(name, keywords)
+        self.logger = logging.getLogger('fanout')
+
+        self.lock = threading.Lock()
+        self.closed = False
+        self.done = threading.Event()
+        self.didFail = False
+        self.failText = None
+
+    @property
+    def isAlive(self):
+        return not self.done.is_set()
+
+    def close(self):
+        """ Stop forwarding output to the parent. """
+        with self.lock:
+            self.closed = True
+
+    def _send(self, level, response):
+        if not response:
+            return
+        with self.lock:
+            if not self.closed:
+                getattr(self.parent, level)(response)
+                return
+        self.logger.info('%s (late %s): %s', self.cmd.name, level, response)
+
+    def diag(self, response=None):
+        self._send('diag', response)
+
+    def debug(self, response=None):
+        self._send('debug', response)
+
+    def inform(self, response=None):
+        self._send('inform', response)
+
+    def respond(self, response=None):
+        self._send('respond', response)
+
+    def warn(self, response=None):
+        self._send('warn', response)
+
+    def finish(self, response=None):
+        self._send('inform', response)
+        self.done.set()
+
+    def fail(self, response=None):
+        self._send('warn', response)
+        self.didFail = True
+        self.failText = response
+        self.done.set()
+
+class Busy(RuntimeError):
+    """ A fan-out call could not get its controller, still in use by an earlier command. """
+    pass
+
+class Outcome(object):
+    """ What happened to one call of a fan-out. """
+
+    OK = 'ok'
+    FAILED = 'failed'
+    TIMEDOUT = 'timedOut'
+    BUSY = 'busy'
+
+    def __init__(self, name):
+        self.name = name
+        self.state = self.TIMEDOUT
+        self.duration = None
+        self.error = None
+
+    def __str__(self):
+        return f'Outcome({self.name}, {self.state}, {self.duration}, {self.error})'
+
+def fanOut(calls, timeout):
+    """ Run each call in its own thread, and wait for all of them up to a common deadline.
+
+    Args
+    ----
+    calls : dict
+       name -> callable, called with no arguments. A call fails by raising.
+    timeout : `float`
+       seconds to wait for all of the calls. Calls still running after
+       that are abandoned (not killed), and marked as timedOut. Each
+       call also runs under that deadline (or the caller's, if sooner),
+       so device waits are cut short.
+
+    Returns
+    -------
+    outcomes : dict
+       name -> Outcome, in the order of calls.
+    """
+
+    t0 = time.time()
+    endTime = t0 + timeout
+    outcomes = dict()
+    threads = []
+    lock = threading.Lock()
+    parentDeadline = deadline.current()
+
+    def run(name, func, outcome):
+        error = None
+        try:
+            with deadline.using(parentDeadline), deadline.within(timeout, name=name):
+                func()
+        except Exception as e:
+            error = e
+        with lock:
+            if outcome.duration is not None:
+                # Already given up on.
+                return
+            outcome.duration = time.time() - t0
+            outcome.error = error
+            if error is None:
+                outcome.state = Outcome.OK
+            elif isinstance(error, Busy):
+                outcome.state = Outcome.BUSY
+            else:
+                outcome.state = Outcome.FAILED
+
+    for name, func in calls.items():
+        outcome = Outcome(name)
+        outcomes[name] = outcome
+        t = threading.Thread(target=run, args=(name, func, outcome),
+                             name=f'fanout-{name}', daemon=True)
+        threads.append(t)
+        t.start()
+
+    for t in threads:
+        t.join(max(0.0, endTime - time.time()))
+
+    with lock:
+        for outcome in outcomes.values():
+            if outcome.duration is None:
+                outcome.state = Outcome.TIMEDOUT
+                outcome.duration = time.time() - t0
+
+    return outcomes
+
+def findHandler(actor, verb, subVerb):
+    """ Return the handler for "<verb> <subVerb> ...", matching verb case-insensitively, or None.
+
+    Also finds commands declared with the subVerb in the verb, as ('rough2 status', '', ...).
+    """
+
+    for cmdSet in actor.commandSets.values():
+        for v in cmdSet.vocab:
+            cmdVerb, args, func = v[:3]
+            argWords = args.split()
+            if (cmdVerb.lower() == verb.lower()
+                and argWords and argWords[0].lstrip('@').strip('()') == subVerb):
+                return cmdVerb, func
+            if cmdVerb.lower() == f'{verb} {subVerb}'.lower() and not argWords:
+                return verb, func
+    return None, None
+
+def uniqueHandlers(handlers, locks):
+    """ Drop handlers which would run the same command as an earlier one.
+
+    Several verbs can map to one method (e.g. "gatevalve status" and
+    "interlock status"). Command sets whose methods serve several
+    controllers, picking one by the verb, set controllerFromVerb, and
+    those are kept once per verb.
+
+    locks is name -> list of locks, as for runHandlers. The locks of a
+    dropped handler are added to those of the one kept. Returns the
+    kept handlers and their locks.
+    """
+
+    kept = dict()
+    unique = dict()
+    uniqueLocks = dict()
+    for name, (verb, handler) in handlers.items():
+        cmdSet = getattr(handler, '__self__', None)
+        key = (handler, verb.lower()) if getattr(cmdSet, 'controllerFromVerb', False) else handler
+        if key in kept:
+            uniqueLocks[kept[key]].extend(locks.get(name, ()))
+            continue
+        kept[key] = name
+        unique[name] = (verb, handler)
+        uniqueLocks[name] = list(locks.get(name, ()))
+    return unique, uniqueLocks
+
+# Stop waiting for a busy controller this long before the deadline, so that it is reported as busy.
+busyMargin = 0.1
+
+def _holdLocks(name, locks):
+    """ Acquire locks, waiting no longer than the current deadline. Returns those held; raises Busy. """
+
+    held = []
+    try:
+        for lock in sorted(set(locks), key=id):
+            wait = deadline.timeout(None, name, 'waiting for the controller')
+            if wait is not None:
+                wait = max(0.0, wait - busyMargin)
+            if not lock.acquire(timeout=-1 if wait is None else wait):
+                raise Busy(f'{name} is still busy with an earlier command')
+            held.append(lock)
+    except BaseException:
+        for lock in reversed(held):
+            lock.release()
+        raise
+    return held
+
+def runHandlers(cmd, handlers, timeout, locks=None):
+    """ Run actor command handlers concurrently, as parts of cmd.
+
+    Args
+    ----
+    cmd : `actorcore.Command`
+       the originating command. It is not finished here.
+    handlers : dict
+       name -> (verb, handler). Each handler is called with a SubCommand
+       whose .cmd.name is verb and which has no keywords.
+    timeout : `float`
+       seconds to wait for all of the handlers.
+    locks : dict
+       name -> list of locks, held for the whole of that handler. Pass
+       the controllers' breaker ioLocks: a handler which we give up on
+       keeps running, and must not interleave its device transactions
+       with the next command's. A handler which cannot get its locks
+       before the deadline is BUSY.
+
+    Returns
+    -------
+    outcomes : dict
+       name -> Outcome. A handler which called cmd.fail() is FAILED, as
+       is one which returned without finishing its command.
+    """
+
+    if locks is None:
+        locks = dict()
+
+    subCmds = dict()
+    calls = dict()
+    for name, (verb, handler) in handlers.items():
+        subCmd = SubCommand(cmd, verb)
+        subCmds[name] = subCmd
+
+        def call(name=name, handler=handler, subCmd=subCmd):
+            held = _holdLocks(name, locks.get(name, ()))
+            try:
+                handler(subCmd)
+            finally:
+                for lock in reversed(held):
+                    lock.release()
+            if subCmd.didFail:
+                raise RuntimeError(subCmd.failText)
+            if subCmd.isAlive:
+                raise RuntimeError('handler returned without finishing')
+
+        calls[name] = call
+
+    outcomes = fanOut(calls, timeout)
+    for subCmd in subCmds.values():
+        subCmd.close()
+
+    return outcomes
+
+def outcomesKey(keyName, outcomes):
+    """ Return a keyword listing name,state,duration for each outcome. """
+
+    parts = []
+    for o in outcomes.values():
+        parts.extend([o.name, o.state, '%0.3f' % (o.duration)])
+    return '%s=%s' % (keyName, ','.join(parts))
+
+def warnAboutOutcomes(cmd, outcomes):
+    """ Generate a text warning for every outcome which was not OK. """
+
+    for o in outcomes.values():
+        if o.state == Outcome.FAILED:
+            cmd.warn('text=%s' % (qstr(f'{o.name} failed after {o.duration:0.2f}s: {o.error}')))
+        elif o.state == Outcome.TIMEDOUT:
+            cmd.warn('text=%s' % (qstr(f'{o.name} did not finish within {o.duration:0.2f}s')))
+        elif o.state == Outcome.BUSY:
+            cmd.warn('text=%s' % (qstr(f'{o.name} was busy: {o.error}')))
@@ -0,0 +1,88 @@
+""" Track when other actors' keywords were last updated, so that we can reuse recent values.
+
+Instead of always commanding another actor to regenerate its status
+before reading its model, a caller can ask whether the keys it needs
+were updated recently enough, and only command a refresh if not:
+
+    freshness.watch('rough1', ('pumpSpeed', 'pumpErrors'))
+    if not freshness.isFresh('rough1', ('pumpSpeed', 'pumpErrors'), maxAge=5):
+        actor.cmdr.call(actor='rough1', cmdStr='pump status', ...)
+
+Update times are taken from keyVar callbacks, on the monotonic clock.
+opscore also calls those when it marks keys not current (e.g. when the
+other actor or the hub disconnects): a key which is not current is
+never fresh, whatever its age.
+"""
+
+import functools
+import logging
+import math
+import threading
+import time
+
+class KeyFreshness(object):
+    def __init__(self, actor):
+        self.actor = actor
+        self.logger = logging.getLogger('keyFreshness')
+        self.lock = threading.Lock()
+
+        # (actorName, keyName) -> monotonic time of the last current update, or None.
+        self.updated = dict()
+        # (actorName, keyName) -> keyVar
+        self.keyVars = dict()
+        self.hits = 0
+        self.misses = 0
+
+    def watch(self, actorName, keyNames):
+        """ Start following keys of another actor, adding its model if need be. """
+
+        with self.lock:
+            newKeys = [k for k in keyNames if (actorName, k) not in self.updated]
+            for k in newKeys:
+                self.updated[(actorName, k)] = None
+        if not newKeys:
+            return
+
+        if actorName not in self.actor.models:
+            self.actor.addModels([actorName])
+        keyVarDict = self.actor.models[actorName].keyVarDict
+        for k in newKeys:
+            keyVar = keyVarDict[k]
+            with self.lock:
+                self.keyVars[(actorName, k)] = keyVar
+            keyVar.addCallback(functools.partial(self._keyUpdated, actorName, k),
+                               callNow=False)
+
+    def _keyUpdated(self, actorName, keyName, keyVar):
+        with self.lock:
+            self.updated[(actorName, keyName)] = time.monotonic() if keyVar.isCurrent else None
+
+    def age(self, actorName, keyName):
+        """ Return the seconds since a watched key was last updated, inf if it never has been or is not current. """
+
+        with self.lock:
+            t = self.updated.get((actorName, keyName))
+            keyVar = self.keyVars.get((actorName, keyName))
+        if t is None or (keyVar is not None and not keyVar.isCurrent):
+            return math.inf
+        return time.monotonic() - t
+
+    def isFresh(self, actorName, keyNames, maxAge):
+        """ Return True if all of the keys were updated no more than maxAge seconds ago. """
+
+        fresh = all(self.age(actorName, k) <= maxAge for k in keyNames)
+        with self.lock:
+            if fresh:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return fresh
+
+    def genKeys(self, cmd):
+        with self.lock:
+            updated = sorted(self.updated.items())
+        now = time.monotonic()
+        for (actorName, keyName), t in updated:
+            age = 'never' if t is None else '%0.1fs' % (now - t)
+            cmd.diag('text="key %s.%s: updated %s ago"' % (actorName, keyName, age))
+        cmd.inform('keyFreshness=%d,%d,%d' % (len(updated), self.hits, self.misses))
@@ -0,0 +1,36 @@
+""" Defer importing heavy modules until they are actually used. """
+
+import importlib
+import threading
+
+class LazyModule(object):
+    """ Stand-in for a module, which imports the real one on first attribute access.
+
+    Use as:
+
+      np = LazyModule('numpy')
+
+    and then np.array() etc. as usual. The import happens under the
+    normal import lock, so this is safe to touch from several threads.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._module is None:
+                self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        module = self._module
+        if module is None:
+            module = self._load()
+        return getattr(module, attr)
+
+    def __repr__(self):
+        state = 'loaded' if self._module is not None else 'not loaded'
+        return f'<LazyModule {self._name} ({state})>'
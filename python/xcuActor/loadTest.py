@@ -0,0 +1,407 @@
+""" Multi-camera load harness.
+
+Launch N xcu actors against fake device endpoints and a local stand-in
+hub, drive them with monitor loops and a command mix, and report:
+
+ - aggregate hub message rates (reply lines/s, by flag), plus command
+   completion latencies,
+ - per-actor CPU and RSS, from /proc,
+ - device-side contention: per fake device transactions, maximum
+   concurrent clients and time spent queued behind other requests.
+
+The stand-in hub does two jobs: it accepts the actors' own commander
+connections (and just counts what they send), and it connects to
+each actor's command port to send commands, as the real hub does.
+
+Each actor is pointed at the fakes and the stand-in hub through
+--configOverrides. The section/key names for the hub and listen
+ports follow the actorcore configuration; override them with
+--hubKeys and --listenKey if your tree differs.
+
+Example:
+
+  xcuLoadTest.py -n 8 --duration 120 --monitor temps=10 --monitor cooler=15 \\
+                 --mix 'gauge status=5' --mix 'power status=1' --rate 0.5
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import socket
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import yaml
+
+from xcuActor import fakeDevices
+
+allCams = [f'{arm}{spec}' for spec in range(1, 5) for arm in 'brnm']
+
+class ProcStats(object):
+    """ CPU and RSS for one process, read from /proc. """
+
+    clockTicks = os.sysconf('SC_CLK_TCK')
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.lastCpu = None
+        self.lastTime = None
+
+    def cpuSeconds(self):
+        with open(f'/proc/{self.pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        # utime and stime are fields 14 and 15; we dropped the first two.
+        return (int(fields[11]) + int(fields[12])) / self.clockTicks
+
+    def rssMB(self):
+        with open(f'/proc/{self.pid}/status') as f:
+            for l in f:
+                if l.startswith('VmRSS:'):
+                    return int(l.split()[1]) / 1024.0
+        return 0.0
+
+    def sample(self):
+        """ Return (cpu fraction since last sample, RSS in MB). """
+
+        try:
+            now = time.monotonic()
+            cpu = self.cpuSeconds()
+            rss = self.rssMB()
+        except (OSError, IndexError, ValueError):
+            return None, None
+
+        frac = None
+        if self.lastCpu is not None:
+            frac = (cpu - self.lastCpu) / max(now - self.lastTime, 1e-6)
+        self.lastCpu = cpu
+        self.lastTime = now
+
+        return frac, rss
+
+class HubStats(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.lines = 0
+        self.bytes = 0
+        self.flags = dict()
+        self.cmdrLines = 0
+        self.sent = 0
+        self.completed = 0
+        self.failed = 0
+        self.latencies = []
+
+    def reply(self, line, flag):
+        with self.lock:
+            self.lines += 1
+            self.bytes += len(line)
+            self.flags[flag] = self.flags.get(flag, 0) + 1
+
+    def done(self, latency, ok):
+        with self.lock:
+            self.completed += 1
+            if not ok:
+                self.failed += 1
+            self.latencies.append(latency)
+
+    def snapshot(self):
+        with self.lock:
+            lat = sorted(self.latencies)
+            return dict(lines=self.lines, bytes=self.bytes,
+                        flags=dict(self.flags),
+                        cmdrLines=self.cmdrLines,
+                        sent=self.sent, completed=self.completed,
+                        failed=self.failed,
+                        latencyMedian=lat[len(lat)//2] if lat else None,
+                        latency95=lat[int(len(lat)*0.95)] if lat else None,
+                        latencyMax=lat[-1] if lat else None)
+
+class _CmdrHandler(socketserver.StreamRequestHandler):
+    """ Swallow whatever an actor's own commander connection sends us. """
+
+    def handle(self):
+        stats = self.server.hubStats
+        for line in self.rfile:
+            with stats.lock:
+                stats.cmdrLines += 1
+
+class _CmdrServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+class ActorLink(object):
+    """ The stand-in hub's command connection to one actor. """
+
+    # Hub -> actor: "commanderName MID command"
+    # Actor -> hub: "commanderID MID flag keywords..."
+    cmdrName = 'loadtest.hub'
+    doneFlags = {':', 'f', 'F'}
+
+    def __init__(self, name, host, port, hubStats):
+        self.name = name
+        self.host = host
+        self.port = port
+        self.hubStats = hubStats
+        self.sock = None
+        self.mid = 1
+        self.pending = dict()
+        self.lock = threading.Lock()
+
+    def connect(self, tryFor=60.0):
+        t0 = time.monotonic()
+        while True:
+            try:
+                self.sock = socket.create_connection((self.host, self.port), timeout=5.0)
+                self.sock.settimeout(None)
+                break
+            except socket.error:
+                if time.monotonic() - t0 > tryFor:
+                    raise
+                time.sleep(0.5)
+        threading.Thread(target=self.readLoop, name=f'hub-{self.name}', daemon=True).start()
+
+    def send(self, cmdStr):
+        with self.lock:
+            mid = self.mid
+            self.mid += 1
+            self.pending[mid] = time.monotonic()
+        self.sock.sendall(f'{self.cmdrName} {mid} {cmdStr}\n'.encode('latin-1'))
+        with self.hubStats.lock:
+            self.hubStats.sent += 1
+
+    def readLoop(self):
+        f = self.sock.makefile('rb')
+        for rawLine in f:
+            line = rawLine.decode('latin-1')
+            parts = line.split(None, 3)
+            if len(parts) < 3:
+                continue
+            flag = parts[2]
+            self.hubStats.reply(line, flag)
+            if flag not in self.doneFlags:
+                continue
+            try:
+                mid = int(parts[1])
+            except ValueError:
+                continue
+            with self.lock:
+                t0 = self.pending.pop(mid, None)
+            if t0 is not None:
+                self.hubStats.done(time.monotonic() - t0, flag == ':')
+
+class LoadHarness(object):
+    def __init__(self, cams, mainPath, workDir,
+                 monitors=None, mix=None, rate=0.0,
+                 latency=0.01, hubPort=0, actorPortBase=19000,
+                 hubKeys=('tron', 'tronHost', 'tronCmdrPort'),
+                 listenKey=('xcu', 'port'),
+                 extraOverrides=None):
+        self.cams = cams
+        self.mainPath = mainPath
+        self.workDir = workDir
+        self.monitors = monitors if monitors else dict()
+        self.mix = mix if mix else dict()
+        self.rate = rate
+        self.actorPortBase = actorPortBase
+        self.hubKeys = hubKeys
+        self.listenKey = listenKey
+        self.extraOverrides = extraOverrides if extraOverrides else dict()
+
+        self.logger = logging.getLogger('loadtest')
+        self.hubStats = HubStats()
+        self.farm = fakeDevices.FakeDeviceFarm.standard(latency=latency)
+        self.cmdrServer = _CmdrServer(('127.0.0.1', hubPort), _CmdrHandler)
+        self.cmdrServer.hubStats = self.hubStats
+
+        self.procs = dict()
+        self.procStats = dict()
+        self.logFiles = dict()
+        self.links = dict()
+        self.running = False
+
+    def overridesFor(self, i, cam):
+        overrides = self.farm.configOverrides()
+        section, hostKey, portKey = self.hubKeys
+        overrides[section] = {hostKey: '127.0.0.1',
+                              portKey: self.cmdrServer.server_address[1]}
+        section, portKey = self.listenKey
+        overrides.setdefault(section, dict())[portKey] = self.actorPortBase + i
+        for section, values in self.extraOverrides.items():
+            overrides.setdefault(section, dict()).update(values)
+
+        return overrides
+
+    def start(self):
+        self.farm.start()
+        threading.Thread(target=self.cmdrServer.serve_forever,
+                         name='hub-cmdr', daemon=True).start()
+
+        for i, cam in enumerate(self.cams):
+            path = os.path.join(self.workDir, f'xcu_{cam}.yaml')
+            with open(path, 'w') as f:
+                yaml.safe_dump(self.overridesFor(i, cam), f)
+            logPath = os.path.join(self.workDir, f'xcu_{cam}.out')
+            argv = [sys.executable, self.mainPath, '--cam', cam,
+                    '--configOverrides', path]
+            self.logger.info('starting %s', argv)
+            self.logFiles[cam] = open(logPath, 'w')
+            proc = subprocess.Popen(argv, stdout=self.logFiles[cam],
+                                    stderr=subprocess.STDOUT)
+            self.procs[cam] = proc
+            self.procStats[cam] = ProcStats(proc.pid)
+
+        for i, cam in enumerate(self.cams):
+            link = ActorLink(f'xcu_{cam}', '127.0.0.1', self.actorPortBase + i,
+                             self.hubStats)
+            link.connect()
+            self.links[cam] = link
+            for controller, period in self.monitors.items():
+                link.send(f'monitor controllers={controller} period={period}')
+
+        self.running = True
+        if self.rate > 0 and self.mix:
+            for cam, link in self.links.items():
+                threading.Thread(target=self.drive, args=(link,),
+                                 name=f'drive-{cam}', daemon=True).start()
+
+    def drive(self, link):
+        """ Send commands from the mix as a Poisson process at self.rate per second. """
+
+        cmds = list(self.mix.keys())
+        weights = [self.mix[c] for c in cmds]
+        while self.running:
+            time.sleep(random.expovariate(self.rate))
+            if not self.running:
+                break
+            try:
+                link.send(random.choices(cmds, weights)[0])
+            except socket.error as e:
+                self.logger.warning('failed to send to %s: %s', link.name, e)
+                return
+
+    def stop(self):
+        self.running = False
+        for cam, proc in self.procs.items():
+            proc.terminate()
+        for proc in self.procs.values():
+            try:
+                proc.wait(5)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.wait()
+        for f in self.logFiles.values():
+            f.close()
+        self.logFiles.clear()
+        self.cmdrServer.shutdown()
+        self.farm.stop()
+
+    def sample(self, dt):
+        """ Return one report dict covering the last dt seconds. """
+
+        actors = dict()
+        for cam, ps in self.procStats.items():
+            cpu, rss = ps.sample()
+            actors[f'xcu_{cam}'] = dict(cpu=cpu, rssMB=rss,
+                                        alive=self.procs[cam].poll() is None)
+        return dict(time=time.time(), dt=dt,
+                    hub=self.hubStats.snapshot(),
+                    actors=actors,
+                    devices=self.farm.stats())
+
+    def run(self, duration, reportEvery=10.0, out=sys.stdout):
+        self.start()
+        try:
+            t0 = time.monotonic()
+            lastLines = 0
+            lastT = t0
+            report = self.sample(0)
+            report['hub']['lineRate'] = 0.0
+            while True:
+                remaining = duration - (time.monotonic() - t0)
+                if remaining <= 0:
+                    break
+                time.sleep(min(reportEvery, remaining))
+                now = time.monotonic()
+                report = self.sample(now - lastT)
+                hub = report['hub']
+                report['hub']['lineRate'] = (hub['lines'] - lastLines) / (now - lastT)
+                lastLines = hub['lines']
+                lastT = now
+                out.write(json.dumps(report) + '\n')
+                out.flush()
+        finally:
+            self.stop()
+        return report
+
+def _parsePairs(pairs, valueType):
+    ret = dict()
+    for p in pairs:
+        k, v = p.rsplit('=', 1)
+        ret[k.strip()] = valueType(v)
+    return ret
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+
+    parser = argparse.ArgumentParser('Run many xcu actors against fake devices')
+    parser.add_argument('-n', '--nActors', type=int, default=4,
+                        help='number of actors to launch (<= 16)')
+    parser.add_argument('--cams', type=str, default=None,
+                        help='comma-separated camera names, instead of -n')
+    parser.add_argument('--duration', type=float, default=60.0,
+                        help='seconds to run for')
+    parser.add_argument('--reportEvery', type=float, default=10.0,
+                        help='seconds between reports')
+    parser.add_argument('--monitor', action='append', default=[],
+                        help='controller=period monitor loop to start in every actor')
+    parser.add_argument('--mix', action='append', default=[],
+                        help='"command=weight" entry in the command mix')
+    parser.add_argument('--rate', type=float, default=0.0,
+                        help='mean commands/s sent to each actor from the mix')
+    parser.add_argument('--latency', type=float, default=0.01,
+                        help='fake device service time per request, s')
+    parser.add_argument('--actorPortBase', type=int, default=19000)
+    parser.add_argument('--hubKeys', type=str, default='tron.tronHost.tronCmdrPort',
+                        help='section.hostKey.portKey for the hub address')
+    parser.add_argument('--listenKey', type=str, default='xcu.port',
+                        help='section.portKey for the actor command port')
+    parser.add_argument('--extraOverrides', type=str, default=None,
+                        help='YAML file of additional config overrides for every actor')
+    parser.add_argument('--workDir', type=str, default=None)
+    parser.add_argument('--debug', action='store_true')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+
+    if args.cams is not None:
+        cams = [c.strip() for c in args.cams.split(',')]
+    else:
+        cams = allCams[:args.nActors]
+
+    extraOverrides = None
+    if args.extraOverrides is not None:
+        with open(args.extraOverrides) as f:
+            extraOverrides = yaml.safe_load(f)
+
+    workDir = args.workDir if args.workDir else tempfile.mkdtemp(prefix='xcuLoad-')
+    mainPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+
+    harness = LoadHarness(cams, mainPath, workDir,
+                          monitors=_parsePairs(args.monitor, int),
+                          mix=_parsePairs(args.mix, float),
+                          rate=args.rate,
+                          latency=args.latency,
+                          actorPortBase=args.actorPortBase,
+                          hubKeys=tuple(args.hubKeys.split('.')),
+                          listenKey=tuple(args.listenKey.split('.')),
+                          extraOverrides=extraOverrides)
+    harness.run(args.duration, reportEvery=args.reportEvery)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+""" Answer local queries for our cached readings and controller health over a Unix socket.
+
+This is for fast local tools which would otherwise poll the hub or the
+devices. Requests are single lines:
+
+    readings [prefix ...]   the latest cached readings, optionally only those
+                            whose names start with one of the prefixes
+    health                  per-controller comm state and last poll
+    all                     both of the above (the default for an empty line)
+
+An optional last word of "json" (the default) or "msgpack" picks the
+reply format. A JSON reply is one line. A msgpack reply is a 4-byte
+big-endian length followed by that many bytes. Errors are returned as
+{"error": "..."}.
+
+Everything is answered from memory in the reactor thread; no request
+ever touches a device, so any number of clients can poll as fast as
+they like without loading the hardware.
+
+The socket path comes from the optional "localQuery" config section,
+and defaults to <actorName>.sock in $XDG_RUNTIME_DIR, or else in
+~/.xcuActor. The socket is only open to our user and group.
+"""
+
+import json
+import logging
+import math
+import os
+import stat
+import struct
+import time
+
+from twisted.internet import protocol, reactor
+from twisted.protocols.basic import LineReceiver
+
+from xcuActor.lazyImport import LazyModule
+
+msgpack = LazyModule('msgpack')
+
+def jsonable(value):
+    """ Return a value as something json and msgpack can both encode. """
+
+    if hasattr(value, 'asdict'):
+        return {k: jsonable(v) for k, v in value.asdict().items()}
+    if hasattr(value, 'snapshotValues'):
+        value = value.snapshotValues()
+    if isinstance(value, bytes):
+        return value.decode('latin-1')
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    if isinstance(value, (list, tuple)):
+        return [jsonable(v) for v in value]
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return str(value)
+
+class QueryProtocol(LineReceiver):
+    delimiter = b'\n'
+
+    def lineReceived(self, line):
+        words = line.decode('latin-1').split()
+        fmt = 'json'
+        if words and words[-1] in {'json', 'msgpack'}:
+            fmt = words.pop()
+
+        try:
+            reply = self.factory.server.answer(words)
+        except Exception as e:
+            reply = dict(error=str(e))
+
+        try:
+            if fmt == 'msgpack':
+                data = msgpack.packb(reply)
+                self.transport.write(struct.pack('>I', len(data)) + data)
+            else:
+                self.transport.write(json.dumps(reply).encode('latin-1') + b'\n')
+        except Exception as e:
+            self.transport.write(json.dumps(dict(error=str(e))).encode('latin-1') + b'\n')
+
+def defaultPath(actorName):
+    """ Return the default socket path for an actor, in a directory only our user can write to. """
+
+    runDir = os.environ.get('XDG_RUNTIME_DIR')
+    if not runDir:
+        runDir = os.path.expanduser('~/.xcuActor')
+        os.makedirs(runDir, mode=0o700, exist_ok=True)
+    return os.path.join(runDir, f'{actorName}.sock')
+
+class LocalQueryServer(object):
+    """ Serve readings and controller health from an actor, on a Unix socket. """
+
+    def __init__(self, actor, path):
+        self.actor = actor
+        self.path = path
+        self.logger = logging.getLogger('localQuery')
+        self.port = None
+        self.requests = 0
+
+    @classmethod
+    def fromConfig(cls, actor):
+        """ Return a server configured from the "localQuery" section, or None if disabled. """
+
+        try:
+            cfg = dict(actor.actorConfig['localQuery'])
+        except Exception:
+            cfg = dict()
+        if not cfg.get('enabled', True):
+            return None
+        path = cfg.get('path', None)
+        if path is None:
+            try:
+                path = defaultPath(actor.name)
+            except OSError as e:
+                logging.getLogger('localQuery').warning('not answering local queries: %s', e)
+                return None
+        return cls(actor, path)
+
+    def start(self):
+        """ Start listening. Must be called from, or before starting, the reactor. """
+
+        # A socket left behind by a previous run would stop us from binding. Never remove anything else.
+        try:
+            if not stat.S_ISSOCK(os.lstat(self.path).st_mode):
+                self.logger.warning('not listening on %s: it exists and is not a socket', self.path)
+                return
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            self.logger.warning('cannot remove old socket %s: %s', self.path, e)
+            return
+
+        factory = protocol.ServerFactory()
+        factory.protocol = QueryProtocol
+        factory.server = self
+        try:
+            self.port = reactor.listenUNIX(self.path, factory, mode=0o660)
+        except Exception as e:
+            self.logger.warning('cannot listen on %s: %s', self.path, e)
+            return
+        self.logger.info('answering local queries on %s', self.path)
+
+    def stop(self):
+        if self.port is not None:
+            self.port.stopListening()
+            self.port = None
+
+    def answer(self, words):
+        self.requests += 1
+        what = words[0] if words else 'all'
+        args = words[1:]
+
+        if what == 'readings':
+            return dict(time=time.time(), readings=self.readings(args))
+        elif what == 'health':
+            return dict(time=time.time(), health=self.health())
+        elif what == 'all':
+            return dict(time=time.time(), readings=self.readings(args), health=self.health())
+        raise ValueError(f'unknown request {what!r}: expected readings, health, or all')
+
+    def readings(self, prefixes=()):
+        ret = dict()
+        for name, reading in self.actor.readings.items():
+            if prefixes and not name.startswith(tuple(prefixes)):
+                continue
+            ret[name] = dict(value=jsonable(reading.value),
+                             time=reading.timestamp,
+                             span=reading.stamp.span,
+                             age=reading.age)
+            if reading.stamps is not None:
+                ret[name]['times'] = [s.wall for s in reading.stamps]
+        return ret
+
+    def health(self):
+        actor = self.actor
+        ret = dict()
+        controllers = dict(actor.controllers.items())
+        states = actor.controllerStatesCopy()
+        lastPolls = dict(actor.lastPolls)
+        for name in sorted(set(controllers) | set(states)):
+            controller = controllers.get(name)
+            breaker = getattr(controller, 'breaker', None)
+            attachState = states.get(name, (None, None))[0]
+            info = dict(attached=attachState,
+                        comm=breaker.state if breaker is not None else None,
+                        lastError=str(breaker.lastError) if breaker is not None and breaker.lastError else None)
+            poll = lastPolls.get(name)
+            if poll is not None:
+                info.update(lastPoll=poll[0], lastPollDuration=poll[1])
+            else:
+                info.update(lastPoll=None, lastPollDuration=None)
+            ret[name] = info
+        return ret
@@ -1,15 +1,77 @@
 #!/usr/bin/env python
 
+import sys
+import time
+
+# Take the startup clock before any of the heavy imports.
+startTime = time.monotonic()
+from xcuActor import startupProfile
+theStartupProfile = startupProfile.StartupProfile(startTime,
+                                                  doProfile='--profile-startup' in sys.argv)
+
 import argparse
 import logging
+import threading
 from twisted.internet import reactor
 
 import actorcore.ICC
 from ics.utils.sps import spectroIds
 import cryoMode
+from xcuActor import cooldown
+from xcuActor import deadline
+from xcuActor import keyFreshness
+from xcuActor import localQuery
+from xcuActor import pumpdown
+from xcuActor import pumpHealth
+from xcuActor import readingCache
+from xcuActor import snapshot
+from xcuActor import watchdog
+
+theStartupProfile.mark('imports')
+
+class ControllerDict(dict):
+    """ The actor's controllers, which several attach threads register at once.
+
+    Changes are made under a lock, and iteration is over a copy, so that
+    status commands, the local query server and the poll scheduler never
+    see the dict change size under them.
+    """
+
+    def __init__(self, *argl, **argv):
+        dict.__init__(self, *argl, **argv)
+        self.lock = threading.RLock()
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        with self.lock:
+            dict.__delitem__(self, key)
+
+    def pop(self, *argl):
+        with self.lock:
+            return dict.pop(self, *argl)
+
+    def __iter__(self):
+        with self.lock:
+            return iter(list(dict.keys(self)))
+
+    def keys(self):
+        with self.lock:
+            return list(dict.keys(self))
+
+    def values(self):
+        with self.lock:
+            return list(dict.values(self))
+
+    def items(self):
+        with self.lock:
+            return list(dict.items(self))
 
 class OurActor(actorcore.ICC.ICC):
     def __init__(self, name, productName=None, site=None,
+                 configOverrides=None,
                  logLevel=logging.INFO):
         if name is not None:
             cam = name.split('_')[-1]
@@ -21,6 +83,19 @@ class OurActor(actorcore.ICC.ICC):
         if name is None:
             name = 'xcu_%s' % (self.ids.camName)
 
+        # Controller attach bookkeeping. Set up before the command sets are loaded,
+        # since those can register things to run once a controller is attached.
+        self.controllerStates = dict()
+        self.attachCallbacks = dict()
+        self.attachLock = threading.RLock()
+        self.startupProfile = theStartupProfile
+
+        # The last known value of device readings, for callers which can live with slightly old ones.
+        self.readings = readingCache.ReadingCache()
+
+        # When other actors' keywords we read were last updated, so we need not always ask for new ones.
+        self.keyFreshness = keyFreshness.KeyFreshness(self)
+
         # This sets up the connections to/from the hub, the logger, and the twisted reactor.
         #
         actorcore.ICC.ICC.__init__(self, name,
@@ -29,6 +104,37 @@ class OurActor(actorcore.ICC.ICC):
 
         self.logger.setLevel(logLevel)
 
+        # Controllers are attached concurrently: see attachControllersConcurrently.
+        self.controllers = ControllerDict(self.controllers)
+
+        if configOverrides is not None:
+            self.overrideConfiguration(configOverrides)
+
+        self.readings.configure(self.actorConfig)
+        self.watchdog = watchdog.Watchdog(self)
+
+        # Publish readings to local processes through shared memory.
+        self.snapshot = snapshot.SnapshotWriter.fromConfig(self)
+        if self.snapshot is not None:
+            self.readings.addListener(self.snapshot.putReading)
+
+        # Follow the cryostat pressure, and predict when pumpdown steps can be taken.
+        self.pumpdown = pumpdown.PumpdownEstimator.fromConfig(self)
+        self.readings.addListener(self.pumpdown.putReading)
+        self.cooldown = cooldown.CooldownEstimator.fromConfig(self)
+        self.readings.addListener(self.cooldown.putReading)
+        self.pumpHealth = pumpHealth.PumpHealthMonitor.fromConfig(self)
+        self.readings.addListener(self.pumpHealth.putReading)
+
+        # When each polled controller last finished a status command, and how long that took.
+        self.lastPolls = dict()
+
+        # Answer local tools from the reading cache, without going through the hub.
+        self.localQuery = localQuery.LocalQueryServer.fromConfig(self)
+        if self.localQuery is not None:
+            self.localQuery.start()
+
+        self.startupProfile.mark('initialized')
         self.everConnected = False
 
         self.monitors = dict()
@@ -39,11 +145,78 @@ class OurActor(actorcore.ICC.ICC):
 
         return self.ids.arm == 'n'
 
+    def overrideConfiguration(self, path):
+        """ Patch actorConfig sections from a YAML file. Used to point us at fake devices.
+
+        The file maps section names to {key: value} dicts, which are
+        merged into the existing sections.
+        """
+        import yaml
+
+        with open(path) as f:
+            overrides = yaml.safe_load(f)
+
+        for section, values in overrides.items():
+            self.logger.warning(f'overriding config section {section} with {values}')
+            try:
+                self.actorConfig[section].update(values)
+            except KeyError:
+                self.actorConfig[section] = dict(values)
+
     def reloadConfiguration(self, cmd):
         cmd.inform('sections=%08x,%r' % (id(self.actorConfig),
                                          self.actorConfig.keys()))
 
+    def newCmd(self, cmd):
+        """ Note when we get our first command, then dispatch as usual. """
+
+        if not self.startupProfile.done:
+            self.startupProfile.mark('firstCommand')
+            dumpPath = None
+            if self.startupProfile.profiler is not None:
+                dumpPath = f'/tmp/{self.name}-startup.prof'
+            self.startupProfile.finish(cmd=self.bcast, dumpPath=dumpPath)
+
+        return actorcore.ICC.ICC.newCmd(self, cmd)
+
+    def commandDeadline(self, cmdStr):
+        """ Return the time budget for a command, in seconds, or None for no limit.
+
+        Taken from the optional "deadlines" config section, which maps
+        command prefixes (e.g. "cooler status") to seconds. The longest
+        matching prefix wins; "default" applies to everything else.
+        """
+
+        try:
+            deadlines = self.actorConfig['deadlines']
+        except Exception:
+            return None
+
+        best = None
+        for prefix in deadlines:
+            if prefix != 'default' and cmdStr.startswith(prefix):
+                if best is None or len(prefix) > len(best):
+                    best = prefix
+        if best is None:
+            best = 'default'
+        seconds = deadlines.get(best, None)
+        return None if seconds is None else float(seconds)
+
+    def runActorCmd(self, cmd):
+        """ Run a command, under the eye of the watchdog and within its deadline. """
+
+        t0 = time.time()
+        try:
+            with self.watchdog.track(cmd.rawCmd, kind='command'), \
+                 deadline.within(self.commandDeadline(cmd.rawCmd), name=cmd.rawCmd):
+                return actorcore.ICC.ICC.runActorCmd(self, cmd)
+        finally:
+            words = cmd.rawCmd.split()
+            if len(words) == 2 and words[1] == 'status' and words[0] in self.monitors:
+                self.lastPolls[words[0]] = (time.time(), time.time() - t0)
+
     def connectionMade(self):
+        self.startupProfile.mark('connected')
         if self.everConnected is False:
             _needModels = [self.name]
             self.logger.info(f'adding models: {_needModels}')
@@ -54,9 +227,112 @@ class OurActor(actorcore.ICC.ICC):
 
             logging.info("Attaching all controllers...")
             self.allControllers = self.actorConfig['controllers']['starting']
-            self.attachAllControllers()
+            self.attachControllersConcurrently(self.allControllers)
             self.everConnected = True
 
+    def attachTimeout(self, controller):
+        """ Return the attach deadline for a controller, in seconds. """
+
+        try:
+            return float(self.actorConfig[controller]['attachTimeout'])
+        except Exception:
+            pass
+        try:
+            return float(self.actorConfig['controllers']['attachTimeout'])
+        except Exception:
+            return 15.0
+
+    def whenAttached(self, controller, func):
+        """ Call func(), in the attach thread, whenever the given controller is (re)attached.
+
+        If the controller is already attached, also call func() right
+        away. A func with the same name as one already registered (e.g.
+        from a reloaded command set) replaces it.
+        """
+
+        key = getattr(func, '__qualname__', func)
+        with self.attachLock:
+            self.attachCallbacks.setdefault(controller, dict())[key] = func
+            if controller not in self.controllers:
+                return
+        func()
+
+    def _setControllerState(self, controller, state, t0):
+        with self.attachLock:
+            duration = time.time() - t0
+            self.controllerStates[controller] = (state, duration)
+        self.genControllerKey(controller)
+
+    def genControllerKey(self, controller, cmd=None):
+        if cmd is None:
+            cmd = self.bcast
+        with self.attachLock:
+            state, duration = self.controllerStates[controller]
+        cmdFunc = cmd.warn if state in {'failed', 'timedOut'} else cmd.inform
+        cmdFunc('controllerAttach=%s,%s,%0.3f' % (controller, state, duration))
+
+    def controllerStatesCopy(self):
+        """ Return a copy of controller -> (attach state, attach duration). """
+
+        with self.attachLock:
+            return dict(self.controllerStates)
+
+    def genControllerKeys(self, cmd=None):
+        for c in self.controllerStatesCopy():
+            self.genControllerKey(c, cmd=cmd)
+
+    def _attachOne(self, controller, t0):
+        try:
+            self.attachController(controller)
+        except Exception as e:
+            self.logger.warning('failed to attach controller %s: %s', controller, e)
+            self.bcast.warn('text="failed to attach controller %s: %s"' % (controller, e))
+            self._setControllerState(controller, 'failed', t0)
+            return
+
+        self._setControllerState(controller, 'attached', t0)
+        self.runAttachCallbacks(controller)
+
+    def runAttachCallbacks(self, controller):
+        """ Run everything registered with whenAttached for the given controller. They stay registered. """
+
+        with self.attachLock:
+            callbacks = list(self.attachCallbacks.get(controller, dict()).values())
+        for func in callbacks:
+            try:
+                func()
+            except Exception as e:
+                self.logger.warning('post-attach call for %s failed: %s', controller, e)
+
+    def attachControllersConcurrently(self, controllers):
+        """ Attach controllers, each in its own thread and with its own deadline.
+
+        Returns immediately: we start serving commands while devices are
+        still being opened. A controller which has not attached within its
+        deadline is marked as timedOut; it is still allowed to finish
+        attaching later.
+        """
+
+        threads = dict()
+        for c in controllers:
+            c = c.strip()
+            t0 = time.time()
+            with self.attachLock:
+                self.controllerStates[c] = ('attaching', 0.0)
+            t = threading.Thread(target=self._attachOne, args=(c, t0),
+                                 name=f'attach-{c}', daemon=True)
+            threads[c] = (t, t0)
+            t.start()
+
+        def watch():
+            for c, (t, t0) in threads.items():
+                t.join(max(0.0, t0 + self.attachTimeout(c) - time.time()))
+                if t.is_alive():
+                    self._setControllerState(c, 'timedOut', t0)
+            self.startupProfile.mark('controllersAttached')
+
+        threading.Thread(target=watch, name='attach-watch', daemon=True).start()
+
     def statusLoop(self, controller):
         try:
             self.callCommand("%s status" % (controller))
@@ -90,15 +366,20 @@ def main():
                         help='identity')
     parser.add_argument('--cam', default=None, type=str, nargs='?',
                         help='ccd name, e.g. r1')
+    parser.add_argument('--configOverrides', default=None, type=str,
+                        help='YAML file of actorConfig sections to override')
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='profile startup, until the first command is served')
     args = parser.parse_args()
 
     if args.name is not None and args.cam is not None:
         raise RuntimeError('only one of --cam and --name can be specified')
     if args.cam is not None:
         args.name = f'xcu_{args.cam}'
-        
+
     theActor = OurActor(args.name,
                         productName='xcuActor',
+                        configOverrides=args.configOverrides,
                         logLevel=args.logLevel)
     theActor.run()
 
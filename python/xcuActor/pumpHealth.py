@@ -0,0 +1,236 @@
+""" Watch the turbo and roughing pump telemetry for slow drifts, e.g. a failing bearing.
+
+The pump controllers' polls put speed, motor current and power, and
+pump temperatures in the reading cache. A PumpHealthMonitor takes each
+of those, and for every (pump, quantity, speed bin) series keeps
+
+  - a rolling median and MAD over the last `window` samples, updated
+    incrementally with a sorted ring, and
+  - the pump's own baseline median and MAD for that series, learned
+    from its first full window, and
+  - a two-sided CUSUM of the clipped, standardized samples against
+    that baseline, which accumulates small persistent shifts and
+    ignores isolated spikes.
+
+When a CUSUM crosses its threshold we warn with
+pumpDrift=pump,quantity,speed,baseline,recent,direction, and say so
+again when the series has come back to its baseline. Current and
+temperatures depend on speed, so each speed bin (5% wide by default)
+has its own baseline.
+
+Baselines are relearned when the actor restarts. Settings come from the
+optional "pumpHealth" config section: window, speedBin (the fractional
+width of the speed bins), minSpeed, cusumSlack, cusumThreshold, and
+minScale (the smallest baseline scale, as a fraction of the median).
+"""
+
+import bisect
+import collections
+import logging
+import math
+import threading
+
+class RollingRobust(object):
+    """ The median and MAD of the last size samples, kept incrementally. """
+
+    def __init__(self, size):
+        self.size = size
+        self.ring = collections.deque()
+        self.sorted = []
+
+    def add(self, x):
+        if len(self.ring) == self.size:
+            old = self.ring.popleft()
+            del self.sorted[bisect.bisect_left(self.sorted, old)]
+        self.ring.append(x)
+        bisect.insort(self.sorted, x)
+
+    @property
+    def full(self):
+        return len(self.ring) == self.size
+
+    def median(self):
+        s = self.sorted
+        n = len(s)
+        if n == 0:
+            return math.nan
+        mid = n // 2
+        return s[mid] if n % 2 else (s[mid-1] + s[mid]) / 2
+
+    def mad(self):
+        """ The median absolute deviation, scaled to match sigma for Gaussian noise. """
+
+        med = self.median()
+        devs = sorted(abs(x - med) for x in self.sorted)
+        n = len(devs)
+        if n == 0:
+            return math.nan
+        mid = n // 2
+        mad = devs[mid] if n % 2 else (devs[mid-1] + devs[mid]) / 2
+        return 1.4826 * mad
+
+class Series(object):
+    """ One pump quantity at one speed: recent statistics, baseline, and drift detector. """
+
+    zClip = 4.0
+
+    def __init__(self, window):
+        self.recent = RollingRobust(window)
+        self.baseMedian = None
+        self.baseScale = None
+        self.cusumUp = 0.0
+        self.cusumDown = 0.0
+        self.alarm = None
+        self.nSamples = 0
+
+    def add(self, x, slack, threshold, minScale):
+        """ Add a sample. Returns 'up' or 'down' when a drift is first detected, 'ok' when one clears, else None. """
+
+        self.nSamples += 1
+        self.recent.add(x)
+        if self.baseMedian is None:
+            if self.recent.full:
+                self.baseMedian = self.recent.median()
+                self.baseScale = max(self.recent.mad(), minScale * abs(self.baseMedian), 1e-9)
+            return None
+
+        # Clip single samples, so that one spike cannot trip the detector on its own,
+        # and cap the sums, so that a cleared drift is noticed promptly.
+        z = (x - self.baseMedian) / self.baseScale
+        z = min(max(z, -self.zClip), self.zClip)
+        self.cusumUp = min(max(0.0, self.cusumUp + z - slack), 2*threshold)
+        self.cusumDown = min(max(0.0, self.cusumDown - z - slack), 2*threshold)
+
+        if self.alarm is None:
+            if self.cusumUp > threshold:
+                self.alarm = 'up'
+                return self.alarm
+            if self.cusumDown > threshold:
+                self.alarm = 'down'
+                return self.alarm
+        else:
+            # Clear once the samples have come back to the baseline for long enough to drain the CUSUM.
+            cusum = self.cusumUp if self.alarm == 'up' else self.cusumDown
+            if cusum == 0.0:
+                self.alarm = None
+                return 'ok'
+        return None
+
+class PumpHealthMonitor(object):
+    def __init__(self, actor=None, window=120, speedBin=0.05, minSpeed=100.0,
+                 cusumSlack=0.5, cusumThreshold=10.0, minScale=0.01, maxSpeedAge=120.0):
+        self.actor = actor
+        self.logger = logging.getLogger('pumpHealth')
+        self.lock = threading.Lock()
+
+        self.window = int(window)
+        self.speedBin = speedBin
+        self.minSpeed = minSpeed
+        self.cusumSlack = cusumSlack
+        self.cusumThreshold = cusumThreshold
+        self.minScale = minScale
+        self.maxSpeedAge = maxSpeedAge
+
+        # The quantities we follow in each pump reading, by reading suffix.
+        self.quantities = {'VAW': ('current', 'power'),
+                           'temps': ('temp1', 'temp2')}
+        self.reset()
+
+    @classmethod
+    def fromConfig(cls, actor):
+        try:
+            cfg = dict(actor.actorConfig['pumpHealth'])
+        except Exception:
+            cfg = dict()
+
+        argv = dict()
+        for k in ('window', 'speedBin', 'minSpeed', 'cusumSlack',
+                  'cusumThreshold', 'minScale', 'maxSpeedAge'):
+            if k in cfg:
+                argv[k] = float(cfg[k])
+        return cls(actor, **argv)
+
+    def reset(self):
+        with self.lock:
+            self.series = dict()
+            self.speeds = dict()
+
+    def isPump(self, device):
+        return device == 'turbo' or device.startswith('rough')
+
+    def speedBinOf(self, rpm):
+        """ Return the nominal speed of the bin holding rpm. """
+
+        n = round(math.log(rpm) / math.log1p(self.speedBin))
+        return round(math.exp(n * math.log1p(self.speedBin)))
+
+    def putReading(self, name, reading):
+        """ ReadingCache listener: follow pump speed, current/power and temperatures. """
+
+        device, _, what = name.partition('.')
+        if not self.isPump(device):
+            return
+
+        if what == 'speed':
+            with self.lock:
+                self.speeds[device] = (float(reading.value.speed), reading.stamp.mono)
+            return
+
+        labels = self.quantities.get(what)
+        if labels is None:
+            return
+        with self.lock:
+            rpm, speedTime = self.speeds.get(device, (None, None))
+        if rpm is None or rpm < self.minSpeed or reading.stamp.mono - speedTime > self.maxSpeedAge:
+            return
+
+        speed = self.speedBinOf(rpm)
+        for label in labels:
+            try:
+                x = float(getattr(reading.value, label))
+            except (AttributeError, TypeError, ValueError):
+                continue
+            if math.isfinite(x):
+                self.add(device, label, speed, x)
+
+    def add(self, device, label, speed, x):
+        key = (device, label, speed)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = Series(self.window)
+            change = series.add(x, self.cusumSlack, self.cusumThreshold, self.minScale)
+
+        if change is not None:
+            self.reportChange(key, series, change)
+
+    def driftKey(self, key, series):
+        device, label, speed = key
+        return 'pumpDrift=%s,%s,%d,%g,%g,%s' % (device, label, speed,
+                                                series.baseMedian, series.recent.median(),
+                                                series.alarm or 'ok')
+
+    def reportChange(self, key, series, change):
+        device, label, speed = key
+        if change == 'ok':
+            self.logger.info('%s %s at %d rpm is back to its baseline', device, label, speed)
+        else:
+            self.logger.warning('%s %s at %d rpm drifted %s: baseline %g, recent median %g',
+                                device, label, speed, change, series.baseMedian, series.recent.median())
+        bcast = getattr(self.actor, 'bcast', None)
+        if bcast is not None:
+            cmdFunc = bcast.inform if change == 'ok' else bcast.warn
+            cmdFunc(self.driftKey(key, series))
+
+    def genKeys(self, cmd):
+        with self.lock:
+            allSeries = sorted(self.series.items())
+        nLearning = 0
+        for key, series in allSeries:
+            if series.baseMedian is None:
+                nLearning += 1
+                continue
+            cmdFunc = cmd.warn if series.alarm else cmd.inform
+            cmdFunc(self.driftKey(key, series))
+        cmd.inform('pumpHealth=%d,%d,%d' % (len(allSeries), nLearning,
+                                            sum(1 for k, s in allSeries if s.alarm)))
@@ -0,0 +1,223 @@
+""" Follow a pumpdown and predict when the pressure will reach the thresholds we act on.
+
+Every cryostat pressure reading (the PCM gauge and the interlock board's
+inside pressure) is fed to a PumpdownEstimator, which keeps a running
+fit of
+
+    ln p(t) = c0 + c1 ln(1 + t/t0) + sum_i a_i exp(-t/tau_i)
+
+where t is the time since the pumpdown started. The exponentials take
+the early, volume-limited part of the pumpdown, and the logarithm the
+power-law outgassing which dominates the long tail. The model is linear
+in its parameters, so it is updated by recursive least squares in a
+fixed amount of work per sample, with an exponential forgetting time so
+that the fit follows the current phase of the pumpdown.
+
+From the fit we predict when each threshold (by default 1 Torr for the
+turbo, 1e-4 for the cryocooler, and 1e-6 for the ion pumps, see
+docs/source/cooldown.rst) will be reached, and flag a stall when the
+pressure is no longer falling fast enough to get to the next one.
+
+Settings come from the optional "pumpdown" config section: thresholds,
+t0, taus, memory, reportInterval and stallDecadeTime (seconds per
+decade of pressure beyond which we call it a stall).
+"""
+
+import logging
+import math
+import threading
+
+from opscore.utility.qstr import qstr
+
+from xcuActor.lazyImport import LazyModule
+np = LazyModule('numpy')
+
+class PumpdownEstimator(object):
+    def __init__(self, actor=None, thresholds=(1.0, 1e-4, 1e-6),
+                 t0=3600.0, taus=(600.0, 6000.0), memory=6*3600.0,
+                 reportInterval=300.0, stallDecadeTime=2*86400.0):
+        self.actor = actor
+        self.logger = logging.getLogger('pumpdown')
+        self.lock = threading.Lock()
+
+        self.thresholds = sorted(thresholds, reverse=True)
+        self.t0 = t0
+        self.taus = tuple(taus)
+        self.memory = memory
+        self.reportInterval = reportInterval
+        self.stallDecadeTime = stallDecadeTime
+
+        # Keep the covariance from winding up while some terms are unobservable.
+        self.maxCovariance = 1e6
+
+        # How to get a pressure, in Torr, out of each reading we follow.
+        self.sources = {'PCM.pressure': lambda v: v,
+                        'interlock.status': lambda v: v.insidePressure}
+
+        self._reset()
+
+    @classmethod
+    def fromConfig(cls, actor):
+        try:
+            cfg = dict(actor.actorConfig['pumpdown'])
+        except Exception:
+            cfg = dict()
+
+        argv = dict()
+        for k in 't0', 'memory', 'reportInterval', 'stallDecadeTime':
+            if k in cfg:
+                argv[k] = float(cfg[k])
+        for k in 'thresholds', 'taus':
+            if k in cfg:
+                argv[k] = [float(v) for v in cfg[k]]
+        return cls(actor, **argv)
+
+    def reset(self, startTime=None):
+        """ Forget the fit, and start a new pumpdown at monotonic time startTime (default: the next sample). """
+
+        with self.lock:
+            self._reset(startTime)
+
+    def _reset(self, startTime=None):
+        nParams = 2 + len(self.taus)
+        self.startTime = startTime
+        self.theta = np.zeros(nParams)
+        self.P = np.eye(nParams) * 1e3
+        self.nSamples = 0
+        self.lastTime = None
+        self.lastPressure = None
+        self.lastReport = None
+
+    def features(self, t):
+        return np.array([1.0, math.log1p(t/self.t0)] + [math.exp(-t/tau) for tau in self.taus])
+
+    def model(self, t):
+        """ The fitted ln(pressure) at t seconds into the pumpdown. """
+
+        return float(self.features(t) @ self.theta)
+
+    def slope(self, t):
+        """ The fitted d ln(p)/dt at t seconds into the pumpdown. """
+
+        dx = np.array([0.0, 1/(self.t0 + t)] + [-math.exp(-t/tau)/tau for tau in self.taus])
+        return float(dx @ self.theta)
+
+    def putReading(self, name, reading):
+        """ ReadingCache listener: ingest any pressure we follow. """
+
+        convert = self.sources.get(name)
+        if convert is None:
+            return
+        try:
+            pressure = float(convert(reading.value))
+        except Exception:
+            return
+        if not pressure > 0 or not math.isfinite(pressure):
+            return
+
+        self.add(reading.stamp.mono, pressure)
+
+        if self.actor is not None and self.isReportDue(reading.stamp.mono):
+            self.genKeys(self.actor.bcast)
+
+    def add(self, now, pressure):
+        """ Update the fit with one pressure (Torr) sampled at monotonic time now. """
+
+        y = math.log(pressure)
+        with self.lock:
+            if self.startTime is None:
+                self.startTime = now
+            elif self.nSamples > 10 and pressure > 1.0 and y > self.model(now - self.startTime) + math.log(100):
+                # Way above the fit and no longer in high vacuum: a vent, or a new pumpdown.
+                self.logger.warning('pressure jumped to %g Torr: restarting pumpdown fit', pressure)
+                self._reset(startTime=now)
+
+            t = max(now - self.startTime, 0.0)
+            dt = 0.0 if self.lastTime is None else max(now - self.lastTime, 0.0)
+            lam = math.exp(-dt/self.memory)
+
+            x = self.features(t)
+            Px = self.P @ x
+            k = Px / (lam + x @ Px)
+            self.theta = self.theta + k * (y - x @ self.theta)
+            self.P = (self.P - np.outer(k, Px)) / lam
+            trace = np.trace(self.P)
+            if trace > self.maxCovariance:
+                self.P *= self.maxCovariance / trace
+
+            self.nSamples += 1
+            self.lastTime = now
+            self.lastPressure = pressure
+
+    def eta(self, threshold, horizon=30*86400.0):
+        """ Return the predicted seconds from the last sample until the pressure reaches threshold.
+
+        Returns 0 if we are already there, and inf if the fit does not get
+        there within horizon seconds.
+        """
+
+        with self.lock:
+            if self.lastTime is None:
+                return math.nan
+            now = self.lastTime - self.startTime
+            target = math.log(threshold)
+            if self.lastPressure <= threshold:
+                return 0.0
+
+            # Step out geometrically until we cross, then bisect.
+            t0 = now
+            step = 60.0
+            while True:
+                t1 = min(now + step, now + horizon)
+                if self.model(t1) <= target:
+                    break
+                if t1 >= now + horizon:
+                    return math.inf
+                t0 = t1
+                step *= 2
+            for i in range(40):
+                mid = (t0 + t1)/2
+                if self.model(mid) <= target:
+                    t1 = mid
+                else:
+                    t0 = mid
+            return t1 - now
+
+    def stallReason(self):
+        """ Return why the pumpdown looks stalled, or None. """
+
+        with self.lock:
+            if self.nSamples < 10:
+                return None
+            pressure = self.lastPressure
+            rate = self.slope(self.lastTime - self.startTime)
+
+        nextThresholds = [th for th in self.thresholds if th < pressure]
+        if not nextThresholds:
+            return None
+        if rate >= 0:
+            return f'pressure is not falling at {pressure:g} Torr'
+        decadeTime = math.log(10) / -rate
+        if decadeTime > self.stallDecadeTime:
+            return (f'pressure is falling by a decade every {decadeTime/3600:0.1f}h '
+                    f'at {pressure:g} Torr')
+        return None
+
+    def isReportDue(self, now):
+        with self.lock:
+            if self.lastReport is not None and now - self.lastReport < self.reportInterval:
+                return False
+            self.lastReport = now
+            return True
+
+    def genKeys(self, cmd):
+        if cmd is None or self.nSamples == 0:
+            return
+        for th in self.thresholds:
+            eta = self.eta(th)
+            cmd.inform('pumpdownEta=%g,%s' % (th, 'inf' if math.isinf(eta) else '%0.0f' % eta))
+        cmd.inform('pumpdownFit=%d,%g,%0.0f' % (self.nSamples, self.lastPressure,
+                                                self.lastTime - self.startTime))
+        reason = self.stallReason()
+        if reason is not None:
+            cmd.warn('pumpdownStall=%s' % (qstr(reason)))
@@ -0,0 +1,239 @@
+import contextlib
+import logging
+import threading
+import time
+
+from xcuActor import records
+
+class Stamp(object):
+    """ When a value was sampled: the middle of the device I/O which fetched it, and how long that I/O took. """
+
+    __slots__ = ('wall', 'mono', 'span')
+
+    def __init__(self, wall=None, mono=None, span=0.0):
+        self.wall = time.time() if wall is None else wall
+        self.mono = time.monotonic() if mono is None else mono
+        self.span = span
+
+    def __repr__(self):
+        return f'Stamp(wall={self.wall:0.3f}, span={self.span:0.3f})'
+
+@contextlib.contextmanager
+def sampling():
+    """ Stamp the device I/O in the enclosed block. Yields a Stamp, which is filled in on exit.
+
+        with readingCache.sampling() as stamp:
+            tipTemp = float(self.sendOneCommand('TC', cmd=cmd))
+    """
+
+    wall0 = time.time()
+    mono0 = time.monotonic()
+    stamp = Stamp(wall0, mono0)
+    yield stamp
+    span = time.monotonic() - mono0
+    stamp.span = span
+    stamp.wall = wall0 + span/2
+    stamp.mono = mono0 + span/2
+
+def sample(func, *args, **kwargs):
+    """ Return func(*args, **kwargs) and the Stamp of the call. """
+
+    with sampling() as stamp:
+        value = func(*args, **kwargs)
+    return value, stamp
+
+def spanning(stamps):
+    """ Return one Stamp covering all of stamps. """
+
+    start = min(s.mono - s.span/2 for s in stamps)
+    end = max(s.mono + s.span/2 for s in stamps)
+    wallOffset = stamps[0].wall - stamps[0].mono
+    mid = (start + end)/2
+    return Stamp(mid + wallOffset, mid, end - start)
+
+def rate(older, newer, index=None):
+    """ Return the rate of change per second between two Readings, using their acquisition times.
+
+    index selects one element of multi-valued readings.
+    """
+
+    v0, t0 = older.value, older.stampOf(index).mono
+    v1, t1 = newer.value, newer.stampOf(index).mono
+    if index is not None:
+        v0, v1 = v0[index], v1[index]
+    dt = t1 - t0
+    if dt <= 0:
+        raise ValueError(f'readings are not in time order (dt={dt:0.3f}s)')
+    return (v1 - v0)/dt
+
+class Reading(object):
+    """ One device reading, and when it was sampled.
+
+    stamp is the acquisition time of the whole reading. A reading made
+    of several values fetched with separate device transactions can also
+    carry one Stamp per value in stamps.
+    """
+
+    __slots__ = ('value', 'stamp', 'stamps')
+
+    def __init__(self, value, stamp=None, stamps=None):
+        self.value = value
+        self.stamps = None if stamps is None else tuple(stamps)
+        if stamp is None:
+            stamp = spanning(self.stamps) if self.stamps else Stamp()
+        self.stamp = stamp
+
+    @property
+    def timestamp(self):
+        return self.stamp.wall
+
+    @property
+    def mono(self):
+        return self.stamp.mono
+
+    @property
+    def age(self):
+        return time.monotonic() - self.stamp.mono
+
+    def stampOf(self, index=None):
+        """ Return the Stamp of one value, or of the whole reading. """
+
+        if index is None or self.stamps is None:
+            return self.stamp
+        return self.stamps[index]
+
+    def __str__(self):
+        return f'Reading({self.value!r}, age={self.age:0.3f})'
+
+class ReadingCache(object):
+    """ The last known value of every device reading we have cached, with its timestamp.
+
+    Readings are named by "<controller>.<reading>", e.g. "PCM.powerStatus".
+
+    Callers say how old a value they can live with: fetch(name, readFunc,
+    maxAge=0.5) returns the cached value if it was read no more than
+    0.5s ago, and otherwise calls readFunc() and caches the result. A
+    maxAge of 0 (the default) always reads the hardware, which is what
+    safety checks should ask for.
+
+    invalidate(name) after commanding a change. A fetch which was
+    already reading when the reading was invalidated returns what it
+    read, but does not cache it: it may be from before the change.
+
+    Functions added with addListener(func) are called as func(name,
+    reading) for every new reading, e.g. to publish it elsewhere.
+
+    If .emitTimes is set, controllers also generate <key>Time keys with
+    the acquisition time of each value in <key>.
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger('readings')
+        self.lock = threading.Lock()
+        self.readings = dict()
+        # Bumped by invalidate(), so that fetches which straddle it do not cache their values.
+        self.generations = dict()
+        self.epoch = 0
+        self.hits = 0
+        self.misses = 0
+        self.listeners = []
+        self.emitTimes = False
+
+    def addListener(self, func):
+        self.listeners.append(func)
+
+    def configure(self, actorConfig):
+        """ Take emitTimes from the optional "readings" config section. """
+
+        try:
+            self.emitTimes = bool(actorConfig['readings']['emitTimes'])
+        except Exception:
+            pass
+
+    def put(self, name, value, stamp=None, stamps=None, generation=None):
+        """ Cache a reading. If generation is given and the reading has been invalidated since, do not. """
+
+        # Records carry their own Stamp: take it if we were not given one, else give them ours.
+        isRecord = isinstance(value, records.Record)
+        if isRecord and stamp is None and stamps is None:
+            stamp = value.stamp
+        reading = Reading(value, stamp=stamp, stamps=stamps)
+        if isRecord and value.stamp is None:
+            value.stamp = reading.stamp
+        with self.lock:
+            if generation is not None and generation != self._generation(name):
+                self.logger.debug('not caching %s: invalidated while it was being read', name)
+                return None
+            self.readings[name] = reading
+        for func in self.listeners:
+            try:
+                func(name, reading)
+            except Exception as e:
+                self.logger.warning('reading listener failed for %s: %s', name, e)
+        return reading
+
+    def get(self, name, maxAge=None):
+        """ Return the cached Reading, or None if there is none or it is older than maxAge seconds. """
+
+        with self.lock:
+            reading = self.readings.get(name)
+        if reading is None:
+            return None
+        if maxAge is not None and reading.age > maxAge:
+            return None
+        return reading
+
+    def items(self):
+        """ Return a list of all (name, Reading) pairs. """
+
+        with self.lock:
+            return list(self.readings.items())
+
+    def _generation(self, name):
+        return self.epoch, self.generations.get(name, 0)
+
+    def invalidate(self, name=None):
+        """ Forget one reading, or all of them. Call after commanding a change. """
+
+        with self.lock:
+            if name is None:
+                self.readings.clear()
+                self.epoch += 1
+            else:
+                self.readings.pop(name, None)
+                self.generations[name] = self.generations.get(name, 0) + 1
+
+    def fetch(self, name, readFunc, maxAge=0.0):
+        """ Return the value of a reading no older than maxAge seconds, reading it if necessary. """
+
+        if maxAge > 0:
+            reading = self.get(name, maxAge=maxAge)
+            if reading is not None:
+                with self.lock:
+                    self.hits += 1
+                return reading.value
+
+        with self.lock:
+            self.misses += 1
+            generation = self._generation(name)
+        with sampling() as stamp:
+            value = readFunc()
+        self.put(name, value, stamp=stamp, generation=generation)
+        return value
+
+    def genTimesKey(self, cmd, key, name):
+        """ If emitTimes is set, generate <key>Time= with the acquisition times of reading name. """
+
+        if not self.emitTimes or cmd is None:
+            return
+        reading = self.get(name)
+        if reading is None:
+            return
+        stamps = reading.stamps if reading.stamps is not None else (reading.stamp,)
+        cmd.inform('%sTime=%s' % (key, ','.join(['%0.3f' % (s.wall) for s in stamps])))
+
+    def genKeys(self, cmd):
+        readings = self.items()
+        for name, reading in sorted(readings):
+            cmd.diag('text="reading %s: %0.3fs old"' % (name, reading.age))
+        cmd.inform('readingCache=%d,%d,%d' % (len(readings), self.hits, self.misses))
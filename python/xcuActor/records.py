@@ -0,0 +1,178 @@
+""" Typed, compact records for device readings.
+
+Each kind of reading is a small class with named fields, units, and
+the Stamp of the device I/O which produced it, instead of a positional
+list:
+
+    temps = cooler.getTemps(cmd=cmd)
+    temps.tipTemp, temps.units['tipTemp'], temps.stamp.wall
+
+Records are __slots__ objects, so they are cheap to make on every
+poll. They still iterate and index like the tuples they replace, so
+that "speed, status = turbo.speed()" keeps working.
+
+For series, a RecordBuffer is a preallocated numpy structured array
+(one field per record field, plus wall and mono times) which records
+are appended into without any per-sample allocation. toBytes() and
+fromBytes() give a fixed-size binary form.
+"""
+
+import struct
+
+from xcuActor.lazyImport import LazyModule
+np = LazyModule('numpy')
+
+class Record(object):
+    """ Base class. Subclasses only declare fields: (name, kind, unit) with kind 'f', 'i' or 's'. """
+
+    fields = ()
+    __slots__ = ('stamp',)
+
+    # Size of string fields, in the numpy and binary forms.
+    strSize = 16
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.names = tuple(f[0] for f in cls.fields)
+        cls.units = {f[0]: f[2] for f in cls.fields}
+        kinds = {'f': 'd', 'i': 'q', 's': f'{cls.strSize}s'}
+        cls._struct = struct.Struct('<' + ''.join(kinds[f[1]] for f in cls.fields) + 'dd')
+
+    def __init__(self, *values, stamp=None, **kwargs):
+        if len(values) + len(kwargs) != len(self.names):
+            raise TypeError(f'{type(self).__name__} takes {len(self.names)} values: {self.names}')
+        for name, value in zip(self.names, values):
+            setattr(self, name, value)
+        for name, value in kwargs.items():
+            setattr(self, name, value)
+        self.stamp = stamp
+
+    def __iter__(self):
+        return (getattr(self, name) for name in self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return tuple(self)[i]
+        return getattr(self, self.names[i])
+
+    def __repr__(self):
+        values = ', '.join(f'{n}={getattr(self, n)!r}' for n in self.names)
+        return f'{type(self).__name__}({values})'
+
+    def asdict(self):
+        return {name: getattr(self, name) for name in self.names}
+
+    def snapshotValues(self):
+        """ The numeric fields, for the shared-memory snapshot. """
+
+        return tuple(getattr(self, f[0]) for f in self.fields if f[1] != 's')
+
+    @classmethod
+    def dtype(cls):
+        kinds = {'f': 'f8', 'i': 'i8', 's': f'U{cls.strSize}'}
+        return np.dtype([(f[0], kinds[f[1]]) for f in cls.fields]
+                        + [('wall', 'f8'), ('mono', 'f8')])
+
+    def toBytes(self):
+        values = []
+        for name, kind, _ in self.fields:
+            v = getattr(self, name)
+            values.append(str(v).encode('latin-1') if kind == 's' else v)
+        stamp = self.stamp
+        return self._struct.pack(*values,
+                                 stamp.wall if stamp is not None else 0.0,
+                                 stamp.mono if stamp is not None else 0.0)
+
+    @classmethod
+    def fromBytes(cls, data):
+        from xcuActor.readingCache import Stamp
+
+        *values, wall, mono = cls._struct.unpack(data)
+        values = [v.rstrip(b'\0').decode('latin-1') if f[1] == 's' else v
+                  for f, v in zip(cls.fields, values)]
+        return cls(*values, stamp=Stamp(wall, mono))
+
+class RecordBuffer(object):
+    """ A preallocated ring of records of one class, as a numpy structured array. """
+
+    def __init__(self, recordClass, size):
+        self.recordClass = recordClass
+        self.size = size
+        self.data = np.zeros(size, dtype=recordClass.dtype())
+        self.n = 0
+
+    def __len__(self):
+        return min(self.n, self.size)
+
+    def append(self, record):
+        """ Copy record's fields into the next row, in place. """
+
+        row = self.data[self.n % self.size]
+        for name in self.recordClass.names:
+            row[name] = getattr(record, name)
+        if record.stamp is not None:
+            row['wall'] = record.stamp.wall
+            row['mono'] = record.stamp.mono
+        self.n += 1
+
+    def view(self):
+        """ Return the filled rows, oldest first. A view while the ring has not wrapped, else a copy. """
+
+        if self.n <= self.size:
+            return self.data[:self.n]
+        i = self.n % self.size
+        return np.concatenate((self.data[i:], self.data[:i]))
+
+class CoolerLoop(Record):
+    fields = (('mode', 's', ''), ('KP', 'f', ''), ('KI', 'f', ''), ('KD', 'f', ''))
+    __slots__ = tuple(f[0] for f in fields)
+
+class CoolerTemps(Record):
+    fields = (('setTemp', 'f', 'K'), ('rejectTemp', 'f', 'C'),
+              ('tipTemp', 'f', 'K'), ('power', 'f', 'W'))
+    __slots__ = tuple(f[0] for f in fields)
+
+class CoolerStatus(Record):
+    fields = CoolerLoop.fields + CoolerTemps.fields
+    __slots__ = tuple(f[0] for f in fields)
+
+class CoolerPower(Record):
+    fields = (('errorMask', 'i', ''), ('minPower', 'f', 'W'),
+              ('maxPower', 'f', 'W'), ('power', 'f', 'W'))
+    __slots__ = tuple(f[0] for f in fields)
+
+class PumpSpeed(Record):
+    fields = (('speed', 'i', 'rpm'), ('status', 'i', ''))
+    __slots__ = tuple(f[0] for f in fields)
+
+class PumpVAW(Record):
+    fields = (('voltage', 'f', 'V'), ('current', 'f', 'A'), ('power', 'f', 'W'))
+    __slots__ = tuple(f[0] for f in fields)
+
+class PumpTemps(Record):
+    fields = (('temp1', 'f', 'C'), ('temp2', 'f', 'C'))
+    __slots__ = tuple(f[0] for f in fields)
+
+class TurboStatus(Record):
+    fields = PumpSpeed.fields + PumpVAW.fields + PumpTemps.fields
+    __slots__ = tuple(f[0] for f in fields)
+
+class RoughStatus(Record):
+    fields = PumpSpeed.fields + PumpTemps.fields
+    __slots__ = tuple(f[0] for f in fields)
+
+class IonPump(Record):
+    fields = (('enabled', 'i', ''), ('voltage', 'f', 'V'), ('current', 'f', 'A'),
+              ('temp', 'f', 'C'), ('pressure', 'f', 'mbar'), ('errors', 'i', ''))
+    __slots__ = tuple(f[0] for f in fields)
+
+class Temps(Record):
+    fields = tuple((f'temp{i+1}', 'f', 'K') for i in range(12))
+    __slots__ = tuple(f[0] for f in fields)
+
+class LTemps(Record):
+    fields = tuple((f'temp{i+1}', 'f', 'K') for i in range(4))
+    __slots__ = tuple(f[0] for f in fields)
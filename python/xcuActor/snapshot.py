@@ -0,0 +1,257 @@
+""" A shared-memory snapshot of the latest device readings, for other processes on this host.
+
+The actor writes every reading which goes through its ReadingCache into
+a small fixed-layout file, by default /dev/shm/<actorName>.snapshot,
+which local consumers (GUIs, scripts, the readout side) can mmap and
+read without talking to the actor or touching the hardware:
+
+    from xcuActor import snapshot
+    reader = snapshot.SnapshotReader('/dev/shm/xcu_b1.snapshot')
+    readings = reader.read()
+    print(readings['PCM.pressure'].values, readings['PCM.pressure'].age)
+
+Layout (little-endian):
+
+  header, HEADER_SIZE bytes:
+    magic    8s   b'XCUSNAP1'
+    version  u32
+    nSlots   u32
+    slotSize u32
+    nUsed    u32
+    seq      u64  even when stable, odd while the writer is updating
+    wall     f64  time.time() of the last update
+
+  nSlots slots of slotSize bytes:
+    name     32s  "<controller>.<reading>", NUL-padded
+    nValues  u32
+    pad      u32
+    wall     f64  time.time() of the reading
+    mono     f64  time.monotonic() of the reading (CLOCK_MONOTONIC is host-wide)
+    values   MAX_VALUES x f64
+
+The writer bumps seq to odd, changes a slot, then bumps it to even
+again. A reader copies the whole file and keeps the copy only if it saw
+the same even seq before and after, so it always gets a consistent
+snapshot, usually on the first try. A slot is assigned to a reading the
+first time it is seen and keeps it until the actor restarts.
+
+Only this module's stdlib imports are needed to read a snapshot.
+"""
+
+import logging
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+
+MAGIC = b'XCUSNAP1'
+VERSION = 1
+MAX_VALUES = 16
+NAME_SIZE = 32
+
+HEADER = struct.Struct('<8sIIIIQd')
+HEADER_SIZE = 64
+SEQ_OFFSET = 24
+SEQ = struct.Struct('<Q')
+SLOT = struct.Struct(f'<{NAME_SIZE}sIIdd{MAX_VALUES}d')
+
+def snapshotValues(value):
+    """ Return a reading as a tuple of floats, or None if it cannot be published.
+
+    Numbers and sequences of numbers are published as they are. Other
+    objects can define snapshotValues() to say how to publish themselves.
+    """
+
+    if hasattr(value, 'snapshotValues'):
+        value = value.snapshotValues()
+    if isinstance(value, (bool, int, float)):
+        return (float(value),)
+    if isinstance(value, (list, tuple)):
+        ret = []
+        for v in value[:MAX_VALUES]:
+            try:
+                ret.append(float(v))
+            except (TypeError, ValueError):
+                ret.append(math.nan)
+        return tuple(ret)
+    return None
+
+class SnapshotWriter(object):
+    """ The actor's side: owns the file and updates slots as readings come in.
+
+    Args
+    ----
+    path : `str`
+      the file to create. Any existing file is reset.
+    nSlots : `int`
+      how many distinct readings can be published.
+    """
+
+    def __init__(self, path, nSlots=256):
+        self.logger = logging.getLogger('snapshot')
+        self.path = path
+        self.nSlots = nSlots
+        self.lock = threading.Lock()
+        self.slots = dict()
+        self.seq = 0
+        self.dropped = set()
+
+        size = HEADER_SIZE + nSlots * SLOT.size
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(fd, 0)
+            os.ftruncate(fd, size)
+            self.mm = mmap.mmap(fd, size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        finally:
+            os.close(fd)
+
+        HEADER.pack_into(self.mm, 0, MAGIC, VERSION, nSlots, SLOT.size, 0, self.seq, time.time())
+
+    @classmethod
+    def fromConfig(cls, actor):
+        """ Create the actor's writer, from the optional "snapshot" config section.
+
+        Returns None if the snapshot is disabled or the file cannot be created.
+        """
+
+        try:
+            cfg = dict(actor.actorConfig['snapshot'])
+        except Exception:
+            cfg = dict()
+        if not cfg.get('enabled', True):
+            return None
+
+        path = cfg.get('path', f'/dev/shm/{actor.name}.snapshot')
+        try:
+            return cls(path, nSlots=int(cfg.get('nSlots', 256)))
+        except OSError as e:
+            logging.getLogger('snapshot').warning('cannot create snapshot file %s: %s', path, e)
+            return None
+
+    def _slotFor(self, name):
+        slot = self.slots.get(name)
+        if slot is None:
+            if len(self.slots) >= self.nSlots:
+                if name not in self.dropped:
+                    self.dropped.add(name)
+                    self.logger.warning('no snapshot slot left for %s', name)
+                return None
+            slot = len(self.slots)
+            self.slots[name] = slot
+        return slot
+
+    def update(self, name, values, wall, mono):
+        """ Publish one reading's values (a sequence of floats). """
+
+        values = tuple(values)[:MAX_VALUES]
+        padded = values + (math.nan,) * (MAX_VALUES - len(values))
+        with self.lock:
+            slot = self._slotFor(name)
+            if slot is None:
+                return
+            offset = HEADER_SIZE + slot * SLOT.size
+
+            self.seq += 1
+            SEQ.pack_into(self.mm, SEQ_OFFSET, self.seq)
+            SLOT.pack_into(self.mm, offset, name.encode('latin-1')[:NAME_SIZE],
+                           len(values), 0, wall, mono, *padded)
+            HEADER.pack_into(self.mm, 0, MAGIC, VERSION, self.nSlots, SLOT.size,
+                             len(self.slots), self.seq, time.time())
+            self.seq += 1
+            SEQ.pack_into(self.mm, SEQ_OFFSET, self.seq)
+
+    def putReading(self, name, reading):
+        """ ReadingCache listener: publish a cached reading, if it is numeric. """
+
+        values = snapshotValues(reading.value)
+        if values is None:
+            return
+        self.update(name, values, reading.timestamp, reading.mono)
+
+    def close(self):
+        self.mm.close()
+
+class SnapshotReading(object):
+    """ One published reading, as seen by a reader. """
+
+    __slots__ = ('name', 'values', 'timestamp', 'mono')
+
+    def __init__(self, name, values, timestamp, mono):
+        self.name = name
+        self.values = values
+        self.timestamp = timestamp
+        self.mono = mono
+
+    @property
+    def value(self):
+        """ The first (often the only) value. """
+        return self.values[0] if self.values else math.nan
+
+    @property
+    def age(self):
+        return time.monotonic() - self.mono
+
+    def __str__(self):
+        return f'{self.name}={self.values} age={self.age:0.3f}'
+
+class SnapshotReader(object):
+    """ The consumer's side: maps the file read-only and returns consistent snapshots. """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, mmap.MAP_SHARED, mmap.PROT_READ)
+
+        magic, version, self.nSlots, self.slotSize, _, _, _ = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or version != VERSION or self.slotSize != SLOT.size:
+            raise ValueError(f'{path} is not a version {VERSION} xcu snapshot')
+
+    def readRaw(self, maxTries=1000):
+        """ Return a consistent copy of the header and used slots, as bytes. """
+
+        for i in range(maxTries):
+            seq1, = SEQ.unpack_from(self.mm, SEQ_OFFSET)
+            if seq1 & 1:
+                continue
+            nUsed = HEADER.unpack_from(self.mm, 0)[4]
+            buf = self.mm[:HEADER_SIZE + nUsed * SLOT.size]
+            seq2, = SEQ.unpack_from(self.mm, SEQ_OFFSET)
+            if seq1 == seq2:
+                return buf
+        raise RuntimeError(f'could not get a consistent snapshot of {self.path} in {maxTries} tries')
+
+    def read(self):
+        """ Return a dict of all published readings, by name. """
+
+        buf = self.readRaw()
+        nUsed = HEADER.unpack_from(buf, 0)[4]
+        readings = dict()
+        for i in range(nUsed):
+            name, nValues, _, wall, mono, *values = SLOT.unpack_from(buf, HEADER_SIZE + i * SLOT.size)
+            name = name.rstrip(b'\0').decode('latin-1')
+            readings[name] = SnapshotReading(name, tuple(values[:nValues]), wall, mono)
+        return readings
+
+    def get(self, name):
+        """ Return one reading, or None if it has not been published. """
+
+        return self.read().get(name)
+
+    def close(self):
+        self.mm.close()
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description='print the readings published by an xcu actor')
+    parser.add_argument('path', help='the snapshot file, e.g. /dev/shm/xcu_b1.snapshot')
+    args = parser.parse_args(argv)
+
+    reader = SnapshotReader(args.path)
+    for name, reading in sorted(reader.read().items()):
+        print(reading)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+""" Measure where actor startup time goes. """
+
+import cProfile
+import io
+import logging
+import os
+import pstats
+import time
+
+def processAge():
+    """ Return how many seconds ago this process was started, or 0.0 if we cannot tell. """
+
+    try:
+        with open('/proc/self/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, IndexError, ValueError):
+        return 0.0
+
+    # starttime is field 22; we dropped the first two.
+    startTicks = int(fields[19])
+    return max(0.0, uptime - startTicks / os.sysconf('SC_CLK_TCK'))
+
+class StartupProfile(object):
+    """ Record named startup milestones, and optionally a full cProfile of startup.
+
+    Milestone times are seconds since the process was started. The
+    profile, if enabled, runs from construction until finish() is
+    called, which we do when the first command has been served.
+    """
+
+    def __init__(self, t0=None, doProfile=False):
+        now = time.monotonic()
+        if t0 is None:
+            t0 = now
+        self.t0 = now - processAge()
+        self.marks = [('interpreter', t0 - self.t0)]
+        self.done = False
+        self.logger = logging.getLogger('startup')
+
+        self.profiler = None
+        if doProfile:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def mark(self, name):
+        """ Record that we have reached milestone name, if we have not already. """
+
+        if self.done or name in {n for n, _ in self.marks}:
+            return
+        self.marks.append((name, time.monotonic() - self.t0))
+
+    def getKey(self):
+        return 'startupProfile=%s' % ','.join(['%s,%0.3f' % (n, t) for n, t in self.marks])
+
+    def finish(self, cmd=None, dumpPath=None, nLines=30):
+        """ Stop recording, and report. """
+
+        if self.done:
+            return
+        self.done = True
+
+        key = self.getKey()
+        self.logger.warning(key)
+        if cmd is not None:
+            cmd.inform(key)
+
+        if self.profiler is None:
+            return
+
+        self.profiler.disable()
+        if dumpPath is not None:
+            self.profiler.dump_stats(dumpPath)
+            self.logger.warning('startup profile written to %s', dumpPath)
+        out = io.StringIO()
+        stats = pstats.Stats(self.profiler, stream=out)
+        stats.sort_stats('cumulative').print_stats(nLines)
+        self.logger.warning('startup profile:\n%s', out.getvalue())
+        self.profiler = None
@@ -0,0 +1,20 @@
+""" Cheap time conversions, so that we do not need astropy on the hot path. """
+
+import time
+
+# MJD of the POSIX epoch, 1970-01-01T00:00:00 UTC.
+MJD_UNIX_EPOCH = 40587.0
+
+def unixToMjd(t):
+    """ Convert a POSIX timestamp to a UTC MJD.
+
+    Like POSIX time, this ignores leap seconds, which is what
+    astropy's Time.now().mjd gives us in practice.
+    """
+
+    return MJD_UNIX_EPOCH + t / 86400.0
+
+def mjdNow():
+    """ Return the current UTC MJD. """
+
+    return unixToMjd(time.time())
@@ -0,0 +1,202 @@
+""" Keep an eye on device transactions and commands which might hang.
+
+Every device transaction and every command is registered with the
+actor's Watchdog while it runs, with its thread and start time. A
+background thread checks them: anything running longer than its bound
+generates a warning keyword and has its thread's stack dumped to the
+log. If a stuck device transaction has a closer (a function which
+closes its socket or serial port), the watchdog calls it once the
+activity has run for closeFactor times its bound, which unblocks the
+thread with an error. "watchdog close <id>" does the same by hand.
+
+Bounds and the rest come from the optional "watchdog" section of the
+actor configuration: period, deviceBound, commandBound, closeFactor,
+and autoClose. A controller section can override deviceBound with
+watchdogBound.
+"""
+
+import contextlib
+import itertools
+import logging
+import socket
+import sys
+import threading
+import time
+import traceback
+
+from opscore.utility.qstr import qstr
+
+class Activity(object):
+    """ One device transaction or command in progress. """
+
+    def __init__(self, id, kind, name, bound, closer=None):
+        self.id = id
+        self.kind = kind
+        self.name = name
+        self.bound = bound
+        self.closer = closer
+        self.thread = threading.current_thread()
+        self.startTime = time.time()
+
+        self.warned = False
+        self.closed = False
+
+    @property
+    def age(self):
+        return time.time() - self.startTime
+
+    def getKey(self):
+        return 'watchdog=%d,%s,%s,%s,%0.1f,%0.1f' % (self.id, self.kind, qstr(self.name),
+                                                    qstr(self.thread.name),
+                                                    self.age, self.bound)
+
+    def stack(self):
+        frame = sys._current_frames().get(self.thread.ident)
+        if frame is None:
+            return 'no stack: thread is gone'
+        return ''.join(traceback.format_stack(frame))
+
+class Watchdog(object):
+    def __init__(self, actor, period=1.0, deviceBound=10.0, commandBound=120.0,
+                 closeFactor=3.0, autoClose=True):
+        self.actor = actor
+        self.logger = logging.getLogger('watchdog')
+
+        self.period = period
+        self.deviceBound = deviceBound
+        self.commandBound = commandBound
+        self.closeFactor = closeFactor
+        self.autoClose = autoClose
+        self.configure()
+
+        self.lock = threading.Lock()
+        self.activities = dict()
+        self.ids = itertools.count(1)
+
+        self.thread = threading.Thread(target=self._loop, name='watchdog', daemon=True)
+        self.thread.start()
+
+    def configure(self):
+        """ Take any settings from the watchdog section of the actor config. """
+
+        try:
+            cfg = self.actor.actorConfig['watchdog']
+        except Exception:
+            return
+        for k in 'period', 'deviceBound', 'commandBound', 'closeFactor':
+            if k in cfg:
+                setattr(self, k, float(cfg[k]))
+        if 'autoClose' in cfg:
+            self.autoClose = bool(cfg['autoClose'])
+
+    def boundFor(self, controller):
+        try:
+            return float(self.actor.actorConfig[controller]['watchdogBound'])
+        except Exception:
+            return self.deviceBound
+
+    @contextlib.contextmanager
+    def track(self, name, bound=None, closer=None, kind='device'):
+        """ Register the enclosed block as a running activity.
+
+        Args
+        ----
+        name : `str`
+          what is running: a controller name or a command.
+        bound : `float`
+          seconds after which we complain. Defaults to deviceBound or
+          commandBound, depending on kind.
+        closer : callable
+          called with no arguments to unblock a stuck device transaction.
+        kind : {'device', 'command'}
+        """
+
+        if bound is None:
+            bound = self.boundFor(name) if kind == 'device' else self.commandBound
+        with self.lock:
+            activity = Activity(next(self.ids), kind, name, bound, closer=closer)
+            self.activities[activity.id] = activity
+        try:
+            yield activity
+        finally:
+            with self.lock:
+                self.activities.pop(activity.id, None)
+            if activity.warned:
+                self.logger.warning('%s %s finished after %0.1fs', kind, name, activity.age)
+
+    def _bcast(self):
+        return getattr(self.actor, 'bcast', None)
+
+    def _loop(self):
+        while True:
+            time.sleep(self.period)
+            try:
+                self.check()
+            except Exception as e:
+                self.logger.warning('watchdog check failed: %s', e)
+
+    def check(self):
+        with self.lock:
+            activities = list(self.activities.values())
+
+        for a in activities:
+            age = a.age
+            if age > a.bound and not a.warned:
+                a.warned = True
+                self.logger.warning('%s %s in thread %s stuck for %0.1fs; stack:\n%s',
+                                    a.kind, a.name, a.thread.name, age, a.stack())
+                bcast = self._bcast()
+                if bcast is not None:
+                    bcast.warn(a.getKey())
+            if (self.autoClose and a.closer is not None and not a.closed
+                    and age > a.bound * self.closeFactor):
+                self.forceClose(a)
+
+    def forceClose(self, activity, cmd=None):
+        """ Close the device under a stuck activity, so that its thread gets an error. """
+
+        if cmd is None:
+            cmd = self._bcast()
+        if activity.closer is None:
+            raise RuntimeError(f'activity {activity.id} ({activity.name}) cannot be closed')
+
+        activity.closed = True
+        self.logger.warning('force-closing %s %s after %0.1fs', activity.kind,
+                            activity.name, activity.age)
+        if cmd is not None:
+            cmd.warn('text=%s' % (qstr(f'force-closing {activity.name} after {activity.age:0.1f}s')))
+        try:
+            activity.closer()
+        except Exception as e:
+            self.logger.warning('failed to close %s: %s', activity.name, e)
+
+    def close(self, id, cmd=None):
+        with self.lock:
+            activity = self.activities.get(id)
+        if activity is None:
+            raise KeyError(f'no running activity {id}')
+        self.forceClose(activity, cmd=cmd)
+
+    def genKeys(self, cmd):
+        with self.lock:
+            activities = list(self.activities.values())
+        for a in activities:
+            cmdFunc = cmd.warn if a.age > a.bound else cmd.inform
+            cmdFunc(a.getKey())
+        cmd.inform('watchdogActive=%d' % (len(activities)))
+
+def track(actor, name, bound=None, closer=None, kind='device'):
+    """ Track an activity with the actor's watchdog, if it has one. """
+
+    watchdog = getattr(actor, 'watchdog', None)
+    if watchdog is None:
+        return contextlib.nullcontext()
+    return watchdog.track(name, bound=bound, closer=closer, kind=kind)
+
+def shutdownSocket(s):
+    """ Close a socket so that a thread blocked on it wakes up. A plain close() does not do that. """
+
+    try:
+        s.shutdown(socket.SHUT_RDWR)
+    finally:
+        s.close()
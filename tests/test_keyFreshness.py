@@ -0,0 +1,49 @@
+import types
+
+from xcuActor import keyFreshness
+
+class FakeKeyVar(object):
+    def __init__(self):
+        self.isCurrent = True
+        self.callbacks = []
+
+    def addCallback(self, func, callNow=False):
+        self.callbacks.append(func)
+
+    def update(self, isCurrent=True):
+        self.isCurrent = isCurrent
+        for func in self.callbacks:
+            func(self)
+
+def makeFreshness(keyNames):
+    keyVars = {k: FakeKeyVar() for k in keyNames}
+    model = types.SimpleNamespace(keyVarDict=keyVars)
+    actor = types.SimpleNamespace(models=dict(rough1=model), addModels=None)
+    return keyFreshness.KeyFreshness(actor), keyVars
+
+def test_updatedKeysAreFresh():
+    freshness, keyVars = makeFreshness(('pumpSpeed', 'pumpErrors'))
+    freshness.watch('rough1', ('pumpSpeed', 'pumpErrors'))
+    assert not freshness.isFresh('rough1', ('pumpSpeed', 'pumpErrors'), maxAge=5)
+
+    for keyVar in keyVars.values():
+        keyVar.update()
+    assert freshness.isFresh('rough1', ('pumpSpeed', 'pumpErrors'), maxAge=5)
+
+def test_notCurrentCallbackForcesRefresh():
+    freshness, keyVars = makeFreshness(('pumpSpeed', 'pumpErrors'))
+    freshness.watch('rough1', ('pumpSpeed', 'pumpErrors'))
+    for keyVar in keyVars.values():
+        keyVar.update()
+
+    # e.g. the rough actor disconnected.
+    keyVars['pumpErrors'].update(isCurrent=False)
+    assert not freshness.isFresh('rough1', ('pumpSpeed', 'pumpErrors'), maxAge=5)
+
+def test_keyMarkedNotCurrentWithoutCallbackIsStale():
+    freshness, keyVars = makeFreshness(('pumpSpeed',))
+    freshness.watch('rough1', ('pumpSpeed',))
+    keyVars['pumpSpeed'].update()
+
+    keyVars['pumpSpeed'].isCurrent = False
+    assert not freshness.isFresh('rough1', ('pumpSpeed',), maxAge=5)
@@ -0,0 +1,38 @@
+from xcuActor import readingCache
+
+def test_fetchCachesAndHits():
+    cache = readingCache.ReadingCache()
+    reads = []
+
+    def read():
+        reads.append(1)
+        return len(reads)
+
+    assert cache.fetch('PCM.powerStatus', read, maxAge=10) == 1
+    assert cache.fetch('PCM.powerStatus', read, maxAge=10) == 1
+    assert cache.fetch('PCM.powerStatus', read, maxAge=0) == 2
+    assert (cache.hits, cache.misses) == (1, 2)
+
+def test_readStraddlingInvalidateIsNotCached():
+    cache = readingCache.ReadingCache()
+
+    def readDuringChange():
+        # e.g. a ~se is sent, and the cache invalidated, while this ~ge is in flight.
+        cache.invalidate('PCM.powerStatus')
+        return 'old'
+
+    assert cache.fetch('PCM.powerStatus', readDuringChange) == 'old'
+    assert cache.get('PCM.powerStatus') is None
+
+    assert cache.fetch('PCM.powerStatus', lambda: 'new') == 'new'
+    assert cache.get('PCM.powerStatus').value == 'new'
+
+def test_invalidateAllStopsCaching():
+    cache = readingCache.ReadingCache()
+
+    def readDuringReset():
+        cache.invalidate()
+        return 'old'
+
+    cache.fetch('temps.temps', readDuringReset)
+    assert cache.get('temps.temps') is None
@@ -0,0 +1,56 @@
+import math
+
+import pytest
+
+from xcuActor import records
+from xcuActor import readingCache
+
+def test_recordActsLikeTuple():
+    speed = records.PumpSpeed(1200, 3)
+    s, status = speed
+    assert (s, status) == (1200, 3)
+    assert speed[0] == speed.speed == 1200
+    assert len(speed) == 2
+    assert speed.units['speed'] == 'rpm'
+
+def test_wrongNumberOfValues():
+    with pytest.raises(TypeError):
+        records.PumpSpeed(1200)
+
+def test_bytesRoundTrip():
+    stamp = readingCache.Stamp(1700000000.25, 1234.5)
+    loop = records.CoolerLoop('POWER', 1.5, 0.25, 0.0, stamp=stamp)
+
+    data = loop.toBytes()
+    assert len(data) == records.CoolerLoop._struct.size
+
+    back = records.CoolerLoop.fromBytes(data)
+    assert tuple(back) == tuple(loop)
+    assert back.stamp.wall == stamp.wall
+    assert back.stamp.mono == stamp.mono
+
+def test_bytesKeepNaN():
+    temps = records.LTemps(80.0, math.nan, 82.5, 83.0)
+    back = records.LTemps.fromBytes(temps.toBytes())
+    assert back.temp1 == 80.0
+    assert math.isnan(back.temp2)
+
+def test_recordBufferAppendsAndWraps():
+    np = pytest.importorskip('numpy')
+
+    buf = records.RecordBuffer(records.PumpSpeed, 3)
+    for i in range(5):
+        buf.append(records.PumpSpeed(i*100, i, stamp=readingCache.Stamp(1000.0 + i, float(i))))
+
+    assert len(buf) == 3
+    rows = buf.view()
+    assert list(rows['speed']) == [200, 300, 400]
+    assert list(rows['mono']) == [2.0, 3.0, 4.0]
+    assert rows.dtype == records.PumpSpeed.dtype()
+
+def test_recordBufferViewDoesNotCopyBeforeWrapping():
+    np = pytest.importorskip('numpy')
+
+    buf = records.RecordBuffer(records.PumpTemps, 4)
+    buf.append(records.PumpTemps(20.0, 21.0))
+    assert np.shares_memory(buf.view(), buf.data)
@@ -0,0 +1,82 @@
+import threading
+import time
+
+from xcuActor import deadline
+from xcuActor.Controllers import singleFlight
+
+def startCall(flights, key, func, results, budget=None):
+    """ Call flights.do(key, func) in a thread, within budget seconds, appending what comes of it to results. """
+
+    def call():
+        try:
+            with deadline.within(budget, name='test'):
+                results.append(flights.do(key, func))
+        except Exception as e:
+            results.append(e)
+
+    t = threading.Thread(target=call)
+    t.start()
+    return t
+
+def waitUntil(testFunc, timeLimit=5.0):
+    endTime = time.monotonic() + timeLimit
+    while not testFunc():
+        assert time.monotonic() < endTime
+        time.sleep(0.001)
+
+def hasFollower(flights, key):
+    with flights.lock:
+        flight = flights.flights.get(key)
+        return flight is not None and flight.followers > 0
+
+def runPair(flights, leaderFunc, followerFunc, leaderBudget=None):
+    """ Run a leader and one follower for the same key. Return (leaderResult, followerResult). """
+
+    release = threading.Event()
+    leaderResults = []
+    followerResults = []
+
+    def lead():
+        release.wait(5)
+        return leaderFunc()
+
+    leader = startCall(flights, 'ge', lead, leaderResults, budget=leaderBudget)
+    waitUntil(lambda: 'ge' in flights.flights)
+    follower = startCall(flights, 'ge', followerFunc, followerResults)
+    waitUntil(lambda: hasFollower(flights, 'ge'))
+    release.set()
+    leader.join(5)
+    follower.join(5)
+
+    return leaderResults[0], followerResults[0]
+
+def test_followerGetsLeadersResult():
+    flights = singleFlight.SingleFlight('test')
+
+    assert runPair(flights, lambda: 'answer', lambda: 'unused') == ('answer', 'answer')
+    assert (flights.calls, flights.saved) == (2, 1)
+
+def test_followerGetsItsOwnCopyOfADeviceError():
+    flights = singleFlight.SingleFlight('test')
+
+    def fail():
+        raise OSError('no route to host')
+
+    leaderError, followerError = runPair(flights, fail, lambda: 'unused')
+
+    assert isinstance(followerError, OSError)
+    assert followerError is not leaderError
+    assert followerError.args == leaderError.args
+
+def test_followerRetriesWhenTheLeaderRunsOutOfTime():
+    flights = singleFlight.SingleFlight('test')
+
+    def outOfTime():
+        raise deadline.current().exceeded('test', 'ge')
+
+    leaderError, followerResult = runPair(flights, outOfTime, lambda: 'answer',
+                                          leaderBudget=60)
+
+    assert isinstance(leaderError, deadline.DeadlineExceeded)
+    assert followerResult == 'answer'
+    assert (flights.calls, flights.saved) == (2, 0)